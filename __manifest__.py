@@ -1,6 +1,6 @@
 {
     'name': 'Certificación SII Chile',
-    'version': '1.0',
+    'version': '1.1',
     'category': 'Accounting/Localization/Chile',
     'summary': 'Herramientas para facilitar el proceso de certificación con el SII en Chile',
     'description': """
@@ -37,6 +37,7 @@
         'wizard/certification_reset_wizard_view.xml',
         'wizard/iecv_generator_wizard_view.xml',
         'data/l10n_cl_edi_certification_data.xml',
+        'data/ir_cron_data.xml',
         'data/certification_partners.xml',
         'data/certification_export_partners.xml',
         'data/certification_purchase_partners.xml',
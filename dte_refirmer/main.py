@@ -1,3 +1,8 @@
+import glob
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import click
 from lxml import etree
 from datetime import datetime, timedelta
@@ -6,11 +11,13 @@ from datetime import datetime, timedelta
 from dte_refirmer.parsers.xml_parser import XMLParser
 from dte_refirmer.parsers.dte_extractor import DTEExtractor
 from dte_refirmer.cleaners.signature_cleaner import SignatureCleaner
-from dte_refirmer.utils.caf_manager import CAFManager
+from dte_refirmer.utils.caf_manager import CAFManager, DEFAULT_INDEX_FILENAME
 from dte_refirmer.signers.ted_resigner import TEDResigner
 from dte_refirmer.signers.dte_resigner import DTEResigner
+from dte_refirmer.signers.signing_context import SigningContext
 from dte_refirmer.signers.setdte_resigner import SetDTEResigner
 from dte_refirmer.validators.signature_validator import SignatureValidator
+from dte_refirmer.validators.structure_validator import StructureValidator
 
 def update_dte_data_interactive(dte_element, namespaces):
     """Función interactiva para actualizar fecha y folio de un DTE."""
@@ -52,8 +59,9 @@ def update_dte_data_interactive(dte_element, namespaces):
         doc_element.set('ID', new_id)
         click.echo(f"  - Folio actualizado a: {nuevo_folio} (ID: {new_id})")
 
-def update_dte_data_non_interactive(dte_element, namespaces):
+def update_dte_data_non_interactive(dte_element, namespaces, verbose=True):
     """Función NO interactiva para actualizar fecha y mantener folio."""
+    echo = click.echo if verbose else (lambda *args, **kwargs: None)
     today = datetime.now()
     today_str = today.strftime('%Y-%m-%d')
     
@@ -65,20 +73,20 @@ def update_dte_data_non_interactive(dte_element, namespaces):
     tipo_dte = id_doc.find('ns:TipoDTE', namespaces).text
     folio_actual = id_doc.find('ns:Folio', namespaces).text
 
-    click.echo("-" * 40)
-    click.echo(f"Procesando DTE Tipo: {click.style(tipo_dte, bold=True)}, Folio: {click.style(folio_actual, bold=True)} (modo no interactivo)")
+    echo("-" * 40)
+    echo(f"Procesando DTE Tipo: {click.style(tipo_dte, bold=True)}, Folio: {click.style(folio_actual, bold=True)} (modo no interactivo)")
 
     # Actualizar Fecha Emisión
     id_doc.find('ns:FchEmis', namespaces).text = today_str
     dd.find('ns:FE', namespaces).text = today_str
-    click.echo(f"  - Fecha de Emisión actualizada a: {today_str}")
-    click.echo(f"  - Folio conservado: {folio_actual}")
+    echo(f"  - Fecha de Emisión actualizada a: {today_str}")
+    echo(f"  - Folio conservado: {folio_actual}")
 
     # Actualizar Fecha de Vencimiento (30 días después de la fecha de emisión)
     fch_venc_element = id_doc.find('ns:FchVenc', namespaces)
     if fch_venc_element is not None:
         fch_venc_element.text = (today + timedelta(days=30)).strftime('%Y-%m-%d')
-        click.echo(f"  - Fecha de Vencimiento actualizada a: {fch_venc_element.text}")
+        echo(f"  - Fecha de Vencimiento actualizada a: {fch_venc_element.text}")
 
 @click.group()
 def cli():
@@ -92,7 +100,8 @@ def cli():
 @click.option('--cert', required=True, type=click.Path(exists=True), help='Ruta al certificado digital (.pfx).')
 @click.option('--cert-password', required=True, help='Contraseña del certificado digital.')
 @click.option('--non-interactive', is_flag=True, default=False, help='Ejecuta en modo no interactivo, actualizando fechas y manteniendo folios originales.')
-def resign(input, output, caf_folder, cert, cert_password, non_interactive):
+@click.option('--caf-index', type=click.Path(dir_okay=False), default=None, help='Ruta al índice de CAFs (por defecto <caf-folder>/.caf_index.json).')
+def resign(input, output, caf_folder, cert, cert_password, non_interactive, caf_index):
     """
     Re-firma un SetDTE completo, actualizando fechas y (opcionalmente) folios.
     """
@@ -103,57 +112,12 @@ def resign(input, output, caf_folder, cert, cert_password, non_interactive):
 
     try:
         click.echo("Cargando claves CAF...")
-        caf_manager = CAFManager(caf_folder)
-        click.echo(f"{len(caf_manager.key_map)} tipos de CAF cargados exitosamente.")
-
-        click.echo("Parseando XML de entrada...")
-        parser = XMLParser(input)
-        parser.parse()
-        
-        click.echo("Limpiando firmas existentes...")
-        cleaner = SignatureCleaner(parser.root, parser.namespaces)
-        cleaner.clean_all_signatures()
-
-        ted_resigner = TEDResigner(caf_manager)
-        dte_resigner = DTEResigner(cert, cert_password, parser.namespaces)
-        resigned_dtes = []
-        
-        for dte_element in parser.get_dte_elements():
-            # If the DTE element is an Exportaciones, rename it to Documento for compliance
-            if dte_element.tag == etree.QName(parser.namespaces['ns'], 'Exportaciones'):
-                dte_element.tag = etree.QName(parser.namespaces['ns'], 'Documento')
-                click.echo(f"  - Elemento <Exportaciones> renombrado a <Documento> para cumplimiento de esquema.")
-
-            if non_interactive:
-                update_dte_data_non_interactive(dte_element, parser.namespaces)
-            else:
-                update_dte_data_interactive(dte_element, parser.namespaces)
-
-            extractor = DTEExtractor(dte_element, parser.namespaces)
-            dte_data = extractor.extract_document_structure()
-            ted_data = extractor.extract_ted_data()
+        caf_manager = CAFManager(caf_folder, index_path=caf_index)
+        click.echo(f"{caf_manager.caf_count} CAFs cargados exitosamente para {len(caf_manager.cafs)} combinaciones de emisor y tipo de DTE.")
 
-            new_ted = ted_resigner.resign_ted(ted_data['dd_element'], parser.namespaces)
-            new_dte = dte_resigner.resign_dte(dte_data, new_ted)
-            resigned_dtes.append(new_dte)
-
-        click.echo("-" * 40)
-        click.echo("Firmando el SetDTE consolidado...")
-        setdte_resigner = SetDTEResigner(cert, cert_password, parser.namespaces)
-        final_envelope = setdte_resigner.resign_setdte(
-            parser.get_envelope_structure(),
-            parser.get_caratula(),
-            resigned_dtes
-        )
-
-        click.echo(f"Guardando XML re-firmado en: {output}")
-        xml_declaration = '<?xml version="1.0" encoding="ISO-8859-1"?>'
-        final_xml_bytes = etree.tostring(final_envelope, encoding='ISO-8859-1', xml_declaration=False, pretty_print=True)
-        
-        with open(output, 'wb') as f:
-            f.write(xml_declaration.encode('ISO-8859-1'))
-            f.write(b'\n')
-            f.write(final_xml_bytes)
+        signing_context = SigningContext.from_pfx(cert, cert_password)
+        resign_envelope_file(input, output, caf_manager, cert, cert_password, signing_context,
+                             non_interactive=non_interactive)
 
         click.secho(f"\nProceso completado exitosamente!", fg='green')
         click.secho(f"Archivo guardado en: {output}", fg='cyan')
@@ -163,20 +127,277 @@ def resign(input, output, caf_folder, cert, cert_password, non_interactive):
         import traceback
         click.secho(traceback.format_exc(), fg='yellow', err=True)
 
-@cli.command()
-@click.option('--input', required=True, type=click.Path(exists=True), help='Ruta al archivo XML firmado que se desea verificar.')
-def verify(input):
-    """Verifica la integridad de las firmas de un archivo EnvioDTE usando xmlsec."""
-    click.echo(f"Verificando firmas para el archivo: {input}")
+def resign_envelope_file(input, output, caf_manager, cert, cert_password, signing_context,
+                         non_interactive=False, verbose=True):
+    """
+    Re-firma un archivo EnvioDTE completo usando un CAFManager y un SigningContext ya cargados.
+    Retorna la cantidad de DTEs re-firmados.
+    """
+    echo = click.echo if verbose else (lambda *args, **kwargs: None)
+
+    echo("Parseando XML de entrada...")
+    parser = XMLParser(input)
+    parser.parse()
+
+    echo("Limpiando firmas existentes...")
+    cleaner = SignatureCleaner(parser.root, parser.namespaces)
+    cleaner.clean_all_signatures()
+
+    ted_resigner = TEDResigner(caf_manager)
+    dte_resigner = DTEResigner(cert, cert_password, parser.namespaces, context=signing_context)
+    resigned_dtes = []
+
+    for dte_element in parser.get_dte_elements():
+        # If the DTE element is an Exportaciones, rename it to Documento for compliance
+        if dte_element.tag == etree.QName(parser.namespaces['ns'], 'Exportaciones'):
+            dte_element.tag = etree.QName(parser.namespaces['ns'], 'Documento')
+            echo(f"  - Elemento <Exportaciones> renombrado a <Documento> para cumplimiento de esquema.")
+
+        if non_interactive:
+            update_dte_data_non_interactive(dte_element, parser.namespaces, verbose=verbose)
+        else:
+            update_dte_data_interactive(dte_element, parser.namespaces)
+
+        extractor = DTEExtractor(dte_element, parser.namespaces)
+        dte_data = extractor.extract_document_structure()
+        ted_data = extractor.extract_ted_data()
+
+        new_ted = ted_resigner.resign_ted(ted_data['dd_element'], parser.namespaces)
+        new_dte = dte_resigner.resign_dte(dte_data, new_ted)
+        resigned_dtes.append(new_dte)
+
+    echo("-" * 40)
+    echo("Firmando el SetDTE consolidado...")
+    setdte_resigner = SetDTEResigner(cert, cert_password, parser.namespaces, signer=dte_resigner)
+    final_envelope = setdte_resigner.resign_setdte(
+        parser.get_envelope_structure(),
+        parser.get_caratula(),
+        resigned_dtes
+    )
+
+    echo(f"Guardando XML re-firmado en: {output}")
+    xml_declaration = '<?xml version="1.0" encoding="ISO-8859-1"?>'
+    final_xml_bytes = etree.tostring(final_envelope, encoding='ISO-8859-1', xml_declaration=False, pretty_print=True)
+
+    with open(output, 'wb') as f:
+        f.write(xml_declaration.encode('ISO-8859-1'))
+        f.write(b'\n')
+        f.write(final_xml_bytes)
+
+    return len(resigned_dtes)
+
+def collect_input_files(inputs):
+    """Expande directorios (archivos *.xml) y patrones glob a una lista ordenada de archivos."""
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            files.extend(glob.glob(os.path.join(pattern, '*.xml')))
+        else:
+            files.extend(glob.glob(pattern))
+    return sorted({os.path.abspath(path) for path in files if os.path.isfile(path)})
+
+@cli.command('resign-batch')
+@click.argument('inputs', nargs=-1, required=True)
+@click.option('--output-dir', required=True, type=click.Path(file_okay=False), help='Carpeta donde guardar los XML re-firmados (mismo nombre de archivo).')
+@click.option('--caf-folder', required=True, type=click.Path(exists=True), help='Ruta a la carpeta con todos los archivos CAF.')
+@click.option('--cert', required=True, type=click.Path(exists=True), help='Ruta al certificado digital (.pfx).')
+@click.option('--cert-password', required=True, help='Contraseña del certificado digital.')
+@click.option('--caf-index', type=click.Path(dir_okay=False), default=None, help='Ruta al índice de CAFs (por defecto <caf-folder>/.caf_index.json).')
+@click.option('--jobs', type=click.IntRange(min=1), default=min(4, os.cpu_count() or 1), show_default=True, help='Cantidad de archivos a procesar en paralelo.')
+def resign_batch(inputs, output_dir, caf_folder, cert, cert_password, caf_index, jobs):
+    """
+    Re-firma en modo no interactivo todos los EnvioDTE de uno o más directorios o patrones glob,
+    cargando el certificado y los CAFs una sola vez.
+    """
+    files = collect_input_files(inputs)
+    if not files:
+        click.secho("No se encontraron archivos XML para procesar.", fg='red', err=True)
+        raise SystemExit(1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = {path: os.path.join(output_dir, os.path.basename(path)) for path in files}
+    if len(set(output_paths.values())) != len(files):
+        click.secho("Hay archivos de entrada con el mismo nombre; no se pueden guardar en la misma carpeta.", fg='red', err=True)
+        raise SystemExit(1)
+
     try:
-        validator = SignatureValidator(input)
-        validator.verify_all()
-        click.secho("\nVERIFICACIÓN EXITOSA: Todas las firmas XMLDSig son correctas y coinciden con los datos.", fg='green', bold=True)
+        caf_manager = CAFManager(caf_folder, index_path=caf_index)
+        signing_context = SigningContext.from_pfx(cert, cert_password)
+    except Exception as e:
+        click.secho(f"\nError cargando CAFs o certificado: {e}", fg='red', err=True)
+        raise SystemExit(1)
+
+    click.echo(f"{caf_manager.caf_count} CAFs y certificado cargados. Re-firmando {len(files)} archivos con {jobs} workers...")
+
+    def process(path):
+        start = time.monotonic()
+        try:
+            dte_count = resign_envelope_file(path, output_paths[path], caf_manager, cert, cert_password, signing_context,
+                                             non_interactive=True, verbose=False)
+            return path, dte_count, None, time.monotonic() - start
+        except Exception as e:
+            return path, 0, str(e), time.monotonic() - start
 
+    failed = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for path, dte_count, error, elapsed in executor.map(process, files):
+            name = os.path.basename(path)
+            if error:
+                failed += 1
+                click.secho(f"  ✗ {name}: {error} ({elapsed:.2f}s)", fg='red')
+            else:
+                click.secho(f"  ✓ {name}: {dte_count} DTEs ({elapsed:.2f}s)", fg='green')
+
+    click.echo("-" * 40)
+    click.secho(f"{len(files) - failed}/{len(files)} archivos re-firmados en: {output_dir}",
+                fg='green' if not failed else 'yellow')
+    if failed:
+        raise SystemExit(1)
+
+@cli.command('caf-index')
+@click.option('--caf-folder', required=True, type=click.Path(exists=True, file_okay=False), help='Ruta a la carpeta con todos los archivos CAF.')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Ruta del índice a generar (por defecto <caf-folder>/.caf_index.json).')
+@click.option('--rebuild', is_flag=True, default=False, help='Ignora el índice existente y re-parsea todos los archivos.')
+def caf_index(caf_folder, output, rebuild):
+    """Construye (o actualiza) el índice persistente de CAFs usado por 'resign'."""
+    index_path = output or os.path.join(caf_folder, DEFAULT_INDEX_FILENAME)
+    if rebuild and os.path.exists(index_path):
+        os.remove(index_path)
+
+    try:
+        caf_manager = CAFManager(caf_folder, index_path=index_path)
     except Exception as e:
-        click.secho(f"\nERROR DE VALIDACIÓN: {e}", fg='red', err=True)
-        import traceback
-        click.secho(traceback.format_exc(), fg='yellow', err=True)
+        click.secho(f"\nError construyendo el índice de CAFs: {e}", fg='red', err=True)
+        raise SystemExit(1)
+
+    for entry in caf_manager.iter_entries():
+        click.echo(f"  TD {entry.dte_type:>3}  folios {entry.desde:>8}-{entry.hasta:<8}  RE {entry.rut_emisor}  FA {entry.fecha_autorizacion}  {entry.path}")
+
+    stats = caf_manager.index.stats
+    click.secho(
+        f"\nÍndice guardado en: {index_path} ({caf_manager.caf_count} CAFs, "
+        f"{stats['parsed']} parseados, {stats['reused']} reutilizados)",
+        fg='green'
+    )
+
+# Códigos de salida de 'verify' y 'validate'
+EXIT_OK = 0
+EXIT_INVALID_SIGNATURES = 1  # verify: alguna firma (TED, DTE o SetDoc) no es válida
+EXIT_INVALID_STRUCTURE = 3   # validate: algún archivo viola el XSD del SII
+EXIT_PROCESSING_ERROR = 2    # algún archivo no se pudo leer o procesar
+
+@cli.command()
+@click.option('--input', 'inputs', required=True, multiple=True, type=click.Path(exists=True), help='Ruta al archivo XML firmado que se desea verificar (se puede repetir).')
+@click.option('--jobs', type=click.IntRange(min=1), default=1, show_default=True, help='Cantidad de DTEs a verificar en paralelo.')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Imprime el resultado estructurado en JSON (stdout).')
+@click.option('--report', type=click.Path(dir_okay=False), default=None, help='Guarda el resultado estructurado en un archivo JSON.')
+def verify(inputs, jobs, as_json, report):
+    """
+    Verifica la integridad de las firmas (TED, DTE y SetDoc) de uno o más archivos EnvioDTE.
+
+    Código de salida: 0 si todas las firmas son válidas, 1 si alguna firma es inválida,
+    2 si algún archivo no se pudo procesar.
+    """
+    file_results = []
+    exit_code = EXIT_OK
+    for input in inputs:
+        if not as_json:
+            click.echo(f"Verificando firmas para el archivo: {input}")
+        try:
+            result = SignatureValidator(input).verify_report(jobs=jobs)
+        except Exception as e:
+            exit_code = EXIT_PROCESSING_ERROR
+            file_results.append({'path': input, 'passed': False, 'error': str(e), 'error_type': e.__class__.__name__})
+            if not as_json:
+                click.secho(f"\nERROR DE VALIDACIÓN: {e}", fg='red', err=True)
+            continue
+
+        file_results.append(result.to_dict())
+        if not result.passed and exit_code == EXIT_OK:
+            exit_code = EXIT_INVALID_SIGNATURES
+
+        if not as_json:
+            for check in result.checks:
+                if check.passed:
+                    click.secho(f"  ✓ {check.kind:<6} {check.target} ({check.duration_ms:.1f} ms)", fg='green')
+                else:
+                    click.secho(f"  ✗ {check.kind:<6} {check.target}: {check.error}", fg='red')
+            failed = result.failed_checks
+            if failed:
+                click.secho(f"\nVERIFICACIÓN FALLIDA: {len(failed)} de {len(result.checks)} firmas no son válidas.", fg='red', bold=True)
+            else:
+                click.secho("\nVERIFICACIÓN EXITOSA: Todas las firmas XMLDSig son correctas y coinciden con los datos.", fg='green', bold=True)
+
+    output = {
+        'passed': exit_code == EXIT_OK,
+        'exit_code': exit_code,
+        'files': file_results,
+    }
+    if report:
+        with open(report, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    if as_json:
+        click.echo(json.dumps(output, ensure_ascii=False, indent=2))
+
+    raise SystemExit(exit_code)
+
+
+@cli.command()
+@click.argument('inputs', nargs=-1, required=True)
+@click.option('--schema-dir', type=click.Path(exists=True, file_okay=False), default=None, help='Carpeta con los XSD del SII (por defecto docs/ del repositorio).')
+@click.option('--jobs', type=click.IntRange(min=1), default=1, show_default=True, help='Cantidad de procesos para validar archivos en paralelo.')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Imprime el resultado estructurado en JSON (stdout).')
+@click.option('--report', type=click.Path(dir_okay=False), default=None, help='Guarda el resultado estructurado en un archivo JSON.')
+@click.option('--quiet', is_flag=True, default=False, help='Muestra solo los archivos que no son válidos.')
+def validate(inputs, schema_dir, jobs, as_json, report, quiet):
+    """
+    Valida uno o más archivos EnvioDTE/LibroCV/LibroGuia (archivos, directorios o patrones glob)
+    contra los XSD del SII, sin conexión.
+
+    Código de salida: 0 si todos son válidos, 3 si alguno viola el esquema,
+    2 si algún archivo no se pudo validar.
+    """
+    files = collect_input_files(inputs)
+    if not files:
+        click.secho("No se encontraron archivos XML para validar.", fg='red', err=True)
+        raise SystemExit(EXIT_PROCESSING_ERROR)
+
+    start = time.monotonic()
+    results = []
+    for result in StructureValidator(schema_dir).validate_files(files, jobs=jobs):
+        results.append(result)
+        if as_json or (quiet and result.valid):
+            continue
+        name = os.path.basename(result.path)
+        if result.valid:
+            click.secho(f"  ✓ {name} ({result.schema}, {result.duration_ms:.1f} ms)", fg='green')
+        else:
+            click.secho(f"  ✗ {name} ({result.schema or result.document_type or '?'}): {len(result.errors)} errores", fg='red')
+            for error in result.errors:
+                click.echo(f"      {error}")
+
+    invalid = sum(1 for result in results if result.status == 'invalid')
+    errors = sum(1 for result in results if result.status == 'error')
+    exit_code = EXIT_PROCESSING_ERROR if errors else EXIT_INVALID_STRUCTURE if invalid else EXIT_OK
+
+    output = {
+        'passed': exit_code == EXIT_OK,
+        'exit_code': exit_code,
+        'summary': {'files': len(results), 'valid': len(results) - invalid - errors, 'invalid': invalid, 'error': errors},
+        'files': [result.to_dict() for result in results],
+    }
+    if report:
+        with open(report, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    if as_json:
+        click.echo(json.dumps(output, ensure_ascii=False, indent=2))
+    else:
+        click.echo("-" * 40)
+        click.secho(f"{len(results) - invalid - errors}/{len(results)} archivos válidos según XSD "
+                    f"({invalid} inválidos, {errors} con error) en {time.monotonic() - start:.2f}s",
+                    fg='green' if exit_code == EXIT_OK else 'red')
+
+    raise SystemExit(exit_code)
 
 
 if __name__ == '__main__':
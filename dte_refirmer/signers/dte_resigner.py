@@ -1,38 +1,30 @@
 import base64
 from lxml import etree
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives.serialization import pkcs12
 
 from dte_refirmer.cleaners.xml_normalizer import canonicalize_c14n
+from dte_refirmer.signers.signing_context import SigningContext
 
 class DTEResigner:
     """
     Re-construye y re-firma un DTE individual con una firma XMLDSig.
+
+    Si se entrega un `context` (SigningContext) ya cargado, no se vuelve a leer el PFX;
+    así todos los firmadores de una ejecución comparten un único certificado.
     """
-    def __init__(self, cert_path: str, cert_password: str, namespaces: dict):
+    def __init__(self, cert_path: str, cert_password: str, namespaces: dict, context: SigningContext = None):
         self.cert_path = cert_path
-        self.cert_password = cert_password.encode('utf-8')
         self.namespaces = namespaces
         self.ds_ns = {'ds': 'http://www.w3.org/2000/09/xmldsig#'}
-        self._load_certificate()
+        self.context = context or SigningContext.from_pfx(cert_path, cert_password)
+
+    @property
+    def private_key(self):
+        return self.context.private_key
 
-    def _load_certificate(self):
-        """Carga el archivo PFX y extrae los componentes."""
-        try:
-            with open(self.cert_path, 'rb') as f:
-                pfx_data = f.read()
-            
-            self.private_key, self.public_cert, _ = pkcs12.load_key_and_certificates(
-                pfx_data,
-                self.cert_password
-            )
-        except ValueError as e:
-            if "MAC verify failed" in str(e) or "decryption failed" in str(e):
-                raise ValueError("La contraseña del certificado PFX es incorrecta.")
-            raise e
-        except Exception as e:
-            raise RuntimeError(f"No se pudo cargar el certificado PFX desde {self.cert_path}: {e}")
+    @property
+    def public_cert(self):
+        return self.context.public_cert
 
     def resign_dte(self, dte_data: dict, new_ted: etree._Element) -> etree._Element:
         """
@@ -79,12 +71,7 @@ class DTEResigner:
         digest_value_el.text = digest_value
 
         c14n_signed_info = canonicalize_c14n(signed_info)
-        private_key = self.private_key
-        signature_value_b64 = base64.b64encode(private_key.sign(
-            c14n_signed_info,
-            padding.PKCS1v15(),
-            hashes.SHA1()
-        )).decode('ascii')
+        signature_value_b64 = self.context.sign(c14n_signed_info)
 
         sig_value_element = etree.SubElement(signature, etree.QName(self.ds_ns['ds'], 'SignatureValue'))
         sig_value_element.text = signature_value_b64
@@ -93,26 +80,4 @@ class DTEResigner:
         return signature
 
     def _build_key_info(self) -> etree._Element:
-        from cryptography.hazmat.primitives import serialization
-        public_numbers = self.private_key.public_key().public_numbers()
-        modulus_b64 = base64.b64encode(public_numbers.n.to_bytes(
-            (public_numbers.n.bit_length() + 7) // 8, 'big')).decode('ascii')
-        exponent_b64 = base64.b64encode(public_numbers.e.to_bytes(
-            (public_numbers.e.bit_length() + 7) // 8, 'big')).decode('ascii')
-
-        cert_bytes = self.public_cert.public_bytes(serialization.Encoding.PEM)
-        cert_b64 = "".join(line for line in cert_bytes.decode('ascii').split('\n') if not line.startswith('---'))
-
-        key_info = etree.Element(etree.QName(self.ds_ns['ds'], 'KeyInfo'))
-        key_value = etree.SubElement(key_info, etree.QName(self.ds_ns['ds'], 'KeyValue'))
-        rsa_key_value = etree.SubElement(key_value, etree.QName(self.ds_ns['ds'], 'RSAKeyValue'))
-        modulus = etree.SubElement(rsa_key_value, etree.QName(self.ds_ns['ds'], 'Modulus'))
-        modulus.text = modulus_b64
-        exponent = etree.SubElement(rsa_key_value, etree.QName(self.ds_ns['ds'], 'Exponent'))
-        exponent.text = exponent_b64
-
-        x509_data = etree.SubElement(key_info, etree.QName(self.ds_ns['ds'], 'X509Data'))
-        x509_cert = etree.SubElement(x509_data, etree.QName(self.ds_ns['ds'], 'X509Certificate'))
-        x509_cert.text = cert_b64
-
-        return key_info
\ No newline at end of file
+        return self.context.new_key_info()
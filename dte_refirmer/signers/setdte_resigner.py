@@ -3,14 +3,16 @@ from typing import List
 from datetime import datetime
 
 from dte_refirmer.signers.dte_resigner import DTEResigner # Reutilizamos la lógica de firma
+from dte_refirmer.signers.signing_context import SigningContext
 
 class SetDTEResigner:
     """
     Re-construye el EnvioDTE y firma el SetDTE consolidado.
     """
-    def __init__(self, cert_path: str, cert_password: str, namespaces: dict):
-        # La firma del SetDTE usa el mismo certificado que los DTEs individuales
-        self.signer = DTEResigner(cert_path, cert_password, namespaces)
+    def __init__(self, cert_path: str, cert_password: str, namespaces: dict, signer: DTEResigner = None,
+                 context: SigningContext = None):
+        # La firma del SetDTE usa el mismo certificado (y KeyInfo) que los DTEs individuales
+        self.signer = signer or DTEResigner(cert_path, cert_password, namespaces, context=context)
         self.namespaces = namespaces
 
     def resign_setdte(self, envelope_data: dict, caratula: etree._Element, signed_dtes: List[etree._Element]) -> etree._Element:
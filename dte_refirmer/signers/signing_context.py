@@ -0,0 +1,80 @@
+import base64
+import threading
+from copy import deepcopy
+from lxml import etree
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+DS_NS = 'http://www.w3.org/2000/09/xmldsig#'
+
+
+class SigningContext:
+    """
+    Certificado de firma cargado una sola vez y compartido por todos los firmadores.
+
+    Descifra el PFX una vez y precalcula el subárbol KeyInfo (módulo, exponente y
+    certificado X509 en base64); cada firma recibe una copia de ese subárbol en lugar
+    de volver a serializar la clave y el certificado.
+    """
+    def __init__(self, private_key, public_cert):
+        self.private_key = private_key
+        self.public_cert = public_cert
+        self._key_info = self._build_key_info()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_pfx(cls, cert_path: str, cert_password: str) -> 'SigningContext':
+        """Carga el archivo PFX y extrae los componentes."""
+        try:
+            with open(cert_path, 'rb') as f:
+                pfx_data = f.read()
+
+            private_key, public_cert, _ = pkcs12.load_key_and_certificates(
+                pfx_data,
+                cert_password.encode('utf-8')
+            )
+        except ValueError as e:
+            if "MAC verify failed" in str(e) or "decryption failed" in str(e):
+                raise ValueError("La contraseña del certificado PFX es incorrecta.")
+            raise e
+        except Exception as e:
+            raise RuntimeError(f"No se pudo cargar el certificado PFX desde {cert_path}: {e}")
+        return cls(private_key, public_cert)
+
+    def sign(self, data: bytes) -> str:
+        """Firma RSA-SHA1 (PKCS#1 v1.5) en base64."""
+        return base64.b64encode(self.private_key.sign(
+            data,
+            padding.PKCS1v15(),
+            hashes.SHA1()
+        )).decode('ascii')
+
+    def new_key_info(self) -> etree._Element:
+        """Copia del KeyInfo precalculado para insertar en una nueva firma."""
+        with self._lock:
+            return deepcopy(self._key_info)
+
+    def _build_key_info(self) -> etree._Element:
+        public_numbers = self.private_key.public_key().public_numbers()
+        modulus_b64 = base64.b64encode(public_numbers.n.to_bytes(
+            (public_numbers.n.bit_length() + 7) // 8, 'big')).decode('ascii')
+        exponent_b64 = base64.b64encode(public_numbers.e.to_bytes(
+            (public_numbers.e.bit_length() + 7) // 8, 'big')).decode('ascii')
+
+        cert_bytes = self.public_cert.public_bytes(serialization.Encoding.PEM)
+        cert_b64 = "".join(line for line in cert_bytes.decode('ascii').split('\n') if not line.startswith('---'))
+
+        key_info = etree.Element(etree.QName(DS_NS, 'KeyInfo'))
+        key_value = etree.SubElement(key_info, etree.QName(DS_NS, 'KeyValue'))
+        rsa_key_value = etree.SubElement(key_value, etree.QName(DS_NS, 'RSAKeyValue'))
+        modulus = etree.SubElement(rsa_key_value, etree.QName(DS_NS, 'Modulus'))
+        modulus.text = modulus_b64
+        exponent = etree.SubElement(rsa_key_value, etree.QName(DS_NS, 'Exponent'))
+        exponent.text = exponent_b64
+
+        x509_data = etree.SubElement(key_info, etree.QName(DS_NS, 'X509Data'))
+        x509_cert = etree.SubElement(x509_data, etree.QName(DS_NS, 'X509Certificate'))
+        x509_cert.text = cert_b64
+
+        return key_info
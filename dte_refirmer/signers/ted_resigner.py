@@ -1,4 +1,5 @@
 import base64
+from copy import deepcopy
 from datetime import datetime
 from lxml import etree
 from cryptography.hazmat.primitives import hashes
@@ -27,10 +28,13 @@ class TEDResigner:
             tsted_element = etree.SubElement(dd_element, 'TSTED')
             tsted_element.text = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
 
-        # 2. Generar la nueva firma FRMT
+        # 2. Usar el CAF que autoriza el folio (puede ser otro si el set cruza varios CAF)
+        self._replace_caf_if_needed(dd_element, namespaces)
+
+        # 3. Generar la nueva firma FRMT
         frmt_signature = self._generate_frmt_signature(dd_element, namespaces)
 
-        # 3. Construir el nuevo elemento TED
+        # 4. Construir el nuevo elemento TED
         new_ted = etree.Element('TED', version='1.0')
         new_ted.append(dd_element)
         
@@ -39,18 +43,55 @@ class TEDResigner:
 
         return new_ted
 
-    def _generate_frmt_signature(self, dd_element: etree._Element, namespaces: dict) -> str:
-        """
-        Genera la firma FRMT siguiendo el algoritmo específico del SII.
-        """
-        # Obtener el tipo de DTE desde el propio elemento DD
+    def _get_caf_key(self, dd_element: etree._Element, namespaces: dict):
+        """Obtiene el RUT emisor (RE), el tipo de DTE (TD) y el folio (F) desde el propio elemento DD."""
+        rut_element = dd_element.find('ns:RE', namespaces)
+        if rut_element is None or not rut_element.text:
+            raise ValueError("El elemento DD no contiene el RUT Emisor (RE).")
         dte_type_element = dd_element.find('ns:TD', namespaces)
         if dte_type_element is None or not dte_type_element.text:
             raise ValueError("El elemento DD no contiene el Tipo de DTE (TD).")
-        dte_type = int(dte_type_element.text)
+        folio_element = dd_element.find('ns:F', namespaces)
+        if folio_element is None or not folio_element.text:
+            raise ValueError("El elemento DD no contiene el Folio (F).")
+        return rut_element.text, int(dte_type_element.text), int(folio_element.text)
+
+    def _replace_caf_if_needed(self, dd_element: etree._Element, namespaces: dict):
+        """
+        Reemplaza el CAF embebido en el DD si su rango no cubre el folio actual,
+        usando el CAF cargado que sí lo autoriza.
+        """
+        caf_entry = self.caf_manager.get_caf_for_folio(*self._get_caf_key(dd_element, namespaces))
 
-        # Obtener la clave privada correcta para este tipo de DTE
-        private_key = self.caf_manager.get_key_for_dte_type(dte_type)
+        current_caf = dd_element.find('ns:CAF', namespaces)
+        if current_caf is not None:
+            desde = current_caf.find('ns:DA/ns:RNG/ns:D', namespaces)
+            hasta = current_caf.find('ns:DA/ns:RNG/ns:H', namespaces)
+            if (desde is not None and hasta is not None
+                    and (int(desde.text), int(hasta.text)) == (caf_entry.desde, caf_entry.hasta)):
+                return
+
+        # Copiar el CAF del archivo al namespace del DTE
+        new_caf = deepcopy(caf_entry.caf_element)
+        for element in new_caf.iter(tag=etree.Element):
+            element.tag = etree.QName(namespaces['ns'], etree.QName(element).localname)
+        etree.cleanup_namespaces(new_caf)
+
+        if current_caf is not None:
+            dd_element.replace(current_caf, new_caf)
+        else:
+            tsted_element = dd_element.find('ns:TSTED', namespaces)
+            if tsted_element is not None:
+                tsted_element.addprevious(new_caf)
+            else:
+                dd_element.append(new_caf)
+
+    def _generate_frmt_signature(self, dd_element: etree._Element, namespaces: dict) -> str:
+        """
+        Genera la firma FRMT siguiendo el algoritmo específico del SII.
+        """
+        # Obtener la clave privada del CAF que autoriza este folio del emisor
+        private_key = self.caf_manager.get_key_for_folio(*self._get_caf_key(dd_element, namespaces))
 
         # 1. Aplanar el XML del DD
         flattened_dd = flatten_xml_for_ted(dd_element)
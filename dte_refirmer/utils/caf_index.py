@@ -0,0 +1,87 @@
+
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+
+class CAFIndex:
+    """
+    Índice persistente de CAFs ya parseados (un único archivo JSON por directorio).
+
+    Por cada archivo guarda TD, rango D..H, RE, FA, el elemento CAF y la clave PEM,
+    junto con mtime, tamaño y SHA-1 del archivo fuente. Una ejecución solo re-parsea
+    los archivos cuyo contenido cambió: si cambia el mtime pero no el hash, la entrada
+    se reutiliza sin volver a parsear el XML.
+    """
+    VERSION = 2
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.entries: Dict[str, dict] = {}
+        self._dirty = False
+        self.stats = {'reused': 0, 'parsed': 0}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get('version') == self.VERSION:
+            self.entries = data.get('entries', {})
+
+    @staticmethod
+    def _file_hash(file_path: str) -> str:
+        with open(file_path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def get(self, file_path: str) -> Optional[dict]:
+        """Datos indexados del archivo, o None si no existen o el contenido cambió."""
+        entry = self.entries.get(file_path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(file_path)
+            if [stat.st_mtime_ns, stat.st_size] != entry['signature']:
+                if stat.st_size != entry['signature'][1] or self._file_hash(file_path) != entry['sha1']:
+                    return None
+                # Mismo contenido con otro mtime (copia, checkout): actualizar la firma
+                entry['signature'] = [stat.st_mtime_ns, stat.st_size]
+                self._dirty = True
+        except OSError:
+            return None
+        self.stats['reused'] += 1
+        return entry['data']
+
+    def put(self, file_path: str, data: dict):
+        """Guarda los datos parseados del archivo ({} para archivos que no son CAF)."""
+        stat = os.stat(file_path)
+        self.entries[file_path] = {
+            'signature': [stat.st_mtime_ns, stat.st_size],
+            'sha1': self._file_hash(file_path),
+            'data': data,
+        }
+        self.stats['parsed'] += 1
+        self._dirty = True
+
+    def prune(self, seen_paths):
+        """Elimina del índice los archivos que ya no existen en el directorio."""
+        for file_path in set(self.entries) - set(seen_paths):
+            del self.entries[file_path]
+            self._dirty = True
+
+    def save(self):
+        """Escribe el índice en disco de forma atómica (solo si hubo cambios)."""
+        if not self._dirty:
+            return
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.VERSION, 'entries': self.entries}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+        except OSError:
+            # El índice es opcional: si no se puede escribir, se sigue sin él
+            pass
@@ -1,61 +1,197 @@
 
 import os
+from bisect import bisect_right
+from functools import cached_property
 from lxml import etree
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
 from cryptography.hazmat.primitives.asymmetric import rsa
 
+from dte_refirmer.utils.caf_index import CAFIndex
+
+DEFAULT_INDEX_FILENAME = '.caf_index.json'
+
+
+def normalize_rut(rut: str) -> str:
+    """Normaliza un RUT para compararlo (sin puntos ni espacios, DV en mayúscula)."""
+    return (rut or '').replace('.', '').strip().upper()
+
+
+class CAFEntry:
+    """
+    Un archivo CAF cargado: tipo, rango de folios autorizado y su clave privada.
+    La clave y el elemento CAF se materializan solo cuando se usan por primera vez.
+    """
+    def __init__(self, dte_type: int, desde: int, hasta: int, rut_emisor: str, fecha_autorizacion: str,
+                 key_pem: str, caf_xml: str, path: str):
+        self.dte_type = dte_type
+        self.desde = desde
+        self.hasta = hasta
+        self.rut_emisor = rut_emisor
+        self.fecha_autorizacion = fecha_autorizacion
+        self.key_pem = key_pem
+        self.caf_xml = caf_xml
+        self.path = path
+
+    @cached_property
+    def private_key(self) -> rsa.RSAPrivateKey:
+        return load_pem_private_key(self.key_pem.encode('ascii'), password=None)
+
+    @cached_property
+    def caf_element(self) -> etree._Element:
+        return etree.fromstring(self.caf_xml)
+
+    def to_data(self) -> dict:
+        return {
+            'dte_type': self.dte_type,
+            'desde': self.desde,
+            'hasta': self.hasta,
+            'rut_emisor': self.rut_emisor,
+            'fecha_autorizacion': self.fecha_autorizacion,
+            'key_pem': self.key_pem,
+            'caf_xml': self.caf_xml,
+        }
+
+
 class CAFManager:
     """
     Escanea un directorio de archivos CAF, los carga en memoria y proporciona
-    la clave privada correcta para un tipo de DTE específico.
+    la clave privada del CAF cuyo rango (RNG D..H) cubre un folio de un tipo de DTE
+    de un emisor.
+
+    Los CAF de cada emisor (RE) y tipo (TD) se indexan por rango en una lista ordenada,
+    de modo que la búsqueda de (emisor, tipo, folio) es O(log n); el directorio puede
+    contener CAFs de varias empresas con rangos que se repiten. Los datos parseados se guardan en un índice
+    persistente (ver CAFIndex), así una nueva ejecución solo re-parsea archivos modificados.
     """
-    def __init__(self, caf_folder_path: str):
+    def __init__(self, caf_folder_path: str, index_path: Optional[str] = None, use_index: bool = True):
         if not os.path.isdir(caf_folder_path):
             raise FileNotFoundError(f"El directorio de CAFs especificado no existe: {caf_folder_path}")
         self.caf_folder_path = caf_folder_path
-        self.key_map: Dict[int, rsa.RSAPrivateKey] = {}
+        self.cafs: Dict[Tuple[str, int], List[CAFEntry]] = {}
+        self._starts: Dict[Tuple[str, int], List[int]] = {}
+        self.index = None
+        if use_index:
+            self.index = CAFIndex(index_path or os.path.join(caf_folder_path, DEFAULT_INDEX_FILENAME))
         self._load_all_cafs()
 
+    @property
+    def caf_count(self) -> int:
+        return sum(len(entries) for entries in self.cafs.values())
+
     def _load_all_cafs(self):
-        """Escanea el directorio y sus subdirectorios para cargar todas las claves privadas de los CAF."""
+        """Escanea el directorio y sus subdirectorios para cargar todos los CAF con su rango y clave privada."""
+        seen_paths = []
         for root, _, files in os.walk(self.caf_folder_path):
-            for filename in files:
+            for filename in sorted(files):
                 # Procesar solo archivos XML
                 if filename.lower().endswith('.xml'):
-                    file_path = os.path.join(root, filename)
-                    try:
-                        parser = etree.XMLParser(remove_blank_text=True, recover=True)
-                        tree = etree.parse(file_path, parser)
-                        xml_root = tree.getroot()
-
-                        # Extraer el tipo de DTE (TD)
-                        td_element = xml_root.find('.//DA/TD')
-                        if td_element is None or not td_element.text:
-                            continue # Archivo no parece ser un CAF válido, lo saltamos
-                        dte_type = int(td_element.text)
-
-                        # Extraer la clave privada de la etiqueta RSASK
-                        rsask_element = xml_root.find('RSASK')
-                        if rsask_element is None or not rsask_element.text:
-                            continue # No se encontró la clave privada, saltamos
-                        
-                        key_pem = rsask_element.text.strip().encode('utf-8')
-                        private_key = load_pem_private_key(key_pem, password=None)
-                        
-                        # Guardar la clave en el mapa
-                        self.key_map[dte_type] = private_key
-
-                    except (etree.XMLSyntaxError, ValueError, TypeError):
-                        # Ignorar archivos que no se puedan parsear o no tengan el formato esperado
-                        continue
-        
-        if not self.key_map:
+                    file_path = os.path.abspath(os.path.join(root, filename))
+                    seen_paths.append(file_path)
+                    entry = self._load_caf_file_indexed(file_path)
+                    if entry is not None:
+                        self.cafs.setdefault((normalize_rut(entry.rut_emisor), entry.dte_type), []).append(entry)
+
+        if self.index is not None:
+            self.index.prune(seen_paths)
+            self.index.save()
+
+        if not self.cafs:
             raise RuntimeError(f"No se pudo cargar ninguna clave CAF válida desde el directorio: {self.caf_folder_path}")
 
-    def get_key_for_dte_type(self, dte_type: int) -> rsa.RSAPrivateKey:
-        """Retorna la clave privada para un tipo de DTE dado."""
-        key = self.key_map.get(dte_type)
-        if key is None:
-            raise ValueError(f"No se encontró un archivo CAF con su clave privada para el Tipo de DTE: {dte_type}")
-        return key
+        self._build_range_index()
+
+    def _build_range_index(self):
+        """Ordena los CAF de cada emisor y tipo por inicio de rango y valida que no se traslapen."""
+        for (rut_emisor, dte_type), entries in self.cafs.items():
+            entries.sort(key=lambda entry: (entry.desde, entry.hasta))
+            unique_entries = []
+            for entry in entries:
+                previous = unique_entries[-1] if unique_entries else None
+                if previous and (previous.desde, previous.hasta) == (entry.desde, entry.hasta):
+                    continue  # Mismo CAF en más de una carpeta
+                if previous and entry.desde <= previous.hasta:
+                    raise ValueError(
+                        f"CAFs traslapados para el emisor {rut_emisor}, Tipo de DTE {dte_type}: "
+                        f"{previous.desde}-{previous.hasta} ({previous.path}) y {entry.desde}-{entry.hasta} ({entry.path})"
+                    )
+                unique_entries.append(entry)
+            self.cafs[(rut_emisor, dte_type)] = unique_entries
+            self._starts[(rut_emisor, dte_type)] = [entry.desde for entry in unique_entries]
+
+    def _load_caf_file_indexed(self, file_path: str) -> Optional[CAFEntry]:
+        """Carga un CAF desde el índice si el archivo no cambió; si no, lo parsea y lo indexa."""
+        if self.index is not None:
+            data = self.index.get(file_path)
+            if data is not None:
+                return CAFEntry(path=file_path, **data) if data else None
+
+        entry = self._load_caf_file(file_path)
+        if self.index is not None:
+            self.index.put(file_path, entry.to_data() if entry else {})
+        return entry
+
+    def iter_entries(self):
+        """Recorre todos los CAF cargados ordenados por emisor, tipo y rango."""
+        for key in sorted(self.cafs):
+            yield from self.cafs[key]
+
+    def _load_caf_file(self, file_path: str) -> Optional[CAFEntry]:
+        """Carga un archivo CAF; retorna None si no tiene el formato esperado."""
+        try:
+            parser = etree.XMLParser(remove_blank_text=True, recover=True)
+            tree = etree.parse(file_path, parser)
+            xml_root = tree.getroot()
+
+            # Extraer el tipo de DTE (TD) y el rango de folios (RNG)
+            td_element = xml_root.find('.//DA/TD')
+            desde_element = xml_root.find('.//DA/RNG/D')
+            hasta_element = xml_root.find('.//DA/RNG/H')
+            if td_element is None or not td_element.text:
+                return None  # Archivo no parece ser un CAF válido, lo saltamos
+            if desde_element is None or hasta_element is None:
+                return None
+
+            # Extraer la clave privada de la etiqueta RSASK
+            rsask_element = xml_root.find('RSASK')
+            caf_element = xml_root.find('CAF')
+            if rsask_element is None or not rsask_element.text or caf_element is None:
+                return None  # No se encontró la clave privada, saltamos
+
+            re_element = xml_root.find('.//DA/RE')
+            fa_element = xml_root.find('.//DA/FA')
+            entry = CAFEntry(
+                dte_type=int(td_element.text),
+                desde=int(desde_element.text),
+                hasta=int(hasta_element.text),
+                rut_emisor=re_element.text.strip() if re_element is not None and re_element.text else '',
+                fecha_autorizacion=fa_element.text.strip() if fa_element is not None and fa_element.text else '',
+                key_pem=rsask_element.text.strip(),
+                caf_xml=etree.tostring(caf_element, encoding='ISO-8859-1', xml_declaration=False).decode('ISO-8859-1'),
+                path=file_path,
+            )
+            # Validar la clave al cargar el archivo (queda cacheada en la entrada)
+            entry.private_key
+            return entry
+
+        except (etree.XMLSyntaxError, ValueError, TypeError):
+            # Ignorar archivos que no se puedan parsear o no tengan el formato esperado
+            return None
+
+    def get_caf_for_folio(self, rut_emisor: str, dte_type: int, folio: int) -> CAFEntry:
+        """Retorna el CAF cuyo rango autorizado cubre el folio para el emisor y tipo de DTE dados."""
+        key = (normalize_rut(rut_emisor), dte_type)
+        entries = self.cafs.get(key)
+        if not entries:
+            raise ValueError(
+                f"No se encontró un archivo CAF con su clave privada para el emisor {rut_emisor}, Tipo de DTE: {dte_type}")
+        position = bisect_right(self._starts[key], folio) - 1
+        if position >= 0 and folio <= entries[position].hasta:
+            return entries[position]
+        ranges = ', '.join(f"{entry.desde}-{entry.hasta}" for entry in entries)
+        raise ValueError(
+            f"El folio {folio} no está cubierto por ningún CAF del emisor {rut_emisor}, Tipo de DTE {dte_type} (rangos: {ranges})")
+
+    def get_key_for_folio(self, rut_emisor: str, dte_type: int, folio: int) -> rsa.RSAPrivateKey:
+        """Retorna la clave privada del CAF que autoriza el folio para el emisor y tipo de DTE dados."""
+        return self.get_caf_for_folio(rut_emisor, dte_type, folio).private_key
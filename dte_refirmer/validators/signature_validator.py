@@ -1,16 +1,77 @@
 import base64
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
 from lxml import etree
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding, rsa
-from cryptography.x509 import load_pem_x509_certificate
+from cryptography.x509 import load_der_x509_certificate
 
 from dte_refirmer.cleaners.xml_normalizer import flatten_xml_for_ted, canonicalize_c14n
 
+
+class DigestMismatchError(ValueError):
+    """El DigestValue de la firma no coincide con el calculado sobre el elemento referenciado."""
+    def __init__(self, reference: str, expected: str, calculated: str):
+        super().__init__(f"El Digest para {reference} no coincide. XML: {expected}, Calculado: {calculated}")
+        self.details = {'reference': reference, 'expected_digest': expected, 'calculated_digest': calculated}
+
+
+class CheckResult(NamedTuple):
+    """Resultado de la verificación de una firma: tipo (TED/DTE/SetDoc), ID, estado, error y duración."""
+    kind: str
+    target: str
+    passed: bool
+    error: Optional[str] = None
+    error_type: Optional[str] = None
+    details: Optional[dict] = None
+    duration_ms: float = 0.0
+
+    def to_dict(self) -> dict:
+        return self._asdict()
+
+
+class VerificationResult(NamedTuple):
+    """Resultado estructurado de la verificación de un archivo EnvioDTE."""
+    path: str
+    checks: List[CheckResult]
+    duration_ms: float
+
+    @property
+    def passed(self) -> bool:
+        return all(check.passed for check in self.checks)
+
+    @property
+    def failed_checks(self) -> List[CheckResult]:
+        return [check for check in self.checks if not check.passed]
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        """Conteo de firmas válidas e inválidas por tipo (TED/DTE/SetDoc)."""
+        summary = {}
+        for check in self.checks:
+            counts = summary.setdefault(check.kind, {'passed': 0, 'failed': 0})
+            counts['passed' if check.passed else 'failed'] += 1
+        return summary
+
+    def to_dict(self) -> dict:
+        return {
+            'path': self.path,
+            'passed': self.passed,
+            'duration_ms': round(self.duration_ms, 3),
+            'summary': self.summary(),
+            'checks': [check.to_dict() for check in self.checks],
+        }
+
+
 class SignatureValidator:
     """
     Valida los tres niveles de firma de un EnvioDTE.
+
+    Los elementos con atributo ID se indexan en una sola pasada, los certificados X509
+    se cachean por su blob base64 y los DTE pueden verificarse en paralelo (`jobs`).
     """
     def __init__(self, signed_xml_path: str):
+        self.path = signed_xml_path
         parser = etree.XMLParser(remove_blank_text=True, recover=True)
         self.tree = etree.parse(signed_xml_path, parser)
         self.root = self.tree.getroot()
@@ -18,44 +79,108 @@ class SignatureValidator:
         if None in self.namespaces:
             self.namespaces['ns'] = self.namespaces.pop(None)
         self.ds_ns = {'ds': 'http://www.w3.org/2000/09/xmldsig#'}
+        self._id_index = self._build_id_index()
+        self._public_keys: Dict[str, rsa.RSAPublicKey] = {}
 
-    def verify_all(self) -> bool:
+    def _build_id_index(self) -> Dict[str, etree._Element]:
+        """Indexa en una pasada todos los elementos que tienen atributo ID."""
+        index = {}
+        for element in self.root.iter(etree.Element):
+            element_id = element.get('ID')
+            if element_id is not None:
+                index.setdefault(element_id, element)
+        return index
+
+    def _get_public_key(self, cert_b64: str) -> rsa.RSAPublicKey:
+        """Clave pública del certificado X509, parseado una sola vez por blob."""
+        key = self._public_keys.get(cert_b64)
+        if key is None:
+            cert = load_der_x509_certificate(base64.b64decode(cert_b64))
+            key = self._public_keys.setdefault(cert_b64, cert.public_key())
+        return key
+
+    def verify_all(self, jobs: int = 1) -> bool:
         """Ejecuta todas las validaciones y retorna True si todas son exitosas."""
+        return self.verify_report(jobs=jobs).passed
+
+    def verify_report(self, jobs: int = 1) -> VerificationResult:
+        """
+        Verifica TED y XMLDSig de cada DTE (en paralelo si jobs > 1) y luego la firma del SetDoc.
+        Retorna un VerificationResult con un resultado por firma, en orden de documento.
+        """
+        start = time.perf_counter()
+        dtes = self.root.findall('.//ns:DTE', self.namespaces)
+        if jobs > 1 and len(dtes) > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                per_dte = list(executor.map(self._verify_dte, dtes))
+        else:
+            per_dte = [self._verify_dte(dte) for dte in dtes]
+
+        results = [result for dte_results in per_dte for result in dte_results]
+        results.append(self._run_check('SetDoc', 'SetDoc', self.verify_setdte_signature))
+        return VerificationResult(self.path, results, (time.perf_counter() - start) * 1000)
+
+    def _verify_dte(self, dte: etree._Element) -> List[CheckResult]:
+        """Verifica el TED y la firma XMLDSig de un DTE."""
+        documento = dte.find('ns:Documento', self.namespaces)
+        doc_id = documento.get('ID') if documento is not None else None
+        target = doc_id or '(sin ID)'
+
+        results = []
+        for ted in dte.findall('.//ns:TED', self.namespaces):
+            results.append(self._run_check('TED', target, self._verify_ted, ted))
+        if doc_id is None:
+            results.append(CheckResult('DTE', target, False, "DTE sin Documento con atributo ID.", 'ValueError'))
+        else:
+            results.append(self._run_check('DTE', target, self._verify_xmldsig, doc_id))
+        return results
+
+    @staticmethod
+    def _run_check(kind: str, target: str, check, *args) -> CheckResult:
+        start = time.perf_counter()
         try:
-            self.verify_ted_signatures()
-            self.verify_dte_signatures()
-            self.verify_setdte_signature()
-            return True
-        except Exception:
-            return False
+            check(*args)
+            return CheckResult(kind, target, True, duration_ms=(time.perf_counter() - start) * 1000)
+        except Exception as e:
+            return CheckResult(
+                kind, target, False,
+                error=str(e) or e.__class__.__name__,
+                error_type=e.__class__.__name__,
+                details=getattr(e, 'details', None),
+                duration_ms=(time.perf_counter() - start) * 1000,
+            )
 
     def verify_ted_signatures(self):
         """Verifica la firma FRMT de cada TED en el documento."""
         for ted in self.root.findall('.//ns:TED', self.namespaces):
-            dd = ted.find('ns:DD', self.namespaces)
-            frmt = ted.find('ns:FRMT', self.namespaces)
-            if dd is None or frmt is None or not frmt.text:
-                raise ValueError("TED malformado: falta DD o FRMT.")
-
-            m = dd.find('.//ns:RSAPK/ns:M', self.namespaces).text
-            e = dd.find('.//ns:RSAPK/ns:E', self.namespaces).text
-            modulus = int.from_bytes(base64.b64decode(m), 'big')
-            exponent = int.from_bytes(base64.b64decode(e), 'big')
-            public_key = rsa.RSAPublicNumbers(e=exponent, n=modulus).public_key()
-
-            signature = base64.b64decode(frmt.text)
-            data_to_verify = flatten_xml_for_ted(dd).encode('ISO-8859-1')
-            
-            public_key.verify(
-                signature,
-                data_to_verify,
-                padding.PKCS1v15(),
-                hashes.SHA1()
-            )
+            self._verify_ted(ted)
+
+    def _verify_ted(self, ted: etree._Element):
+        """Verifica la firma FRMT de un TED con la clave pública del CAF embebido."""
+        dd = ted.find('ns:DD', self.namespaces)
+        frmt = ted.find('ns:FRMT', self.namespaces)
+        if dd is None or frmt is None or not frmt.text:
+            raise ValueError("TED malformado: falta DD o FRMT.")
+
+        m = dd.find('.//ns:RSAPK/ns:M', self.namespaces).text
+        e = dd.find('.//ns:RSAPK/ns:E', self.namespaces).text
+        modulus = int.from_bytes(base64.b64decode(m), 'big')
+        exponent = int.from_bytes(base64.b64decode(e), 'big')
+        public_key = rsa.RSAPublicNumbers(e=exponent, n=modulus).public_key()
+
+        signature = base64.b64decode(frmt.text)
+        data_to_verify = flatten_xml_for_ted(dd).encode('ISO-8859-1')
+
+        public_key.verify(
+            signature,
+            data_to_verify,
+            padding.PKCS1v15(),
+            hashes.SHA1()
+        )
 
     def _verify_xmldsig(self, element_id: str):
         """Lógica genérica para verificar una firma XMLDSig."""
-        referenced_element = self.root.find(f'.//*[@ID=\'{element_id}\']', self.namespaces)
+        referenced_element = self._id_index.get(element_id)
         if referenced_element is None:
             raise ValueError(f"No se encontró el elemento referenciado con ID: {element_id}")
 
@@ -66,17 +191,17 @@ class SignatureValidator:
                 signature = parent.find('ds:Signature', self.ds_ns)
         else:
             signature = referenced_element.find('ds:Signature', self.ds_ns)
+            if signature is None and referenced_element.getparent() is not None:
+                # Firma del SetDTE: hermana del SetDTE dentro de EnvioDTE
+                signature = referenced_element.getparent().find('ds:Signature', self.ds_ns)
 
         if signature is None:
             raise ValueError(f"No se encontró la firma para el elemento con ID: {element_id}")
 
         signed_info = signature.find('ds:SignedInfo', self.ds_ns)
         signature_value = base64.b64decode(signature.find('ds:SignatureValue', self.ds_ns).text)
-        cert_b64 = signature.find('.//ds:X509Certificate', self.ds_ns).text
-        
-        cert_pem = f"-----BEGIN CERTIFICATE-----\n{cert_b64}\n-----END CERTIFICATE-----".encode()
-        cert = load_pem_x509_certificate(cert_pem)
-        public_key = cert.public_key()
+        cert_b64 = "".join(signature.find('.//ds:X509Certificate', self.ds_ns).text.split())
+        public_key = self._get_public_key(cert_b64)
 
         c14n_signed_info = canonicalize_c14n(signed_info)
         public_key.verify(
@@ -88,16 +213,18 @@ class SignatureValidator:
 
         ref_uri = signed_info.find('ds:Reference', self.ds_ns).get('URI')[1:]
         digest_value_in_xml = signed_info.find('.//ds:DigestValue', self.ds_ns).text
-        
-        element_to_check = self.root.find(f'.//*[@ID=\'{ref_uri}\']', self.namespaces)
+
+        element_to_check = self._id_index.get(ref_uri)
+        if element_to_check is None:
+            raise ValueError(f"No se encontró el elemento referenciado con ID: {ref_uri}")
         c14n_element = canonicalize_c14n(element_to_check)
-        
+
         digest = hashes.Hash(hashes.SHA1())
         digest.update(c14n_element)
         calculated_digest = base64.b64encode(digest.finalize()).decode('ascii')
 
         if digest_value_in_xml != calculated_digest:
-            raise ValueError(f"El Digest para {ref_uri} no coincide. XML: {digest_value_in_xml}, Calculado: {calculated_digest}")
+            raise DigestMismatchError(ref_uri, digest_value_in_xml, calculated_digest)
 
     def verify_dte_signatures(self):
         """Verifica las firmas XMLDSig de cada DTE individual."""
@@ -107,4 +234,4 @@ class SignatureValidator:
 
     def verify_setdte_signature(self):
         """Verifica la firma XMLDSig del SetDTE."""
-        self._verify_xmldsig('SetDoc')
\ No newline at end of file
+        self._verify_xmldsig('SetDoc')
@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+from lxml import etree
+
+# Carpeta docs/ del repositorio, donde vienen los XSD del SII
+DEFAULT_SCHEMA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'docs')
+
+SII_NS = 'http://www.sii.cl/SiiDte'
+
+# Esquema a usar según el elemento raíz: {nombre local: (carpeta, archivo XSD)}
+SCHEMAS_BY_ROOT = {
+    'EnvioDTE': ('schema_dte', 'EnvioDTE_v10.xsd'),
+    'DTE': ('schema_dte', 'DTE_v10.xsd'),
+    'LibroCompraVenta': ('schema_iecv', 'LibroCV_v10.xsd'),
+    'LibroGuia': ('schema_lgd', 'LibroGuia_v10.xsd'),
+    'EnvioBOLETA': ('schema_envio_bol', 'EnvioBOLETA_v11.xsd'),
+    'LibroBoleta': ('schema_libro_bol', 'LibroBOLETA_v10.xsd'),
+}
+
+# Carpeta de la que se toman los XSD importados que no vienen junto al esquema
+# (schema_lgd no incluye xmldsignature_v10.xsd)
+SHARED_SCHEMA_FOLDER = 'schema_dte'
+
+
+class StructureResult(NamedTuple):
+    """Resultado de validar un archivo: 'valid', 'invalid' (viola el XSD) o 'error' (no se pudo validar)."""
+    path: str
+    status: str
+    document_type: Optional[str] = None
+    schema: Optional[str] = None
+    errors: Tuple[str, ...] = ()
+    duration_ms: float = 0.0
+
+    @property
+    def valid(self) -> bool:
+        return self.status == 'valid'
+
+    def to_dict(self) -> dict:
+        return self._asdict()
+
+
+class _SharedSchemaResolver(etree.Resolver):
+    """Resuelve imports de XSD inexistentes junto al esquema desde la carpeta compartida."""
+    def __init__(self, shared_dir: str):
+        super().__init__()
+        self.shared_dir = shared_dir
+
+    def resolve(self, url, public_id, context):
+        if url and not url.startswith(('http://', 'https://')) and not os.path.exists(url):
+            shared_path = os.path.join(self.shared_dir, os.path.basename(url))
+            if os.path.exists(shared_path):
+                return self.resolve_filename(shared_path, context)
+        return None
+
+
+class StructureValidator:
+    """
+    Valida archivos EnvioDTE, DTE, LibroCV, LibroGuia y de boletas contra los XSD del SII.
+
+    El esquema se elige por el elemento raíz de cada archivo y se compila una sola vez
+    por instancia, de modo que se reutiliza en todos los archivos validados.
+    """
+    def __init__(self, schema_dir: Optional[str] = None):
+        self.schema_dir = schema_dir or DEFAULT_SCHEMA_DIR
+        self._schemas: Dict[str, etree.XMLSchema] = {}
+        self._lock = threading.Lock()
+
+    def get_schema(self, document_type: str) -> etree.XMLSchema:
+        """Esquema compilado para el tipo de documento (nombre local del elemento raíz)."""
+        schema = self._schemas.get(document_type)
+        if schema is None:
+            folder, filename = SCHEMAS_BY_ROOT[document_type]
+            parser = etree.XMLParser()
+            parser.resolvers.add(_SharedSchemaResolver(os.path.join(self.schema_dir, SHARED_SCHEMA_FOLDER)))
+            schema_doc = etree.parse(os.path.join(self.schema_dir, folder, filename), parser)
+            schema = self._schemas.setdefault(document_type, etree.XMLSchema(schema_doc))
+        return schema
+
+    def validate_file(self, path: str) -> StructureResult:
+        """Valida un archivo contra el XSD que corresponde a su elemento raíz."""
+        start = time.perf_counter()
+
+        def elapsed():
+            return (time.perf_counter() - start) * 1000
+
+        try:
+            tree = etree.parse(path, etree.XMLParser(remove_blank_text=True))
+        except (OSError, etree.XMLSyntaxError) as e:
+            return StructureResult(path, 'error', errors=(f"XML mal formado: {e}",), duration_ms=elapsed())
+
+        root = etree.QName(tree.getroot())
+        if root.namespace != SII_NS or root.localname not in SCHEMAS_BY_ROOT:
+            return StructureResult(path, 'error', document_type=root.localname,
+                                   errors=(f"Elemento raíz no soportado: {root.text}",), duration_ms=elapsed())
+
+        schema_name = SCHEMAS_BY_ROOT[root.localname][1]
+        try:
+            with self._lock:
+                schema = self.get_schema(root.localname)
+                schema.validate(tree)
+                errors = tuple(f"línea {error.line}: {error.message}" for error in schema.error_log)
+        except (OSError, etree.XMLSchemaParseError, etree.XMLSyntaxError) as e:
+            return StructureResult(path, 'error', root.localname, schema_name,
+                                   (f"No se pudo cargar el esquema {schema_name}: {e}",), elapsed())
+
+        return StructureResult(path, 'invalid' if errors else 'valid', root.localname, schema_name, errors, elapsed())
+
+    def validate_files(self, paths: Iterable[str], jobs: int = 1):
+        """
+        Valida varios archivos, en orden. Con jobs > 1 usa un pool de procesos; cada
+        worker compila los esquemas una sola vez y los reutiliza en todos sus archivos.
+        """
+        paths = list(paths)
+        if jobs <= 1 or len(paths) <= 1:
+            for path in paths:
+                yield self.validate_file(path)
+            return
+
+        chunksize = max(1, len(paths) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(self.schema_dir,)) as executor:
+            yield from executor.map(_validate_in_worker, paths, chunksize=chunksize)
+
+
+# Validador de cada proceso worker (ver StructureValidator.validate_files)
+_WORKER_VALIDATOR: Optional[StructureValidator] = None
+
+
+def _init_worker(schema_dir: str):
+    global _WORKER_VALIDATOR
+    _WORKER_VALIDATOR = StructureValidator(schema_dir)
+
+
+def _validate_in_worker(path: str) -> StructureResult:
+    return _WORKER_VALIDATOR.validate_file(path)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Rellena la clave de caso DTE (l10n_cl_edi_certification_case_id) en account.move y
+stock.picking a partir de los vínculos y referencias existentes, para que la búsqueda
+de documentos por caso use el índice en lugar de patrones LIKE sobre ref/origin.
+"""
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+
+    # 1. Facturas/notas ya vinculadas desde el caso (individuales y batch)
+    cr.execute("""
+        UPDATE account_move m
+           SET l10n_cl_edi_certification_case_id = c.id
+          FROM l10n_cl_edi_certification_case_dte c
+         WHERE m.l10n_cl_edi_certification_case_id IS NULL
+           AND m.id IN (c.generated_account_move_id, c.generated_batch_account_move_id)
+    """)
+    _logger.info(f"Clave de caso asignada a {cr.rowcount} documentos account.move vinculados")
+
+    # 2. Facturas con la referencia generada por el generador de documentos
+    cr.execute("""
+        UPDATE account_move m
+           SET l10n_cl_edi_certification_case_id = c.id
+          FROM l10n_cl_edi_certification_case_dte c
+         WHERE m.l10n_cl_edi_certification_case_id IS NULL
+           AND m.ref = 'Certificación DTE - Caso ' || c.id
+    """)
+    _logger.info(f"Clave de caso asignada a {cr.rowcount} documentos account.move por referencia")
+
+    # 3. Guías vinculadas desde el caso (individuales y batch)
+    cr.execute("""
+        UPDATE stock_picking p
+           SET l10n_cl_edi_certification_case_id = c.id
+          FROM l10n_cl_edi_certification_case_dte c
+         WHERE p.l10n_cl_edi_certification_case_id IS NULL
+           AND p.id IN (c.generated_stock_picking_id, c.generated_batch_stock_picking_id)
+    """)
+    _logger.info(f"Clave de caso asignada a {cr.rowcount} guías vinculadas")
+
+    # 4. Guías con el origen generado, acotado al proceso de certificación del caso
+    cr.execute("""
+        UPDATE stock_picking p
+           SET l10n_cl_edi_certification_case_id = c.id
+          FROM l10n_cl_edi_certification_case_dte c
+          JOIN l10n_cl_edi_certification_parsed_set s ON s.id = c.parsed_set_id
+         WHERE p.l10n_cl_edi_certification_case_id IS NULL
+           AND p.l10n_cl_edi_certification_id = s.certification_process_id
+           AND p.origin = 'Certificación SII - Caso ' || c.case_number_raw
+    """)
+    _logger.info(f"Clave de caso asignada a {cr.rowcount} guías por origen")
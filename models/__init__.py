@@ -6,6 +6,8 @@ from . import certification_available_set
 from . import l10n_cl_edi_certification_data
 from . import certification_case_dte
 from . import certification_document_generator
+from . import certification_folio_allocator
+from . import certification_xsd_validator
 from . import certification_purchase_entry
 from . import certification_iecv_constants
 from . import certification_iecv_book_base
@@ -22,6 +24,7 @@ from . import certification_delivery_guide_book
 from . import account_move
 from . import purchase_order
 from . import stock_picking
+from . import l10n_cl_dte_caf
 from . import sale_order
 from . import sale_order_line
 from . import l10n_cl_edi_util
@@ -10,6 +10,12 @@ class AccountMove(models.Model):
     l10n_cl_edi_certification_id = fields.Many2one('l10n_cl_edi.certification.process', 
                                                string='Proceso Certificación SII',
                                                help='Proceso de certificación al que pertenece este documento')
+    l10n_cl_edi_certification_case_id = fields.Many2one('l10n_cl_edi.certification.case.dte',
+                                                    string='Caso DTE Certificación',
+                                                    index=True,
+                                                    copy=False,
+                                                    ondelete='set null',
+                                                    help='Caso DTE específico que genera este documento')
     
     # === CAMPOS ESPECÍFICOS DE EXPORTACIÓN ===
     # Campos adicionales no cubiertos por l10n_cl_edi_exports
@@ -314,6 +314,7 @@ class CertificationAvailableSet(models.Model):
             
             # Aplicar cambios al caso
             if case_updates:
+                case_updates.update({'batch_fingerprint': False, 'batch_signed_dte': False})
                 case.write(case_updates)
         
         # Eliminar archivo batch existente si existe
@@ -1,16 +1,54 @@
-from odoo import models, fields, api, _
+from odoo import models, fields, api, _, Command
 from odoo.exceptions import UserError
+from odoo.tools import split_every
 from odoo.tools.float_utils import float_repr
 import base64
+import hashlib
 import logging
+import os
+import shutil
+import tempfile
+import textwrap
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
-from datetime import datetime
+from datetime import datetime, timedelta
+from markupsafe import Markup
+from psycopg2.errors import DeadlockDetected, LockNotAvailable, SerializationFailure
 import xml.etree.ElementTree as ET
 import re
 from xml.sax.saxutils import escape
 
 _logger = logging.getLogger(__name__)
 
+SII_DTE_NS = 'http://www.sii.cl/SiiDte'
+XSI_NS = 'http://www.w3.org/2001/XMLSchema-instance'
+
+# Etiquetas de apertura del envío tal como se escriben en el archivo
+ENVIODTE_OPEN = (
+    f'<EnvioDTE xmlns="{SII_DTE_NS}" xmlns:xsi="{XSI_NS}" '
+    f'xsi:schemaLocation="{SII_DTE_NS} EnvioDTE_v10.xsd" version="1.0">\n'
+).encode('ascii')
+SETDTE_OPEN = b'<SetDTE ID="SetDoc">'
+
+# Apertura canónica del SetDTE (hereda los namespaces declarados en EnvioDTE)
+SETDTE_C14N_OPEN = f'<SetDTE xmlns="{SII_DTE_NS}" xmlns:xsi="{XSI_NS}" ID="SetDoc">'.encode('ascii')
+
+BATCH_JOB_CRON_XMLID = 'l10n_cl_edi_certification.ir_cron_process_batch_file_jobs'
+# Bloques de copia del envío al filestore y tamaño de la vista previa del XML
+STREAM_BLOCK_SIZE = 1024 * 1024
+XML_PREVIEW_SIZE = 256 * 1024
+
+# Intentos máximos de un trabajo interrumpido antes de marcarlo con error
+BATCH_JOB_MAX_ATTEMPTS = 3
+# Conflictos transitorios con otras transacciones: el trabajo vuelve a la cola
+PG_CONCURRENCY_ERRORS = (SerializationFailure, LockNotAvailable, DeadlockDetected)
+
+
+class BatchJobCancelled(Exception):
+    """Cancelación solicitada por el usuario durante un trabajo de generación"""
+
 class CertificationBatchFile(models.Model):
     _name = 'l10n_cl_edi.certification.batch_file'
     _description = 'Archivo de Envío Consolidado SII'
@@ -42,7 +80,8 @@ class CertificationBatchFile(models.Model):
     
     xml_content = fields.Text(
         string='Contenido XML',
-        help='Contenido XML del archivo consolidado'
+        compute='_compute_xml_content',
+        help='Contenido XML del archivo consolidado (leído desde el adjunto bajo demanda)'
     )
     
     file_data = fields.Binary(
@@ -58,7 +97,10 @@ class CertificationBatchFile(models.Model):
     
     state = fields.Selection([
         ('draft', 'Borrador'),
+        ('queued', 'En Cola'),
+        ('running', 'Procesando'),
         ('generated', 'Generado'),
+        ('cancelled', 'Cancelado'),
         ('error', 'Error')
     ], string='Estado', default='draft')
     
@@ -77,6 +119,112 @@ class CertificationBatchFile(models.Model):
         default=fields.Datetime.now
     )
     
+    # ==================== TRABAJO EN SEGUNDO PLANO ====================
+    
+    parsed_set_id = fields.Many2one(
+        'l10n_cl_edi.certification.parsed_set',
+        string='Set de Pruebas',
+        ondelete='set null',
+        help='Set de pruebas específico a consolidar (vacío: todos los sets del tipo)'
+    )
+    
+    incremental = fields.Boolean(
+        string='Regeneración Incremental',
+        help='Reutilizar los documentos batch cuyos datos no cambiaron'
+    )
+    
+    job_stage = fields.Selection([
+        ('queued', 'En cola'),
+        ('validate', 'Validando requisitos'),
+        ('regenerate', 'Regenerando documentos'),
+        ('sign', 'Firmando DTEs'),
+        ('envelope', 'Construyendo envío'),
+        ('done', 'Terminado'),
+    ], string='Etapa')
+    
+    job_progress = fields.Integer(string='Progreso (%)')
+    
+    job_progress_message = fields.Char(string='Detalle del Progreso')
+    
+    job_cancel_requested = fields.Boolean(string='Cancelación Solicitada')
+    
+    job_attempts = fields.Integer(string='Intentos')
+    
+    job_heartbeat = fields.Datetime(
+        string='Último Avance',
+        help='Fecha del último punto de control; un trabajo sin avances se reencola'
+    )
+    
+    checkpoint_case_ids = fields.Many2many(
+        'l10n_cl_edi.certification.case.dte',
+        'l10n_cl_edi_batch_file_checkpoint_case_rel',
+        'batch_file_id',
+        'case_id',
+        string='Casos Regenerados',
+        help='Casos cuyo documento batch ya fue regenerado por este trabajo (punto de reanudación)'
+    )
+    
+    @api.depends('file_data')
+    def _compute_xml_content(self):
+        """Vista previa del XML: solo los primeros XML_PREVIEW_SIZE bytes del adjunto"""
+        attachments = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'file_data'),
+            ('res_id', 'in', self.ids),
+        ])
+        attachment_by_record = {attachment.res_id: attachment for attachment in attachments}
+        for record in self:
+            attachment = attachment_by_record.get(record.id)
+            if not attachment:
+                record.xml_content = False
+                continue
+            if attachment.store_fname:
+                with open(attachment._full_path(attachment.store_fname), 'rb') as stream:
+                    preview = stream.read(XML_PREVIEW_SIZE)
+            else:
+                preview = attachment.raw[:XML_PREVIEW_SIZE]
+            record.xml_content = preview.decode('ISO-8859-1')
+            if attachment.file_size > XML_PREVIEW_SIZE:
+                record.xml_content += _('\n<!-- Vista previa truncada: descargue el archivo completo -->')
+
+    def _attach_file_data(self, stream):
+        """
+        Guardar el XML como adjunto de file_data copiándolo por bloques desde el archivo al
+        filestore, sin cargarlo completo en memoria (con adjuntos en base de datos se lee entero)
+        """
+        self.ensure_one()
+        attachment_model = self.env['ir.attachment']
+        values = {
+            'name': self.filename or 'file_data',
+            'res_model': self._name,
+            'res_field': 'file_data',
+            'res_id': self.id,
+            'mimetype': 'application/xml',
+        }
+        if attachment_model._storage() != 'file':
+            values['raw'] = stream.read()
+        else:
+            checksum = hashlib.sha1()
+            for block in iter(lambda: stream.read(STREAM_BLOCK_SIZE), b''):
+                checksum.update(block)
+            checksum = checksum.hexdigest()
+            # Misma ruta que usa ir.attachment para el contenido con este checksum
+            fname = f'{checksum[:2]}/{checksum}'
+            full_path = attachment_model._full_path(fname)
+            if not os.path.isfile(full_path):
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                stream.seek(0)
+                with open(full_path, 'wb') as target:
+                    shutil.copyfileobj(stream, target, STREAM_BLOCK_SIZE)
+                attachment_model._mark_for_gc(fname)
+            values.update({
+                'store_fname': fname,
+                'file_size': stream.tell(),
+                'checksum': checksum,
+            })
+        attachment_model.create(values)
+        self.invalidate_recordset(['file_data', 'xml_content'])
+
     def action_download_file(self):
         """Acción para descargar el archivo XML consolidado"""
         self.ensure_one()
@@ -103,16 +251,18 @@ class CertificationBatchFile(models.Model):
             self._recover_missing_batch_documents(
                 self.certification_id.id, 
                 self.set_type, 
-                parsed_set_id=getattr(self, 'parsed_set_id', None)
+                parsed_set_id=self.parsed_set_id.id or None
             )
         except Exception as e:
             _logger.warning(f"Advertencia en recuperación automática: {str(e)}")
         
         # 2. Luego regenerar el consolidado con todos los documentos disponibles
         _logger.info("PASO 2: Regenerando consolidado...")
-        generation_method = getattr(self.certification_id, f'action_generate_batch_{self.set_type}', None)
+        # Modo incremental: solo se rehacen los casos cuyos datos cambiaron
+        certification = self.certification_id.with_context(l10n_cl_edi_incremental_batch=True)
+        generation_method = getattr(certification, f'action_generate_batch_{self.set_type}', None)
         if generation_method:
-            parsed_set_id = getattr(self, 'parsed_set_id', None)
+            parsed_set_id = self.parsed_set_id.id
             if parsed_set_id:
                 return generation_method(parsed_set_id=parsed_set_id)
             else:
@@ -124,7 +274,7 @@ class CertificationBatchFile(models.Model):
         """Recuperar documentos batch faltantes sin regenerar"""
         self.ensure_one()
         return self.env['l10n_cl_edi.certification.batch_file']._recover_missing_batch_documents(
-            self.certification_id.id, self.set_type, parsed_set_id=getattr(self, 'parsed_set_id', None)
+            self.certification_id.id, self.set_type, parsed_set_id=self.parsed_set_id.id or None
         )
     
     @api.model
@@ -186,64 +336,382 @@ class CertificationBatchFile(models.Model):
         return self._generate_batch_file(certification_process_id, 'facturas_compra', 'CONSOLIDADO FACTURAS DE COMPRA', parsed_set_id=parsed_set_id)
 
     def _generate_batch_file(self, certification_process_id, set_type, name, parsed_set_id=None):
-        """Motor principal de generación de archivos consolidados"""
-        _logger.info(f"=== INICIANDO GENERACIÓN BATCH {set_type.upper()} ===")
+        """
+        Encolar la generación de un archivo consolidado.
+
+        La regeneración, firma y construcción del envío se ejecutan en segundo plano
+        (ver _cron_process_batch_jobs); el registro del archivo refleja etapa y progreso.
+        """
+        _logger.info(f"=== ENCOLANDO GENERACIÓN BATCH {set_type.upper()} ===")
         
         # Obtener proceso de certificación
         process = self.env['l10n_cl_edi.certification.process'].browse(certification_process_id)
         if not process.exists():
             raise UserError(_('Proceso de certificación no encontrado'))
 
-        try:
-            # 1. Validar prerequisitos
-            self._validate_ready_for_batch_generation(process, set_type, parsed_set_id=parsed_set_id)
-            
-            # 2. Regenerar documentos del set con nuevos folios
-            regenerated_documents = self._regenerate_test_documents(process, set_type, parsed_set_id=parsed_set_id)
-            
-            # 3. Generar nodos DTE frescos para el consolidado
-            dte_nodes = self._generate_fresh_dte_nodes(regenerated_documents)
-            
-            # 4. Construir XML consolidado
-            consolidated_xml = self._build_consolidated_setdte(process, dte_nodes, set_type)
-            
-            # 5. Crear archivo batch
-            batch_file = self.create({
-                'certification_id': certification_process_id,
-                'name': name,
-                'set_type': set_type,
-                'xml_content': consolidated_xml,
-                'file_data': base64.b64encode(consolidated_xml.encode('ISO-8859-1')),
-                'document_count': len(dte_nodes),
-                'state': 'generated'
-            })
-            
-            _logger.info(f"Archivo batch {set_type} generado exitosamente con {len(dte_nodes)} documentos")
-            
+        active_job = self.search([
+            ('certification_id', '=', certification_process_id),
+            ('set_type', '=', set_type),
+            ('state', 'in', ('queued', 'running')),
+        ], limit=1)
+        if active_job:
             return {
                 'type': 'ir.actions.client',
                 'tag': 'display_notification',
                 'params': {
-                    'title': _('Archivo Consolidado Generado'),
-                    'message': _('Se generó exitosamente %s con %d documentos') % (name, len(dte_nodes)),
-                    'type': 'success',
+                    'title': _('Generación en Curso'),
+                    'message': _('%s ya está en proceso (%s%%)') % (active_job.name, active_job.job_progress),
+                    'type': 'info',
                     'sticky': False,
                 }
             }
+
+        # Los requisitos se validan antes de encolar para informar errores de inmediato
+        self._validate_ready_for_batch_generation(process, set_type, parsed_set_id=parsed_set_id)
+        
+        job = self.create({
+            'certification_id': certification_process_id,
+            'name': name,
+            'set_type': set_type,
+            'parsed_set_id': parsed_set_id,
+            'incremental': bool(self.env.context.get('l10n_cl_edi_incremental_batch')),
+            'state': 'queued',
+            'job_stage': 'queued',
+            'job_progress_message': _('En espera de un worker'),
+        })
+        job._trigger_batch_job_cron()
+        _logger.info(f"Archivo batch {set_type} encolado como trabajo {job.id}")
+        
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Generación en Cola'),
+                'message': _('%s se está generando en segundo plano. Revise su progreso en Archivos Consolidados.') % name,
+                'type': 'success',
+                'sticky': False,
+            }
+        }
+
+    # ==================== TRABAJOS EN SEGUNDO PLANO ====================
+
+    def _trigger_batch_job_cron(self):
+        """Despertar al cron que procesa los trabajos en cola"""
+        cron = self.env.ref(BATCH_JOB_CRON_XMLID, raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+
+    def _get_batch_job_param(self, key, default):
+        """Parámetro entero l10n_cl_edi_certification.<key> (con valor por defecto si es inválido)"""
+        param = self.env['ir.config_parameter'].sudo().get_param(f'l10n_cl_edi_certification.{key}')
+        try:
+            value = int(param) if param else default
+        except ValueError:
+            _logger.warning(f"Parámetro {key} inválido: {param}, usando {default}")
+            value = default
+        return max(1, value)
+
+    def action_cancel_job(self):
+        """
+        Cancelar de inmediato los trabajos que siguen en cola y solicitar la cancelación de los
+        que ya tomó un worker. La cancelación directa es un UPDATE condicionado al estado en la
+        base de datos (no al que leyó la interfaz): si un worker tomó el trabajo entretanto,
+        la transacción falla por serialización y se reintenta viendo el trabajo 'running'.
+        """
+        if not self:
+            return
+        self.flush_recordset()
+        self.env.cr.execute("""
+            UPDATE l10n_cl_edi_certification_batch_file
+               SET state = 'cancelled',
+                   job_progress_message = %s,
+                   write_uid = %s,
+                   write_date = (now() at time zone 'UTC')
+             WHERE id IN %s
+               AND state = 'queued'
+         RETURNING id
+        """, [_('Cancelado por el usuario'), self.env.uid, tuple(self.ids)])
+        cancelled_ids = {row[0] for row in self.env.cr.fetchall()}
+        self.invalidate_recordset(['state', 'job_progress_message', 'write_uid', 'write_date'])
+        
+        self.filtered(lambda job: job.id not in cancelled_ids and job.state == 'running').write({
+            'job_cancel_requested': True,
+        })
+
+    def action_resume_job(self):
+        """Reencolar trabajos cancelados o con error; continúan desde su último punto de control"""
+        jobs = self.filtered(lambda job: job.state in ('cancelled', 'error') and job.job_stage)
+        if not jobs:
+            raise UserError(_('Solo se pueden reanudar trabajos cancelados o con error.'))
+        jobs.write({
+            'state': 'queued',
+            'job_cancel_requested': False,
+            'job_attempts': 0,
+            'error_message': False,
+            'job_progress_message': _('En espera de un worker'),
+        })
+        jobs._trigger_batch_job_cron()
+
+    @api.model
+    def _cron_process_batch_jobs(self):
+        """Procesar trabajos de generación en cola, uno a la vez, dentro del presupuesto de tiempo del cron"""
+        self._requeue_stalled_batch_jobs()
+        
+        time_budget = self._get_batch_job_param('batch_job_time_budget', 600)
+        start = time.monotonic()
+        while time.monotonic() - start < time_budget:
+            job = self._claim_next_batch_job()
+            if not job:
+                return
+            job._run_batch_job()
+        
+        # Quedan trabajos pendientes: continuar en una nueva ejecución del cron
+        if self.search_count([('state', '=', 'queued')], limit=1):
+            self._trigger_batch_job_cron()
+
+    @api.model
+    def _requeue_stalled_batch_jobs(self):
+        """Reencolar trabajos 'running' sin avances (worker caído o detenido por límite de tiempo)"""
+        timeout = self._get_batch_job_param('batch_job_timeout_minutes', 30)
+        stalled_jobs = self.search([
+            ('state', '=', 'running'),
+            ('job_heartbeat', '<', fields.Datetime.now() - timedelta(minutes=timeout)),
+        ])
+        for job in stalled_jobs:
+            if job.job_attempts >= BATCH_JOB_MAX_ATTEMPTS:
+                _logger.error(f"❌ Trabajo batch {job.id} abandonado tras {job.job_attempts} intentos")
+                job.write({
+                    'state': 'error',
+                    'error_message': _('El trabajo se interrumpió %d veces sin completarse') % job.job_attempts,
+                })
+            else:
+                _logger.warning(f"⚠️ Trabajo batch {job.id} sin avances desde {job.job_heartbeat}, reencolando")
+                job.write({'state': 'queued', 'job_progress_message': _('Reanudando tras interrupción')})
+        if stalled_jobs:
+            self.env.cr.commit()
+
+    @api.model
+    def _claim_next_batch_job(self):
+        """Tomar el trabajo en cola más antiguo; SKIP LOCKED evita que dos workers tomen el mismo"""
+        self.flush_model(['state'])
+        self.env.cr.execute("""
+            SELECT id
+              FROM l10n_cl_edi_certification_batch_file
+             WHERE state = 'queued'
+             ORDER BY create_date, id
+             LIMIT 1
+               FOR UPDATE SKIP LOCKED
+        """)
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.browse()
+        job = self.browse(row[0])
+        job.write({
+            'state': 'running',
+            'job_attempts': job.job_attempts + 1,
+            'job_heartbeat': fields.Datetime.now(),
+        })
+        self.env.cr.commit()
+        return job
+
+    def _job_checkpoint(self, stage, progress, message, **values):
+        """Registrar etapa y progreso del trabajo y confirmar la transacción (punto de reanudación)"""
+        self.ensure_one()
+        values.update({
+            'job_stage': stage,
+            'job_progress': progress,
+            'job_progress_message': message,
+            'job_heartbeat': fields.Datetime.now(),
+        })
+        self.write(values)
+        try:
+            self.env.cr.commit()
+        except SerializationFailure:
+            # El registro se modificó durante el bloque (p. ej. el usuario solicitó cancelar)
+            self.env.cr.rollback()
+            self._check_job_cancelled()
+            raise
+
+    def _check_job_cancelled(self):
+        """Lanzar BatchJobCancelled si el usuario solicitó cancelar el trabajo"""
+        self.invalidate_recordset(['job_cancel_requested'])
+        if self.job_cancel_requested:
+            raise BatchJobCancelled()
+
+    def _run_batch_job(self):
+        """Ejecutar un trabajo de generación por etapas, confirmando cada punto de control"""
+        self.ensure_one()
+        _logger.info(f"=== INICIANDO GENERACIÓN BATCH {self.set_type.upper()} (trabajo {self.id}, intento {self.job_attempts}) ===")
+        process = self.certification_id
+        job = self.with_context(l10n_cl_edi_incremental_batch=self.incremental)
+        
+        try:
+            # 1. Validar prerequisitos
+            job._job_checkpoint('validate', 0, _('Validando requisitos'))
+            job._validate_ready_for_batch_generation(process, self.set_type, parsed_set_id=self.parsed_set_id.id or None)
             
-        except Exception as e:
-            _logger.error(f"Error generando archivo batch {set_type}: {str(e)}")
+            # 2. Regenerar documentos del set con nuevos folios (por bloques)
+            documents = job._job_regenerate_documents(process)
             
-            # Crear registro de error
-            self.create({
-                'certification_id': certification_process_id,
-                'name': f"{name} (Error)",
-                'set_type': set_type,
+            # 3. Firmar DTEs frescos para el consolidado (por bloques)
+            dte_nodes = job._job_sign_documents(documents)
+            
+            # 4. Escribir, validar y adjuntar el envío consolidado
+            job._job_build_envelope(process, dte_nodes)
+            _logger.info(f"Archivo batch {self.set_type} generado exitosamente con {len(dte_nodes)} documentos")
+        
+        except BatchJobCancelled:
+            self.env.cr.rollback()
+            _logger.info(f"Trabajo batch {self.id} cancelado en etapa {self.job_stage}")
+            self.write({
+                'state': 'cancelled',
+                'job_cancel_requested': False,
+                'job_progress_message': _('Cancelado por el usuario'),
+            })
+            self.env.cr.commit()
+        
+        except PG_CONCURRENCY_ERRORS as e:
+            # Escritura concurrente sobre el trabajo o sus documentos: se pierde solo el bloque
+            # en curso y el trabajo se reanuda desde su último punto de control
+            self.env.cr.rollback()
+            if self.job_attempts >= BATCH_JOB_MAX_ATTEMPTS:
+                _logger.error(f"❌ Trabajo batch {self.id} abandonado tras {self.job_attempts} conflictos de concurrencia")
+                self.write({
+                    'state': 'error',
+                    'error_message': _('Conflicto de concurrencia en %d intentos: %s') % (self.job_attempts, e),
+                })
+            else:
+                _logger.warning(f"⚠️ Conflicto de concurrencia en trabajo batch {self.id} (etapa {self.job_stage}), reencolando: {e}")
+                self.write({'state': 'queued', 'job_progress_message': _('Reanudando tras conflicto de concurrencia')})
+                self._trigger_batch_job_cron()
+            self.env.cr.commit()
+        
+        except Exception as e:
+            self.env.cr.rollback()
+            _logger.error(f"Error generando archivo batch {self.set_type}: {str(e)}")
+            self.write({
                 'state': 'error',
-                'error_message': str(e)
+                'error_message': str(e),
             })
-            
-            raise UserError(_('Error generando archivo consolidado: %s') % str(e))
+            self.env.cr.commit()
+
+    def _job_regenerate_documents(self, process):
+        """
+        Etapa de regeneración: procesa los casos pendientes en bloques y registra los
+        casos terminados en checkpoint_case_ids, de modo que un reintento no los repite.
+        Si algún caso no se pudo regenerar el trabajo falla: un set incompleto no sirve.
+        """
+        cases = self._get_sorted_cases_for_set_type(process, self.set_type, parsed_set_id=self.parsed_set_id.id or None)
+        pending_cases = self._get_pending_batch_cases(cases)
+        self._check_folio_capacity(process, pending_cases)
+        done_count = len(cases) - len(pending_cases)
+        chunk_size = self._get_batch_job_param('batch_job_chunk_size', 10)
+        
+        self._job_checkpoint('regenerate', 5, _('Regenerando documentos: %d/%d') % (done_count, len(cases)))
+        for chunk in split_every(chunk_size, pending_cases.ids, cases.browse):
+            self._check_job_cancelled()
+            regenerated, errors = self._regenerate_cases(process, chunk)
+            done_count += len(regenerated)
+            self._job_checkpoint(
+                'regenerate', 5 + 55 * done_count // len(cases),
+                _('Regenerando documentos: %d/%d') % (done_count, len(cases)),
+                checkpoint_case_ids=[Command.link(case_id) for case_id in regenerated],
+            )
+            if errors:
+                # Los casos siguientes pueden referenciar a los fallidos: detenerse aquí
+                raise UserError(_('No se pudieron regenerar %d documento(s) del set %s:\n%s') % (
+                    len(errors), self.set_type, '\n'.join(errors)))
+        
+        documents = [case._get_batch_document() for case in cases]
+        missing_cases = [case for case, document in zip(cases, documents) if not document]
+        if missing_cases:
+            raise UserError(_('Casos sin documento batch para el set %s: %s') % (
+                self.set_type, ', '.join(case.case_number_raw for case in missing_cases)))
+        _logger.info(f"Regeneración por bloques: {len(cases) - len(pending_cases)} reutilizados, {len(pending_cases)} regenerados")
+        return documents
+
+    def _check_folio_capacity(self, process, cases):
+        """
+        Verificar antes de regenerar que los CAFs tengan folios para todos los casos por tipo
+        de documento: agotar un CAF a mitad de la etapa dejaría el set renumerado a medias.
+        """
+        required = defaultdict(int)
+        for case in cases:
+            required[case.document_type_code] += 1
+        if not required:
+            return
+        caf_summary = process._get_caf_summary(list(required))
+        shortages = [
+            _('%s: se requieren %d folios, quedan %d') % (
+                process._get_document_type_name(code), count, caf_summary[code]['remaining'])
+            for code, count in required.items()
+            if caf_summary[code]['remaining'] < count
+        ]
+        if shortages:
+            raise UserError(_('Folios CAF insuficientes para regenerar el set %s:\n%s') % (
+                self.set_type, '\n'.join(shortages)))
+
+    def _get_pending_batch_cases(self, cases):
+        """
+        Casos cuyo documento batch debe regenerarse, recorridos en orden topológico: los que
+        no están en el punto de control ni son reutilizables, y todo caso que referencia a uno
+        de ellos, porque el documento referenciado cambiará de folio aunque la huella del
+        caso aún coincida con el folio anterior.
+        """
+        pending_cases = cases.browse()
+        for case in cases:
+            if case.reference_ids.referenced_case_dte_id & pending_cases:
+                pending_cases |= case
+            elif case in self.checkpoint_case_ids:
+                continue
+            elif not (self.incremental and case._is_batch_document_reusable()):
+                pending_cases |= case
+        return pending_cases
+
+    def _job_sign_documents(self, documents):
+        """
+        Etapa de firma: firma los DTEs en bloques. Cada bloque guarda los DTEs firmados
+        en sus casos, así un reintento reutiliza los ya firmados (modo incremental).
+        """
+        signer = self.with_context(l10n_cl_edi_incremental_batch=True)
+        chunk_size = self._get_batch_job_param('batch_job_chunk_size', 10)
+        dte_nodes = []
+        errors = []
+        signed_count = 0
+        
+        self._job_checkpoint('sign', 60, _('Firmando DTEs: 0/%d') % len(documents))
+        for chunk in split_every(chunk_size, documents, list):
+            self._check_job_cancelled()
+            try:
+                dte_nodes.extend(signer._generate_fresh_dte_nodes(chunk))
+            except UserError as e:
+                errors.append(str(e))
+            signed_count += len(chunk)
+            self._job_checkpoint('sign', 60 + 30 * signed_count // len(documents),
+                                 _('Firmando DTEs: %d/%d') % (signed_count, len(documents)))
+        
+        # Los DTEs ya firmados quedan guardados: al reanudar solo se firman los fallidos
+        if errors or len(dte_nodes) != len(documents):
+            raise UserError(_('Solo se firmaron %d de %d DTEs para el consolidado:\n%s') % (
+                len(dte_nodes), len(documents), '\n'.join(errors)))
+        return dte_nodes
+
+    def _job_build_envelope(self, process, dte_nodes):
+        """Etapa final: escribir el envío consolidado, validarlo contra el XSD y adjuntarlo"""
+        self._check_job_cancelled()
+        self._job_checkpoint('envelope', 90, _('Construyendo envío con %d DTEs') % len(dte_nodes))
+        
+        with tempfile.TemporaryFile() as stream:
+            self._write_consolidated_setdte(process, dte_nodes, self.set_type, stream)
+            stream.seek(0)
+            self.env['l10n_cl_edi.certification.xsd.validator']._check_xml(stream, 'envio_dte', label=self.name)
+            stream.seek(0)
+            self._attach_file_data(stream)
+        self._job_checkpoint('done', 100, _('Generado con %d documentos') % len(dte_nodes),
+                             state='generated',
+                             document_count=len(dte_nodes),
+                             generation_date=fields.Datetime.now(),
+                             error_message=False)
 
     def _validate_ready_for_batch_generation(self, process, set_type, parsed_set_id=None):
         """Validar que los documentos estén aceptados por SII para consolidación"""
@@ -466,13 +934,10 @@ class CertificationBatchFile(models.Model):
             
             # 5. Crear archivo batch con el contenido del libro IECV
             if iecv_book.xml_file:
-                xml_content = base64.b64decode(iecv_book.xml_file).decode('ISO-8859-1')
-                
                 batch_file = self.create({
                     'certification_id': certification_process_id,
                     'name': name,
                     'set_type': set_type,
-                    'xml_content': xml_content,
                     'file_data': iecv_book.xml_file,  # Ya está en base64
                     'document_count': len(iecv_book._get_sales_documents()) if book_type == 'IEV' else len(iecv_book._get_purchase_entries()),
                     'state': 'generated'
@@ -507,143 +972,167 @@ class CertificationBatchFile(models.Model):
             
             raise UserError(_('Error generando libro: %s') % str(e))
 
-    def _regenerate_test_documents(self, process, set_type, parsed_set_id=None):
-        """Regenerar documentos del set con nuevos folios CAF"""
-        _logger.info(f"Regenerando documentos para set {set_type}")
-        
+    def _get_sorted_cases_for_set_type(self, process, set_type, parsed_set_id=None):
+        """
+        Casos del set en orden topológico del grafo de referencias: cada documento se
+        genera después de los documentos que referencia (incluye cadenas NC → ND → NC)
+        """
         relevant_cases = self._get_relevant_cases_for_set_type(process, set_type, parsed_set_id=parsed_set_id)
-        
-        # Ordenar casos para generar facturas antes que notas de crédito/débito
-        # Esto es crucial para evitar errores de referencia
-        def sort_key(case):
-            doc_type = case.document_type_code
-            # Facturas y guías primero (códigos 33, 34, 52, 110, etc.)
-            if doc_type in ['33', '34', '52', '110']:
-                return 1
-            # Notas de crédito/débito después (códigos 56, 61, 111, 112)
-            elif doc_type in ['56', '61', '111', '112']:
-                return 2
-            # Otros tipos al final
-            else:
-                return 3
-        
-        relevant_cases = relevant_cases.sorted(key=sort_key)
-        _logger.info(f"Casos ordenados para generación: {[f'{c.case_number_raw}({c.document_type_code})' for c in relevant_cases]}")
-        
-        regenerated_documents = []
-        
-        for case in relevant_cases:
-            try:
-                # Utilizar el generador de documentos en modo batch
-                generator = self.env['l10n_cl_edi.certification.document.generator'].create({
-                    'dte_case_id': case.id,
-                    'certification_process_id': process.id,
-                    'for_batch': True
-                })
-                
-                # Generar documento batch con nuevos folios CAF
-                result = generator.generate_document(for_batch=True)
-                
-                # Obtener el documento generado para batch
-                document = None
-                if case.document_type_code == '52': # Guía de Despacho
-                    document = case.generated_batch_stock_picking_id
-                else:
-                    document = case.generated_batch_account_move_id
+        waves = relevant_cases._get_generation_waves()
+        return relevant_cases.browse([case_id for wave in waves for case_id in wave.ids])
 
-                if not document:
-                    _logger.warning(f"No se pudo obtener documento batch para caso {case.case_number_raw}")
-                    continue
-                
-                # Asegurar que el documento esté confirmado (solo para account.move)
-                if document._name == 'account.move' and document.state == 'draft':
-                    document.action_post()
-                
-                # Verificar que tenga XML DTE (l10n_cl_dte_file existe en ambos modelos)
-                if document.l10n_cl_dte_file:
-                    regenerated_documents.append(document)
-                    _logger.info(f"Documento regenerado para caso {case.case_number_raw}")
-                else:
-                    _logger.warning(f"Documento sin XML DTE para caso {case.case_number_raw}")
-                
+    def _regenerate_cases(self, process, cases):
+        """
+        Regenerar en orden los documentos batch de los casos.
+
+        Returns:
+            tuple: ({id del caso: documento regenerado}, errores por caso no generado)
+        """
+        documents = {}
+        errors = []
+        self.env['l10n_cl_edi.certification.document.generator']._prefetch_item_products(cases)
+        # Las confirmaciones de cada bloque descartan lo resuelto: repetirlo en esta transacción
+        cases._resolve_reference_targets()
+        cases._prefetch_referenced_documents()
+        for case in cases:
+            try:
+                # Un caso fallido no deja escrituras a medias en el bloque que se confirma
+                with self.env.cr.savepoint():
+                    documents[case.id] = self._regenerate_case_document(process, case)
+            except PG_CONCURRENCY_ERRORS:
+                # La transacción quedó abortada: propagarlo para que el trabajo se reencole
+                raise
             except Exception as e:
                 _logger.error(f"Error regenerando documento para caso {case.case_number_raw}: {str(e)}")
-                continue
+                errors.append(f"{case.case_number_raw}: {str(e)}")
+        return documents, errors
+
+    def _regenerate_case_document(self, process, case):
+        """Generar el documento batch de un caso; lanza UserError si no queda un DTE utilizable"""
+        # Utilizar el generador de documentos en modo batch
+        generator = self.env['l10n_cl_edi.certification.document.generator'].create({
+            'dte_case_id': case.id,
+            'certification_process_id': process.id,
+            'for_batch': True
+        })
         
-        if not regenerated_documents:
-            raise UserError(_('No se pudieron regenerar documentos para el set %s') % set_type)
+        # Generar documento batch con nuevos folios CAF
+        generator.generate_document(for_batch=True)
         
-        return regenerated_documents
+        # Obtener el documento generado para batch
+        document = case._get_batch_document()
+        if not document:
+            raise UserError(_('No se pudo obtener el documento batch'))
+        
+        # Asegurar que el documento esté confirmado (solo para account.move)
+        if document._name == 'account.move' and document.state == 'draft':
+            document.action_post()
+        
+        # Verificar que tenga XML DTE (l10n_cl_dte_file existe en ambos modelos)
+        if not document.l10n_cl_dte_file:
+            raise UserError(_('Documento %s sin XML DTE') % document.name)
+        _logger.info(f"Documento regenerado para caso {case.case_number_raw}")
+        return document
 
     def _generate_fresh_dte_nodes(self, documents):
-        """Generar nodos DTE frescos para consolidado usando templates de Odoo"""
+        """Generar nodos DTE frescos para consolidado usando templates de Odoo
+
+        El proceso se divide en etapas:
+        1. Renderizado de todos los DTEs en el hilo ORM (qweb, montos, TED).
+        2. Firma, parseo y validación en un pool de hilos, cada uno con su
+           propio cursor, ya que la firma RSA + C14N es el cuello de botella.
+        3. Ensamblado en el mismo orden de entrada, registrando errores por documento.
+        """
         _logger.info(f"Generando DTEs frescos para {len(documents)} documentos en consolidado")
-        
-        dte_nodes = []
-        
-        for document in documents:
+
+        errors = []
+        cases_by_document = self._get_cases_by_batch_document(documents)
+        incremental = self.env.context.get('l10n_cl_edi_incremental_batch')
+
+        # 1. Renderizar todos los DTEs en el hilo ORM (o reutilizar los ya firmados)
+        rendered_dtes = []
+        reused_results = []
+        for index, document in enumerate(documents):
+            case = cases_by_document.get((document._name, document.id))
+            if incremental and case and case._is_batch_document_reusable():
+                reused_results.append({
+                    'index': index,
+                    'name': document.name,
+                    'dte_node': self._extract_dte_node_from_signed(case.batch_signed_dte),
+                })
+                continue
             try:
-                _logger.info(f"Generando DTE fresco para documento {document.name}")
-                
-                # Generar DTE fresco usando el template base de Odoo
-                fresh_dte_xml = self._generate_single_dte_for_consolidado(document)
-                
-                # DEBUG: Log del XML generado para entender la estructura
-                _logger.info(f"XML generado para {document.name} (primeros 500 chars): {fresh_dte_xml[:500]}")
-                
-                # Parsear el DTE generado
-                dte_root = etree.fromstring(fresh_dte_xml.encode('ISO-8859-1'))
-                
-                # DEBUG: Log de la estructura del XML parseado
-                _logger.info(f"Root tag: {dte_root.tag}")
-                _logger.info(f"Root children: {[child.tag for child in dte_root]}")
-                
-                # Buscar el nodo DTE con múltiples estrategias
-                dte_node = None
-                
-                # 1. Con namespace SiiDte
-                dte_node = dte_root.find('.//{http://www.sii.cl/SiiDte}DTE')
-                if dte_node is None:
-                    # 2. Sin namespace específico
-                    dte_node = dte_root.find('.//DTE')
-                if dte_node is None:
-                    # 3. Buscar por tag local
-                    for elem in dte_root.iter():
-                        if elem.tag.endswith('DTE'):
-                            dte_node = elem
-                            break
-                if dte_node is None:
-                    # 4. Si el root es un DTE directamente
-                    if dte_root.tag.endswith('DTE'):
-                        dte_node = dte_root
-                
-                if dte_node is not None:
-                    dte_nodes.append(dte_node)
-                    _logger.info(f"✓ DTE fresco generado para documento {document.name}")
-                else:
-                    _logger.warning(f"⚠️ No se pudo extraer nodo DTE del documento fresco {document.name}")
-                    _logger.warning(f"Estructura XML completa: {[elem.tag for elem in dte_root.iter()][:20]}")
-                    
+                rendered_dtes.append(self._render_dte_for_consolidado(document, index))
             except Exception as e:
-                _logger.error(f"Error generando DTE fresco para documento {document.name}: {str(e)}")
+                _logger.error(f"Error renderizando DTE fresco para documento {document.name}: {str(e)}")
+                errors.append(f"{document.name}: {str(e)}")
+
+        # 2. Firmar y validar en paralelo
+        signed_results = self._sign_rendered_dtes(rendered_dtes)
+
+        # Guardar DTEs firmados y su huella para futuras regeneraciones incrementales
+        for result in signed_results:
+            document = documents[result['index']]
+            case = cases_by_document.get((document._name, document.id))
+            if case and result.get('signed_xml'):
+                case.write({
+                    'batch_signed_dte': result['signed_xml'],
+                    'batch_fingerprint': case._get_batch_fingerprint(),
+                })
+
+        # 3. Ensamblar en orden determinístico
+        dte_nodes = []
+        for result in sorted(signed_results + reused_results, key=lambda r: r['index']):
+            if result.get('error'):
+                _logger.error(f"Error generando DTE fresco para documento {result['name']}: {result['error']}")
+                errors.append(f"{result['name']}: {result['error']}")
                 continue
-        
-        if not dte_nodes:
-            raise UserError(_('No se pudieron generar DTEs frescos para el consolidado'))
-        
+            dte_nodes.append(result['dte_node'])
+            _logger.info(f"✓ DTE fresco generado para documento {result['name']}")
+
+        if errors:
+            raise UserError(_('No se pudieron generar DTEs frescos para el consolidado:\n%s') % '\n'.join(errors))
+
         return dte_nodes
-    
-    def _generate_single_dte_for_consolidado(self, document):
-        """Generar un DTE individual fresco para uso en consolidado"""
+
+    def _get_cases_by_batch_document(self, documents):
+        """Mapear (modelo, id) de cada documento batch a su caso DTE en una sola búsqueda"""
+        move_ids = [d.id for d in documents if d._name == 'account.move']
+        picking_ids = [d.id for d in documents if d._name == 'stock.picking']
+        cases = self.env['l10n_cl_edi.certification.case.dte'].search([
+            '|',
+            ('generated_batch_account_move_id', 'in', move_ids),
+            ('generated_batch_stock_picking_id', 'in', picking_ids),
+        ])
+        cases_by_document = {}
+        for case in cases:
+            document = case._get_batch_document()
+            if document:
+                cases_by_document[(document._name, document.id)] = case
+        return cases_by_document
+
+    def _get_dte_signing_workers(self, document_count):
+        """Cantidad de hilos de firma (parámetro l10n_cl_edi_certification.dte_signing_workers)"""
+        param = self.env['ir.config_parameter'].sudo().get_param(
+            'l10n_cl_edi_certification.dte_signing_workers')
+        try:
+            workers = int(param) if param else min(4, os.cpu_count() or 1)
+        except ValueError:
+            _logger.warning(f"Parámetro dte_signing_workers inválido: {param}, usando firma secuencial")
+            workers = 1
+        return max(1, min(workers, document_count))
+
+    def _render_dte_for_consolidado(self, document, index=0):
+        """Renderizar (sin firmar) el DTE de un documento para el consolidado"""
         # Usar el método estándar de Odoo para generar DTE
         # pero en el contexto del consolidado y certificación
         document = document.with_context(l10n_cl_edi_certification=True)
         folio = int(document.l10n_latam_document_number)
         doc_id_number = 'F{}T{}'.format(folio, document.l10n_latam_document_type_id.code)
-        
+
         # Generar barcode XML necesario para el DTE
         dte_barcode_xml = document._l10n_cl_get_dte_barcode_xml()
-        
+
         # Renderizar DTE usando template base de Odoo
         dte_xml = self.env['ir.qweb']._render('l10n_cl_edi.dte_template', {
             'move': document,
@@ -660,191 +1149,212 @@ class CertificationBatchFile(models.Model):
             'dte': dte_barcode_xml['ted'],
             '__keep_empty_lines': True,
         })
-        
+
         # DEBUG: Verificar que el XML generado sea correcto
         _logger.debug(f"DTE XML generado para folio {folio}: {dte_xml[:200]}...")
-        
+
         # Verificar elementos clave del DTE
         if doc_id_number not in dte_xml:
             _logger.error(f"DTE generado no contiene ID esperado {doc_id_number}")
             raise UserError(_(f'DTE generado no contiene ID {doc_id_number}'))
-        
+
         if 'TED' not in dte_xml:
             _logger.warning(f"DTE para folio {folio} no contiene TED (Timbre Electrónico)")
-        
+
         _logger.debug(f"DTE para folio {folio} validado - contiene ID y estructura básica")
-        
-        # Firmar el DTE individual
+
+        # Certificado digital (se resuelve aquí para que los hilos solo reciban su id)
         digital_signature = document.company_id.sudo()._get_digital_signature(user_id=self.env.user.id)
-        
-        # Debug: Verificar que tenemos certificado digital
         if not digital_signature:
             _logger.error(f"No se encontró certificado digital para documento {doc_id_number}")
             raise UserError(_("No se encontró certificado digital. Verifique la configuración de la empresa."))
-        
-        _logger.debug(f"Firmando DTE {doc_id_number} con certificado: {digital_signature.subject_common_name}")
-        
-        signed_dte = document._sign_full_xml(
-            dte_xml, 
-            digital_signature, 
-            doc_id_number,
-            'doc',  # Tipo de documento (no envío)
-            document.l10n_latam_document_type_id._is_doc_type_voucher()  # Verificar si es voucher
-        )
-        
-        # Debug: Verificar que la firma se aplicó
-        if '<?xml' in signed_dte and 'Signature' in signed_dte:
-            _logger.debug(f"DTE {doc_id_number} firmado exitosamente")
-        else:
-            _logger.warning(f"DTE {doc_id_number} no contiene estructura de firma esperada")
-        
-        # Debug: Verificar que el DTE fue firmado correctamente
-        _logger.debug(f"DTE {doc_id_number} firmado. Verificando estructura...")
-        
-        # Validar estructura básica (validación suave)
-        if self._validate_individual_signature(signed_dte, doc_id_number):
-            _logger.info(f"DTE {doc_id_number} firmado y validado exitosamente")
-        else:
-            _logger.warning(f"DTE {doc_id_number} tiene problemas de firma, pero continuando con procesamiento")
-        
-        # TEMPORAL: Deshabilitar limpieza y normalización que causan problemas de encoding
-        # cleaned_dte = self._clean_dte_namespaces(signed_dte)
-        # normalized_dte = self._normalize_xml_output(cleaned_dte)
-        
-        # Retornar el DTE firmado tal como viene del módulo base
-        return signed_dte
-    
-    def _extract_dte_nodes(self, documents):
-        """OBSOLETO: Método anterior que extraía DTEs existentes"""
-        # Ahora usamos _generate_fresh_dte_nodes en su lugar
-        return self._generate_fresh_dte_nodes(documents)
-
-    def _build_consolidated_setdte(self, process, dte_nodes, set_type):
-        """Construir XML consolidado con carátula y múltiples DTEs"""
-        _logger.info(f"Construyendo XML consolidado para {len(dte_nodes)} DTEs")
-        
-        # Crear estructura base del EnvioDTE con namespaces correctos
-        nsmap = {
-            None: 'http://www.sii.cl/SiiDte',  # Namespace por defecto
-            'xsi': 'http://www.w3.org/2001/XMLSchema-instance'
+
+        return {
+            'index': index,
+            'name': document.name,
+            'doc_id': doc_id_number,
+            'xml': str(dte_xml),
+            'is_voucher': document.l10n_latam_document_type_id._is_doc_type_voucher(),
+            'signature_model': digital_signature._name,
+            'signature_id': digital_signature.id,
         }
-        
-        envio_root = etree.Element('EnvioDTE', nsmap=nsmap)
-        envio_root.set('{http://www.w3.org/2001/XMLSchema-instance}schemaLocation', 
-                       'http://www.sii.cl/SiiDte EnvioDTE_v10.xsd')
-        envio_root.set('version', '1.0')
-        
-        # Crear SetDTE
-        set_dte = etree.SubElement(envio_root, 'SetDTE')
-        set_dte.set('ID', 'SetDoc')
-        
-        # Crear carátula consolidada
-        caratula = self._build_consolidated_caratula(process, dte_nodes, set_type)
-        set_dte.append(caratula)
-        
-        # Agregar todos los nodos DTE
-        for dte_node in dte_nodes:
-            set_dte.append(dte_node)
-        
-        # Construir XML consolidado manualmente (bypass template incompatible)
-        company = process.company_id
-        digital_signature_sudo = company.sudo()._get_digital_signature(user_id=self.env.user.id)
-        
-        # Convertir estructura lxml a string SIN declaración XML
+
+    def _sign_rendered_dtes(self, rendered_dtes):
+        """Firmar DTEs ya renderizados, en paralelo cuando hay más de un hilo disponible"""
+        if not rendered_dtes:
+            return []
+
+        workers = self._get_dte_signing_workers(len(rendered_dtes))
+        start_time = time.time()
+
+        if workers == 1:
+            results = [self._sign_and_extract_dte(self.env, rendered) for rendered in rendered_dtes]
+        else:
+            _logger.info(f"Firmando {len(rendered_dtes)} DTEs con {workers} hilos")
+            uid, context = self.env.uid, dict(self.env.context)
+
+            def sign_in_thread(rendered):
+                # Cada hilo usa su propio cursor: el cursor ORM no es thread-safe
+                try:
+                    with self.pool.cursor() as cr:
+                        env = api.Environment(cr, uid, context)
+                        return self._sign_and_extract_dte(env, rendered)
+                except Exception as e:
+                    return {'index': rendered['index'], 'name': rendered['name'], 'error': str(e)}
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dte_signing') as executor:
+                results = list(executor.map(sign_in_thread, rendered_dtes))
+
+        _logger.info(f"Firma de {len(rendered_dtes)} DTEs completada en {time.time() - start_time:.2f}s")
+        return results
+
+    def _sign_and_extract_dte(self, env, rendered):
+        """Firmar un DTE renderizado y extraer su nodo DTE (sin acceso a registros del lote)"""
+        doc_id_number = rendered['doc_id']
         try:
-            xml_string = etree.tostring(
-                envio_root, 
-                encoding='ISO-8859-1', 
-                xml_declaration=False, 
-                pretty_print=True
-            ).decode('ISO-8859-1')
-            _logger.info(f"XML consolidado generado exitosamente con {len(dte_nodes)} DTEs")
+            digital_signature = env[rendered['signature_model']].sudo().browse(rendered['signature_id'])
+
+            _logger.debug(f"Firmando DTE {doc_id_number} con certificado: {digital_signature.subject_common_name}")
+
+            signed_dte = env['account.move']._sign_full_xml(
+                rendered['xml'],
+                digital_signature,
+                doc_id_number,
+                'doc',  # Tipo de documento (no envío)
+                rendered['is_voucher']
+            )
+
+            # Debug: Verificar que la firma se aplicó
+            if '<?xml' in signed_dte and 'Signature' in signed_dte:
+                _logger.debug(f"DTE {doc_id_number} firmado exitosamente")
+            else:
+                _logger.warning(f"DTE {doc_id_number} no contiene estructura de firma esperada")
+
+            # Validar estructura básica (validación suave)
+            if self._validate_individual_signature(signed_dte, doc_id_number):
+                _logger.info(f"DTE {doc_id_number} firmado y validado exitosamente")
+            else:
+                _logger.warning(f"DTE {doc_id_number} tiene problemas de firma, pero continuando con procesamiento")
+
+            dte_node = self._extract_dte_node_from_signed(signed_dte)
+            if dte_node is None:
+                return {'index': rendered['index'], 'name': rendered['name'],
+                        'error': 'No se pudo extraer nodo DTE del documento fresco'}
+
+            return {'index': rendered['index'], 'name': rendered['name'], 'dte_node': dte_node,
+                    'signed_xml': str(signed_dte)}
+
         except Exception as e:
-            _logger.error(f"Error generando XML consolidado: {str(e)}")
-            raise UserError(_('Error al construir XML consolidado: %s') % str(e))
-        
-        # Firmar usando el método estándar de Odoo (que agregará la declaración XML)
-        signed_xml = self.env['account.move']._sign_full_xml(
-            xml_string, 
-            digital_signature_sudo, 
-            'SetDoc',
-            'env',  # Tipo de envío
-            False   # No es voucher
-        )
-        
-        # TEMPORAL: Deshabilitar normalización que causa problemas de encoding
-        # signed_xml = self._normalize_xml_output(signed_xml)
-        
-        # Aplicar solo la corrección mínima necesaria para schema
-        if signed_xml.startswith('<?xml') and '?><EnvioDTE' in signed_xml:
-            decl_end = signed_xml.find('?>') + 2
-            xml_declaration = signed_xml[:decl_end]
-            xml_body = signed_xml[decl_end:]
-            signed_xml = xml_declaration + '\n' + xml_body
-            _logger.debug("Aplicada corrección mínima de schema - separación XML")
-        
-        # Validar estructura final del SetDTE
-        if not self._validate_setdte_structure(signed_xml):
-            _logger.error("Estructura final del SetDTE inválida")
-            raise UserError(_('La estructura final del SetDTE no es válida.'))
-        
+            return {'index': rendered['index'], 'name': rendered['name'], 'error': str(e)}
+
+    def _extract_dte_node_from_signed(self, signed_dte_xml):
+        """Parsear un DTE firmado y devolver su nodo DTE"""
+        dte_root = etree.fromstring(signed_dte_xml.encode('ISO-8859-1'))
+
+        # 1. Con namespace SiiDte
+        dte_node = dte_root.find('.//{http://www.sii.cl/SiiDte}DTE')
+        if dte_node is None:
+            # 2. Sin namespace específico
+            dte_node = dte_root.find('.//DTE')
+        if dte_node is None:
+            # 3. Buscar por tag local
+            for elem in dte_root.iter():
+                if elem.tag.endswith('DTE'):
+                    dte_node = elem
+                    break
+        if dte_node is None:
+            # 4. Si el root es un DTE directamente
+            if dte_root.tag.endswith('DTE'):
+                dte_node = dte_root
+
+        if dte_node is None:
+            _logger.warning(f"Estructura XML completa: {[elem.tag for elem in dte_root.iter()][:20]}")
+
+        return dte_node
+
+    def _write_consolidated_setdte(self, process, dte_nodes, set_type, stream):
+        """Escribir el EnvioDTE consolidado directamente en un stream binario
+
+        Cada fragmento (Carátula y DTEs firmados) se serializa y escribe una sola vez,
+        y el digest SHA1 del SetDTE se calcula de forma incremental sobre su forma
+        canónica, sin construir ni re-parsear el envío completo en memoria.
+        """
+        _logger.info(f"Escribiendo XML consolidado en streaming para {len(dte_nodes)} DTEs")
+
+        company = process.company_id
+        digital_signature_sudo = company.sudo()._get_digital_signature(user_id=self.env.user.id)
+        if not digital_signature_sudo:
+            raise UserError(_("No se encontró certificado digital. Verifique la configuración de la empresa."))
+
+        # Validar cada DTE antes de escribirlo (reemplaza el re-parseo del envío final)
+        for i, dte_node in enumerate(dte_nodes):
+            if dte_node.find('.//{http://www.w3.org/2000/09/xmldsig#}Signature') is None:
+                raise UserError(_('El DTE %d no tiene firma individual') % (i + 1))
+
+        caratula = self._build_consolidated_caratula(process, dte_nodes, set_type)
+        digest = hashlib.sha1(SETDTE_C14N_OPEN)
+
+        stream.write(b'<?xml version="1.0" encoding="ISO-8859-1" ?>\n')
+        stream.write(ENVIODTE_OPEN)
+        stream.write(SETDTE_OPEN)
+
+        for node in [caratula] + list(dte_nodes):
+            fragment = b'\n' + etree.tostring(node, encoding='ISO-8859-1', xml_declaration=False, with_tail=False)
+            stream.write(fragment)
+            digest.update(self._get_setdte_fragment_c14n(fragment))
+
+        stream.write(b'\n</SetDTE>')
+        digest.update(b'\n</SetDTE>')
+
+        # Firmar el SetDoc con el digest calculado
+        signature = self._build_setdte_signature(base64.b64encode(digest.digest()).decode(), digital_signature_sudo)
+        stream.write(signature.encode('ISO-8859-1'))
+        stream.write(b'</EnvioDTE>')
+
         _logger.info(f"XML consolidado firmado digitalmente con {len(dte_nodes)} DTEs validados")
-        
-        return signed_xml
-        
-    def _validate_setdte_structure(self, setdte_xml):
-        """Validar estructura básica del SetDTE firmado"""
-        try:
-            # Parsear XML
-            root = etree.fromstring(setdte_xml.encode('ISO-8859-1'))
-            
-            # Verificar elemento raíz
-            if root.tag != '{http://www.sii.cl/SiiDte}EnvioDTE':
-                _logger.error(f"Elemento raíz incorrecto: {root.tag}")
-                return False
-            
-            # Verificar SetDTE
-            setdte_elem = root.find('.//{http://www.sii.cl/SiiDte}SetDTE')
-            if setdte_elem is None:
-                _logger.error("No se encontró elemento SetDTE")
-                return False
-            
-            # Verificar ID del SetDTE
-            if setdte_elem.get('ID') != 'SetDoc':
-                _logger.error(f"ID del SetDTE incorrecto: {setdte_elem.get('ID')}")
-                return False
-            
-            # Verificar Carátula
-            caratula = setdte_elem.find('.//{http://www.sii.cl/SiiDte}Caratula')
-            if caratula is None:
-                _logger.error("No se encontró Carátula en SetDTE")
-                return False
-            
-            # Verificar que hay DTEs
-            dtes = setdte_elem.findall('.//{http://www.sii.cl/SiiDte}DTE')
-            if not dtes:
-                _logger.error("No se encontraron DTEs en SetDTE")
-                return False
-            
-            # Verificar firma del SetDTE
-            setdte_signature = setdte_elem.find('.//{http://www.w3.org/2000/09/xmldsig#}Signature')
-            if setdte_signature is None:
-                _logger.error("No se encontró firma en SetDTE")
-                return False
-            
-            # Verificar que cada DTE tenga su firma individual
-            for i, dte in enumerate(dtes):
-                dte_signature = dte.find('.//{http://www.w3.org/2000/09/xmldsig#}Signature')
-                if dte_signature is None:
-                    _logger.error(f"DTE {i+1} no tiene firma individual")
-                    return False
-            
-            _logger.info(f"Estructura SetDTE válida con {len(dtes)} DTEs firmados")
-            return True
-            
-        except Exception as e:
-            _logger.error(f"Error validando estructura SetDTE: {str(e)}")
-            return False
+
+    def _get_setdte_fragment_c14n(self, fragment):
+        """Forma canónica (C14N) de un fragmento tal como queda dentro del SetDTE"""
+        wrapper = etree.fromstring(
+            b'<?xml version="1.0" encoding="ISO-8859-1"?>' + SETDTE_C14N_OPEN + fragment + b'</SetDTE>'
+        )
+        canonical = etree.tostring(wrapper, method='c14n')
+        return canonical[len(SETDTE_C14N_OPEN):-len(b'</SetDTE>')]
+
+    def _build_setdte_signature(self, digest_value, digital_signature):
+        """Construir el nodo Signature del SetDoc a partir de su digest"""
+        account_move = self.env['account.move']
+        signed_info = self.env['ir.qweb']._render('l10n_cl_edi.signed_info_template_with_xsi', {
+            'uri': '#SetDoc',
+            'digest_value': digest_value,
+        })
+        signed_info_c14n = Markup(etree.tostring(
+            etree.fromstring(str(signed_info)), method='c14n', exclusive=False,
+            with_comments=False, inclusive_ns_prefixes=None).decode())
+
+        if hasattr(digital_signature, '_get_public_key_numbers_bytes'):
+            # Certificado genérico (certificate.certificate)
+            exponent, modulus = digital_signature._get_public_key_numbers_bytes(formatting='base64')
+            signature_values = {
+                'signature_value': digital_signature._sign(
+                    signed_info_c14n.encode('utf-8'), hashing_algorithm='sha1', formatting='base64').decode(),
+                'modulus': modulus.decode(),
+                'exponent': exponent.decode(),
+                'certificate': '\n' + textwrap.fill(
+                    digital_signature._get_der_certificate_bytes(formatting='base64').decode(), 64),
+            }
+        else:
+            # Certificado propio de la localización (l10n_cl.certificate)
+            signature_values = {
+                'signature_value': account_move._sign_message(
+                    signed_info_c14n.encode('utf-8'), digital_signature.private_key.encode('ascii')),
+                'modulus': digital_signature._get_private_key_modulus(),
+                'exponent': digital_signature._get_private_key_exponent(),
+                'certificate': '\n' + textwrap.fill(digital_signature.certificate, 64),
+            }
+
+        return str(self.env['ir.qweb']._render('l10n_cl_edi.signature_template', dict(
+            signature_values, signed_info=signed_info_c14n)))
 
     def _validate_individual_signature(self, signed_dte_xml, doc_id):
         """Validar que la firma individual del DTE sea válida"""
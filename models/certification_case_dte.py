@@ -1,10 +1,26 @@
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+import hashlib
+import json
 import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+from psycopg2.errors import DeadlockDetected, LockNotAvailable, SerializationFailure
 
 _logger = logging.getLogger(__name__)
 
+# Crons que procesan la cola de generación de casos (cada cron es un worker independiente)
+DTE_CASE_CRON_XMLIDS = (
+    'l10n_cl_edi_certification.ir_cron_generate_dte_cases',
+    'l10n_cl_edi_certification.ir_cron_generate_dte_cases_2',
+)
+# Intentos máximos de un caso interrumpido antes de marcarlo con error
+DTE_CASE_MAX_ATTEMPTS = 3
+# Conflictos transitorios entre workers paralelos: el caso vuelve a la cola
+PG_CONCURRENCY_ERRORS = (SerializationFailure, LockNotAvailable, DeadlockDetected)
+
 
 class CertificationCaseDte(models.Model):
     _name = 'l10n_cl_edi.certification.case.dte'
@@ -34,9 +50,23 @@ class CertificationCaseDte(models.Model):
     # Estado de generación
     generation_status = fields.Selection([
         ('pending', 'Pendiente'),
+        ('queued', 'En Cola'),
+        ('generating', 'Generando'),
         ('generated', 'Generado'),
         ('error', 'Error')
     ], string='Estado Generación', default='pending', track_visibility='onchange')
+    generation_attempts = fields.Integer(
+        string='Intentos de Generación',
+        readonly=True,
+        copy=False,
+        help='Veces que un worker tomó el caso desde la cola de generación'
+    )
+    generation_heartbeat = fields.Datetime(
+        string='Inicio Generación',
+        readonly=True,
+        copy=False,
+        help='Momento en que un worker tomó el caso; permite reanudar casos de workers caídos'
+    )
     
     # Documentos generados
     generated_account_move_id = fields.Many2one(
@@ -111,6 +141,20 @@ class CertificationCaseDte(models.Model):
     
     # Texto original
     raw_text_block = fields.Text(string='Bloque de Texto Original del Caso')
+
+    # Regeneración incremental de envíos consolidados
+    batch_fingerprint = fields.Char(
+        string='Huella Batch',
+        readonly=True,
+        copy=False,
+        help='Huella de los datos del caso con que se firmó el DTE batch vigente'
+    )
+    batch_signed_dte = fields.Text(
+        string='DTE Batch Firmado',
+        readonly=True,
+        copy=False,
+        help='Último DTE batch firmado, reutilizable mientras la huella no cambie'
+    )
     
     @api.depends('case_number_raw')
     def _compute_case_number_display(self):
@@ -137,6 +181,358 @@ class CertificationCaseDte(models.Model):
             else:
                 record.document_type_name = "Sin tipo"
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._mark_processes_reconcile_dirty()
+        return records
+
+    def write(self, vals):
+        result = super().write(vals)
+        if not self.env.context.get('l10n_cl_edi_reconciling'):
+            self._mark_processes_reconcile_dirty()
+        return result
+
+    def unlink(self):
+        processes = self.parsed_set_id.certification_process_id
+        result = super().unlink()
+        processes._mark_reconcile_dirty()
+        return result
+
+    def _mark_processes_reconcile_dirty(self):
+        """Marcar los procesos de estos casos para conciliar en la próxima apertura"""
+        self.parsed_set_id.certification_process_id._mark_reconcile_dirty()
+
+
+    # ------------------------------------------------------------------
+    # Grafo de referencias entre casos
+    # ------------------------------------------------------------------
+
+    def _resolve_reference_targets(self):
+        """
+        Resolver una sola vez las referencias de estos casos al caso referenciado, por número
+        de caso SII dentro del mismo proceso, y dejarlas vinculadas en referenced_case_dte_id.
+
+        Los números sin vincular se resuelven con una sola búsqueda para todo el recordset.
+        Las referencias cuyo caso no existe se recuerdan hasta el fin de la transacción del
+        cursor actual y no se vuelven a buscar en ella (siguen informándose como faltantes).
+
+        Returns:
+            tuple: ({id del caso: ids de casos referenciados}, referencias sin caso encontrado)
+        """
+        known_missing = self._get_unresolved_reference_ids()
+        unresolved_numbers = {
+            reference.referenced_sii_case_number
+            for reference in self.reference_ids
+            if not reference.referenced_case_dte_id and reference.referenced_sii_case_number
+            and reference.id not in known_missing
+        }
+        cases_by_number = {}
+        if unresolved_numbers:
+            processes = self.parsed_set_id.certification_process_id
+            for case in self.search([
+                ('parsed_set_id.certification_process_id', 'in', processes.ids),
+                ('case_number_raw', 'in', list(unresolved_numbers)),
+            ]):
+                cases_by_number.setdefault((case.parsed_set_id.certification_process_id.id, case.case_number_raw), case)
+
+        reference_model = self.env['l10n_cl_edi.certification.case.dte.reference']
+        dependencies = {}
+        missing = reference_model
+        links = defaultdict(list)
+        for case in self:
+            process_id = case.parsed_set_id.certification_process_id.id
+            targets = set()
+            for reference in case.reference_ids:
+                target = reference.referenced_case_dte_id
+                if not target and reference.referenced_sii_case_number:
+                    target = cases_by_number.get((process_id, reference.referenced_sii_case_number))
+                    if target:
+                        links[target.id].append(reference.id)
+                    else:
+                        missing |= reference
+                if target and target != case:
+                    targets.add(target.id)
+            dependencies[case.id] = targets
+
+        for target_id, reference_ids in links.items():
+            reference_model.browse(reference_ids).write({'referenced_case_dte_id': target_id})
+        if set(missing.ids) - known_missing:
+            known_missing.update(missing.ids)
+            self.env.cr.postcommit.add(known_missing.clear)
+            self.env.cr.postrollback.add(known_missing.clear)
+        return dependencies, missing
+
+    def _get_unresolved_reference_ids(self):
+        """
+        Ids de referencias cuyo caso referenciado no existe, ya buscadas en la transacción en
+        curso de este cursor (cada worker y cada trabajo batch tienen el suyo)
+        """
+        return self.env.cr.cache.setdefault('l10n_cl_edi_unresolved_references', set())
+
+    def _prefetch_referenced_documents(self):
+        """
+        Leer en bloque los documentos (individual y batch) de los casos referenciados por estos
+        casos, para que los generadores de la misma transacción los tomen de la caché del ORM.
+        Debe llamarse en el cursor que genera: el del worker o el del trabajo batch.
+        """
+        referenced_cases = self.reference_ids.referenced_case_dte_id
+        referenced_moves = referenced_cases.generated_account_move_id | referenced_cases.generated_batch_account_move_id
+        referenced_moves.read(['name', 'state', 'l10n_latam_document_number', 'l10n_latam_document_type_id'])
+
+    def _get_generation_waves(self):
+        """
+        Ordenar los casos en oleadas según el grafo de referencias (orden topológico): los
+        casos de una oleada solo dependen de oleadas anteriores o de casos fuera de este
+        conjunto, por lo que son independientes entre sí y pueden generarse en paralelo.
+
+        Returns:
+            list: recordsets de casos, uno por oleada, respetando el orden original en cada una
+        """
+        dependencies, missing = self._resolve_reference_targets()
+        if missing:
+            raise UserError(_('Referencias a casos inexistentes en el proceso:\n%s') % '\n'.join(
+                f"Caso {reference.case_dte_id.case_number_raw} → caso {reference.referenced_sii_case_number}"
+                for reference in missing
+            ))
+
+        position = {case_id: index for index, case_id in enumerate(self.ids)}
+        pending_count = {}
+        dependents = defaultdict(list)
+        for case_id, targets in dependencies.items():
+            targets = targets & position.keys()
+            pending_count[case_id] = len(targets)
+            for target_id in targets:
+                dependents[target_id].append(case_id)
+
+        waves = []
+        ready = [case_id for case_id in self.ids if not pending_count[case_id]]
+        while ready:
+            waves.append(self.browse(ready))
+            next_ready = []
+            for case_id in ready:
+                for dependent_id in dependents[case_id]:
+                    pending_count[dependent_id] -= 1
+                    if not pending_count[dependent_id]:
+                        next_ready.append(dependent_id)
+            ready = sorted(next_ready, key=position.get)
+
+        scheduled = sum(len(wave) for wave in waves)
+        if scheduled < len(self):
+            blocked = self.filtered(lambda case: pending_count[case.id])
+            raise UserError(_('Referencias circulares entre los casos (o casos que dependen de ellas): %s') % ', '.join(
+                blocked.mapped('case_number_raw')))
+
+        _logger.info(f"🗂️ {len(self)} casos programados en {len(waves)} oleadas: " + ' | '.join(
+            ', '.join(f"{case.case_number_raw}({case.document_type_code})" for case in wave) for wave in waves))
+        return waves
+
+    # ------------------------------------------------------------------
+    # Cola de generación de documentos
+    # ------------------------------------------------------------------
+
+    def _trigger_generation_crons(self):
+        """Despertar a los workers que procesan la cola de generación"""
+        for xmlid in DTE_CASE_CRON_XMLIDS:
+            cron = self.env.ref(xmlid, raise_if_not_found=False)
+            if cron:
+                cron._trigger()
+
+    @api.model
+    def _cron_generate_queued_cases(self):
+        """
+        Worker de la cola de generación: toma casos en cola de a uno y genera su documento,
+        confirmando cada caso. Varios workers pueden ejecutarse a la vez sobre la misma cola.
+        """
+        self._requeue_stalled_cases()
+
+        # El mapa de productos vive en la caché de este cursor: cargarlo una vez para la cola
+        queued_cases = self.search([('generation_status', '=', 'queued')])
+        if queued_cases:
+            self.env['l10n_cl_edi.certification.document.generator']._prefetch_item_products(queued_cases)
+            self.env.cr.commit()
+
+        batch_files = self.env['l10n_cl_edi.certification.batch_file']
+        time_budget = batch_files._get_batch_job_param('dte_generation_time_budget', 600)
+        start = time.monotonic()
+        while time.monotonic() - start < time_budget:
+            case = self._claim_next_queued_case()
+            if not case:
+                break
+            case._generate_claimed_case()
+
+        # Quedan casos en cola: continuar en una nueva ejecución del cron
+        if self.search_count([('generation_status', '=', 'queued')], limit=1):
+            self._trigger_generation_crons()
+
+    @api.model
+    def _requeue_stalled_cases(self):
+        """Reencolar casos 'generating' de workers caídos o detenidos por límite de tiempo"""
+        batch_files = self.env['l10n_cl_edi.certification.batch_file']
+        timeout = batch_files._get_batch_job_param('dte_generation_timeout_minutes', 15)
+        stalled_cases = self.search([
+            ('generation_status', '=', 'generating'),
+            ('generation_heartbeat', '<', fields.Datetime.now() - timedelta(minutes=timeout)),
+        ])
+        for case in stalled_cases:
+            if case.generation_attempts >= DTE_CASE_MAX_ATTEMPTS:
+                _logger.error(f"❌ Caso {case.case_number_raw} abandonado tras {case.generation_attempts} intentos")
+                case.write({
+                    'generation_status': 'error',
+                    'error_message': _('La generación se interrumpió %d veces sin completarse') % case.generation_attempts,
+                })
+            else:
+                _logger.warning(f"⚠️ Caso {case.case_number_raw} sin terminar desde {case.generation_heartbeat}, reencolando")
+                case.generation_status = 'queued'
+        if stalled_cases:
+            self.env.cr.commit()
+
+    @api.model
+    def _claim_next_queued_case(self):
+        """
+        Tomar el caso en cola más antiguo cuyos casos referenciados (vinculados al encolar, ver
+        _get_generation_waves) ya no estén en cola ni generándose: las notas esperan a su
+        documento de origen. SKIP LOCKED evita que dos workers tomen el mismo caso.
+        """
+        self.flush_model(['generation_status'])
+        self.env['l10n_cl_edi.certification.case.dte.reference'].flush_model(['case_dte_id', 'referenced_case_dte_id'])
+        self.env.cr.execute("""
+            SELECT c.id
+              FROM l10n_cl_edi_certification_case_dte c
+             WHERE c.generation_status = 'queued'
+               AND NOT EXISTS (
+                    SELECT 1
+                      FROM l10n_cl_edi_certification_case_dte_reference r
+                      JOIN l10n_cl_edi_certification_case_dte t ON t.id = r.referenced_case_dte_id
+                     WHERE r.case_dte_id = c.id
+                       AND t.id != c.id
+                       AND t.generation_status IN ('queued', 'generating')
+               )
+             ORDER BY c.id
+             LIMIT 1
+               FOR UPDATE OF c SKIP LOCKED
+        """)
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.browse()
+        case = self.browse(row[0])
+        case.write({
+            'generation_status': 'generating',
+            'generation_attempts': case.generation_attempts + 1,
+            'generation_heartbeat': fields.Datetime.now(),
+        })
+        self.env.cr.commit()
+        return case
+
+    def _generate_claimed_case(self):
+        """Generar el documento de un caso tomado de la cola y confirmar el resultado"""
+        self.ensure_one()
+        process = self.parsed_set_id.certification_process_id
+        case = self.with_company(process.company_id)
+        try:
+            # Sin costo si el mapa del worker ya está cargado; lo repone tras un rollback
+            self.env['l10n_cl_edi.certification.document.generator']._prefetch_item_products(self)
+            # Referencias y documentos referenciados, resueltos en el cursor de este worker
+            case._resolve_reference_targets()
+            case._prefetch_referenced_documents()
+            generator = self.env['l10n_cl_edi.certification.document.generator'].with_company(process.company_id).create({
+                'dte_case_id': case.id,
+                'certification_process_id': process.id,
+            })
+            generator.generate_document()
+            if self.generation_status == 'generating':
+                # Documento existente recuperado: el generador lo vincula sin marcar el caso
+                self.generation_status = 'generated'
+            _logger.info(f"✅ Documento generado para caso {self.case_number_raw}")
+        except PG_CONCURRENCY_ERRORS as e:
+            self.env.cr.rollback()
+            if self.generation_attempts >= DTE_CASE_MAX_ATTEMPTS:
+                _logger.error(f"❌ Caso {self.case_number_raw} abandonado tras {self.generation_attempts} conflictos de concurrencia")
+                self.write({
+                    'generation_status': 'error',
+                    'error_message': _('Conflicto de concurrencia en %d intentos: %s') % (self.generation_attempts, e),
+                })
+            else:
+                _logger.warning(f"⚠️ Conflicto de concurrencia generando caso {self.case_number_raw}, reencolando: {e}")
+                self.generation_status = 'queued'
+        except Exception as e:
+            self.env.cr.rollback()
+            _logger.error(f"❌ Error generando DTE para caso {self.case_number_raw}: {str(e)}")
+            self.write({
+                'generation_status': 'error',
+                'error_message': str(e),
+            })
+        self.env.cr.commit()
+
+        # Último caso del proceso: actualizar su estado
+        if not self.search_count([
+            ('parsed_set_id.certification_process_id', '=', process.id),
+            ('generation_status', 'in', ('queued', 'generating')),
+        ], limit=1):
+            process.check_certification_status()
+            self.env.cr.commit()
+
+    def _get_batch_document(self):
+        """Documento batch vigente del caso (guía para tipo 52, factura/nota para el resto)"""
+        self.ensure_one()
+        if self.document_type_code == '52':
+            return self.generated_batch_stock_picking_id
+        return self.generated_batch_account_move_id
+
+    def _get_batch_fingerprint(self):
+        """
+        Huella de los datos de entrada del documento batch: campos del caso, ítems,
+        referencias (incluido el folio batch del documento referenciado), partner y folio.
+        """
+        self.ensure_one()
+        skip_fields = {
+            'batch_fingerprint', 'batch_signed_dte', 'generation_status', 'error_message', 'notes',
+            'generation_attempts', 'generation_heartbeat',
+            'generated_account_move_id', 'generated_batch_account_move_id',
+            'generated_stock_picking_id', 'generated_batch_stock_picking_id',
+        }
+        case_values = {
+            name: self[name]
+            for name, field in self._fields.items()
+            if field.store and not field.relational and not field.automatic and name not in skip_fields
+        }
+
+        items = [
+            (item.sequence, item.name, item.quantity, item.uom_raw, item.price_unit,
+             item.discount_percent, item.is_exempt)
+            for item in self.item_ids
+        ]
+
+        set_cases = {case.case_number_raw: case for case in self.parsed_set_id.dte_case_ids}
+        references = []
+        for reference in self.reference_ids:
+            referenced_case = reference.referenced_case_dte_id or set_cases.get(reference.referenced_sii_case_number)
+            referenced_document = referenced_case._get_batch_document() if referenced_case else None
+            references.append((
+                reference.sequence, reference.reference_document_text_raw, reference.referenced_sii_case_number,
+                reference.reason_raw, reference.reference_code,
+                referenced_document.l10n_latam_document_number if referenced_document else None,
+            ))
+
+        document = self._get_batch_document()
+        payload = {
+            'case': case_values,
+            'items': items,
+            'references': references,
+            'partner': self.partner_id.id,
+            'folio': document.l10n_latam_document_number if document else None,
+        }
+        return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _is_batch_document_reusable(self):
+        """Indica si el documento batch y su DTE firmado siguen vigentes para los datos actuales"""
+        self.ensure_one()
+        document = self._get_batch_document()
+        if not document or not document.l10n_cl_dte_file or not self.batch_signed_dte:
+            return False
+        if document._name == 'account.move' and document.state != 'posted':
+            return False
+        return self.batch_fingerprint == self._get_batch_fingerprint()
 
     @api.model
     def search_read(self, domain=None, fields=None, offset=0, limit=None, order=None):
@@ -161,67 +557,81 @@ class CertificationCaseDte(models.Model):
     def _sync_generation_status(self):
         """
         Sincroniza el estado de generación de los casos DTE con los documentos existentes.
+
+        Opera sobre todo el recordset con un número constante de consultas: los documentos
+        vinculados se validan en bloque, los documentos candidatos de los casos sin vínculo
+        se buscan con una consulta por modelo y los cambios se escriben agrupados por valor.
         """
+        if not self:
+            return
+
+        # Documentos vinculados que siguen existiendo y no están cancelados
+        active_moves = self.generated_account_move_id.exists().filtered(lambda m: m.state != 'cancel')
+        active_pickings = self.generated_stock_picking_id.exists().filtered(lambda p: p.state != 'cancel')
+
+        # Candidatos para casos sin documento vinculado (por clave del caso)
+        unlinked = self.filtered(lambda c: not c.generated_account_move_id and not c.generated_stock_picking_id)
+        candidate_moves = {}
+        candidate_pickings = {}
+        if unlinked:
+            for move in self.env['account.move'].search([
+                ('l10n_cl_edi_certification_case_id', 'in', unlinked.ids),
+                ('state', '!=', 'cancel')
+            ]):
+                case = move.l10n_cl_edi_certification_case_id
+                if move != case.generated_batch_account_move_id:
+                    candidate_moves.setdefault(case.id, move)
+            for picking in self.env['stock.picking'].search([
+                ('l10n_cl_edi_certification_case_id', 'in', unlinked.ids),
+                ('state', '!=', 'cancel')
+            ]):
+                case = picking.l10n_cl_edi_certification_case_id
+                if picking != case.generated_batch_stock_picking_id:
+                    candidate_pickings.setdefault(case.id, picking)
+
+        # Resolver en memoria: {valores a escribir: ids de casos}
+        updates = defaultdict(list)
         for record in self:
-            try:
-                # Verificar si hay factura vinculada
-                if record.generated_account_move_id:
-                    # Si hay factura vinculada, verificar que exista y esté activa
-                    if record.generated_account_move_id.exists() and record.generated_account_move_id.state != 'cancel':
-                        # Factura existe y está activa
-                        if record.generation_status != 'generated':
-                            record.generation_status = 'generated'
-                            _logger.info(f"Sincronizado caso {record.id}: estado → 'generated'")
-                    else:
-                        # Factura no existe o está cancelada, desvincular
-                        record.generated_account_move_id = False
-                        record.generation_status = 'pending'
-                        _logger.info(f"Sincronizado caso {record.id}: factura inexistente, estado → 'pending'")
-                
-                # Verificar si hay guía de despacho vinculada
-                elif record.generated_stock_picking_id:
-                    # Si hay guía vinculada, verificar que exista y esté activa
-                    if record.generated_stock_picking_id.exists() and record.generated_stock_picking_id.state != 'cancel':
-                        # Guía existe y está activa
-                        if record.generation_status != 'generated':
-                            record.generation_status = 'generated'
-                            _logger.info(f"Sincronizado caso {record.id}: estado → 'generated' (guía)")
-                    else:
-                        # Guía no existe o está cancelada, desvincular
-                        record.generated_stock_picking_id = False
-                        record.generation_status = 'pending'
-                        _logger.info(f"Sincronizado caso {record.id}: guía inexistente, estado → 'pending'")
-                
+            if record.generated_account_move_id:
+                if record.generated_account_move_id in active_moves:
+                    if record.generation_status != 'generated':
+                        updates[(('generation_status', 'generated'),)].append(record.id)
+                        _logger.info(f"Sincronizado caso {record.id}: estado → 'generated'")
                 else:
-                    # No hay documento vinculado, buscar si existe un documento relacionado
-                    potential_invoice = self.env['account.move'].search([
-                        ('ref', '=', f'Certificación DTE - Caso {record.id}'),
-                        ('state', '!=', 'cancel')
-                    ], limit=1)
-                    
-                    # Buscar guía de despacho relacionada (por referencia al caso)
-                    potential_picking = self.env['stock.picking'].search([
-                        ('origin', 'ilike', f'Caso {record.id}'),
-                        ('state', '!=', 'cancel')
-                    ], limit=1)
-                    
-                    if potential_invoice:
-                        # Encontrada factura relacionada, vincular
-                        record.generated_account_move_id = potential_invoice
-                        record.generation_status = 'generated'
-                        _logger.info(f"Sincronizado caso {record.id}: factura encontrada {potential_invoice.name}, estado → 'generated'")
-                    elif potential_picking:
-                        # Encontrada guía relacionada, vincular
-                        record.generated_stock_picking_id = potential_picking
-                        record.generation_status = 'generated'
-                        _logger.info(f"Sincronizado caso {record.id}: guía encontrada {potential_picking.name}, estado → 'generated'")
-                    else:
-                        # No hay documento relacionado
-                        if record.generation_status == 'generated':
-                            record.generation_status = 'pending'
-                            _logger.info(f"Sincronizado caso {record.id}: sin documento, estado → 'pending'")
+                    # Factura no existe o está cancelada, desvincular
+                    updates[(('generated_account_move_id', False), ('generation_status', 'pending'))].append(record.id)
+                    _logger.info(f"Sincronizado caso {record.id}: factura inexistente, estado → 'pending'")
+
+            elif record.generated_stock_picking_id:
+                if record.generated_stock_picking_id in active_pickings:
+                    if record.generation_status != 'generated':
+                        updates[(('generation_status', 'generated'),)].append(record.id)
+                        _logger.info(f"Sincronizado caso {record.id}: estado → 'generated' (guía)")
+                else:
+                    # Guía no existe o está cancelada, desvincular
+                    updates[(('generated_stock_picking_id', False), ('generation_status', 'pending'))].append(record.id)
+                    _logger.info(f"Sincronizado caso {record.id}: guía inexistente, estado → 'pending'")
+
+            elif record.id in candidate_moves:
+                invoice = candidate_moves[record.id]
+                updates[(('generated_account_move_id', invoice.id), ('generation_status', 'generated'))].append(record.id)
+                _logger.info(f"Sincronizado caso {record.id}: factura encontrada {invoice.name}, estado → 'generated'")
+
+            elif record.id in candidate_pickings:
+                picking = candidate_pickings[record.id]
+                updates[(('generated_stock_picking_id', picking.id), ('generation_status', 'generated'))].append(record.id)
+                _logger.info(f"Sincronizado caso {record.id}: guía encontrada {picking.name}, estado → 'generated'")
+
+            elif record.generation_status == 'generated':
+                # No hay documento relacionado
+                updates[(('generation_status', 'pending'),)].append(record.id)
+                _logger.info(f"Sincronizado caso {record.id}: sin documento, estado → 'pending'")
+
+        for vals, case_ids in updates.items():
+            try:
+                self.browse(case_ids).write(dict(vals))
             except Exception as e:
-                _logger.warning(f"Error sincronizando caso {record.id}: {str(e)}")
+                _logger.warning(f"Error sincronizando casos {case_ids}: {str(e)}")
 
     def action_reset_case(self):
         """
@@ -27,6 +27,10 @@ class CertificationDeliveryGuideBookActions(models.AbstractModel):
             xml_content = self._build_delivery_guide_book_xml()
             _logger.info(f"✓ XML generado, tamaño: {len(xml_content)} bytes")
             
+            # Validar contra LibroGuia_v10.xsd antes de firmar
+            self.env['l10n_cl_edi.certification.xsd.validator']._check_xml(
+                xml_content, 'libro_guia', label=_('Libro de Guías'), allow_unsigned=True)
+            
             # Aplicar firma digital
             signed_xml = self._apply_digital_signature(xml_content)
             _logger.info("✓ Firma digital aplicada")
@@ -1,5 +1,6 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from psycopg2.errors import DeadlockDetected, LockNotAvailable, SerializationFailure
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -80,7 +81,8 @@ class CertificationDocumentGenerator(models.TransientModel):
         
             # **VERIFICACIÓN: Buscar documentos duplicados por referencia (solo modo normal)**
             existing_moves = self.env['account.move'].search([
-                ('ref', '=', f'Certificación DTE - Caso {self.dte_case_id.id}'),
+                ('l10n_cl_edi_certification_case_id', '=', self.dte_case_id.id),
+                ('id', '!=', self.dte_case_id.generated_batch_account_move_id.id),
                 ('state', '!=', 'cancel')
             ])
             if existing_moves:
@@ -127,6 +129,9 @@ class CertificationDocumentGenerator(models.TransientModel):
                 _logger.info(f"✅ ENTRANDO A FLUJO DE DOCUMENTOS ORIGINALES")
                 return self._generate_original_document(for_batch=for_batch)
                 
+        except (SerializationFailure, LockNotAvailable, DeadlockDetected):
+            # Conflicto transitorio con otra transacción: propagarlo para que se reintente
+            raise
         except Exception as e:
             _logger.error(f"Error generando documento para caso {self.dte_case_id.id}: {str(e)}")
             # Actualizar estado de error
@@ -303,6 +308,9 @@ class CertificationDocumentGenerator(models.TransientModel):
         
         # Obtener la primera referencia (documento original)
         ref = self.dte_case_id.reference_ids[0]
+        if not ref.referenced_case_dte_id and ref.id not in self.dte_case_id._get_unresolved_reference_ids():
+            # Generación individual: vincular las referencias del caso (en cola ya vienen vinculadas)
+            self.dte_case_id._resolve_reference_targets()
         _logger.info(f"✓ Primera referencia: '{ref.reference_document_text_raw}' -> caso {ref.referenced_sii_case_number}")
         
         # **NUEVA LÓGICA: Detectar si es ND que anula NC**
@@ -325,15 +333,12 @@ class CertificationDocumentGenerator(models.TransientModel):
         
         # Buscar el documento original generado
         _logger.info(f"🔍 Buscando documento original con caso: {ref.referenced_sii_case_number}")
-        original_invoice = self._get_referenced_move(ref.referenced_sii_case_number, for_batch)
+        original_invoice = self._get_referenced_move(ref, for_batch)
         _logger.info(f"Documento original encontrado: {bool(original_invoice)}")
         
         if not original_invoice:
             # Si no existe, sugerir generarlo primero
-            referenced_case = self.env['l10n_cl_edi.certification.case.dte'].search([
-                ('parsed_set_id.certification_process_id', '=', self.certification_process_id.id),
-                ('case_number_raw', '=', ref.referenced_sii_case_number)
-            ], limit=1)
+            referenced_case = ref.referenced_case_dte_id
             
             if referenced_case:
                 error_msg = f"El documento original (caso {ref.referenced_sii_case_number}) aún no ha sido generado. "
@@ -480,7 +485,10 @@ class CertificationDocumentGenerator(models.TransientModel):
         invoice = invoices[0]
         
         # Agregar referencia al caso DTE
-        invoice.ref = f'Certificación DTE - Caso {self.dte_case_id.id}'
+        invoice.write({
+            'ref': f'Certificación DTE - Caso {self.dte_case_id.id}',
+            'l10n_cl_edi_certification_case_id': self.dte_case_id.id,
+        })
         
         # Establecer contexto de certificación para corrección de encoding
         invoice = invoice.with_context(l10n_cl_edi_certification=True)
@@ -558,6 +566,11 @@ class CertificationDocumentGenerator(models.TransientModel):
         if self.dte_case_id.document_type_code in ['110', '111', '112']:
             return self._get_export_product_for_item(item_name)
         
+        # Producto ya resuelto en esta transacción (ver _prefetch_item_products)
+        product_map = self._get_item_product_map()
+        if ('item', item_name) in product_map:
+            return self.env['product.product'].browse(product_map[('item', item_name)])
+        
         # Para documentos normales, usar la lógica existente
         # Buscar producto existente por nombre exacto
         product = self.env['product.product'].search([
@@ -566,11 +579,20 @@ class CertificationDocumentGenerator(models.TransientModel):
         
         if product:
             _logger.info("Producto existente encontrado: %s (ID: %s)", product.name, product.id)
+            product_map[('item', item_name)] = product.id
             return product
         
         # Crear producto único para este item (SIN default_code para evitar SKU en líneas)
         _logger.info("Creando nuevo producto: %s", item_name)
-        product = self.env['product.product'].create({
+        product = self.env['product.product'].create(self._prepare_item_product_vals(item_name))
+        self._remember_item_products('item', product, created=True)
+        
+        _logger.info("✓ Producto creado: %s (ID: %s)", product.name, product.id)
+        return product
+
+    def _prepare_item_product_vals(self, item_name):
+        """Valores del producto de servicio creado para un item DTE"""
+        return {
             'name': item_name,  # Nombre exacto del item DTE
             'type': 'service',
             'invoice_policy': 'order',
@@ -579,10 +601,60 @@ class CertificationDocumentGenerator(models.TransientModel):
             'sale_ok': True,
             'purchase_ok': False,
             # NO agregar default_code para evitar que aparezca SKU en las líneas
-        })
-        
-        _logger.info("✓ Producto creado: %s (ID: %s)", product.name, product.id)
-        return product
+        }
+
+    def _get_item_product_map(self):
+        """Productos de items resueltos en esta transacción: {('item' | 'guide', nombre): id de product.product}"""
+        return self.env.cr.cache.setdefault('l10n_cl_edi_item_products', {})
+
+    def _remember_item_products(self, kind, products, created=False):
+        """Registrar productos en el mapa de la transacción; si se crearon, olvidarlos ante un rollback"""
+        product_map = self._get_item_product_map()
+        for product in products:
+            product_map.setdefault((kind, product.name), product.id)
+        if created:
+            self.env.cr.postrollback.add(product_map.clear)
+
+    @api.model
+    def _prefetch_item_products(self, cases):
+        """
+        Resolver de una vez los productos de los items de los casos: una búsqueda por nombre
+        (name IN ...) por tipo de producto y una sola creación para los que faltan. Los
+        generadores toman luego los productos desde el mapa de la transacción.
+        """
+        names = {'item': set(), 'guide': set()}
+        guide_prices = {}
+        for case in cases:
+            # Los documentos de exportación usan productos predefinidos (_get_export_product_for_item)
+            if case.document_type_code in ['110', '111', '112']:
+                continue
+            kind = 'guide' if case.document_type_code == '52' else 'item'
+            for item in case.item_ids:
+                if item.name:
+                    names[kind].add(item.name)
+                    if kind == 'guide':
+                        guide_prices.setdefault(item.name, item.price_unit)
+
+        product_map = self._get_item_product_map()
+        Product = self.env['product.product']
+        for kind, kind_names in names.items():
+            missing = sorted(name for name in kind_names if (kind, name) not in product_map)
+            if not missing:
+                continue
+            domain = [('name', 'in', missing)]
+            if kind == 'guide':
+                domain.append(('type', '=', 'consu'))
+            self._remember_item_products(kind, Product.search(domain))
+
+            to_create = [name for name in missing if (kind, name) not in product_map]
+            if to_create:
+                if kind == 'guide':
+                    category = self._get_certification_product_category()
+                    vals_list = [self._prepare_guide_product_vals(name, guide_prices[name], category) for name in to_create]
+                else:
+                    vals_list = [self._prepare_item_product_vals(name) for name in to_create]
+                self._remember_item_products(kind, Product.create(vals_list), created=True)
+            _logger.info(f"📦 Productos de items ({kind}): {len(missing) - len(to_create)} existentes, {len(to_create)} creados")
     
     def _get_export_product_for_item(self, item_name):
         """
@@ -637,6 +709,7 @@ class CertificationDocumentGenerator(models.TransientModel):
             'l10n_latam_document_type_id': doc_type.id,
             'invoice_date': fields.Date.context_today(self),
             'ref': f'Caso SII {self.dte_case_id.case_number_raw}',
+            'l10n_cl_edi_certification_case_id': self.dte_case_id.id,
         }
         
         # Configurar diario según el tipo de documento
@@ -735,49 +808,15 @@ class CertificationDocumentGenerator(models.TransientModel):
 
     def _get_next_available_folio(self, document_type):
         """
-        Obtiene el siguiente folio disponible del CAF para el tipo de documento.
+        Obtiene (y reserva) el siguiente folio disponible del CAF para el tipo de documento.
         """
         self.ensure_one()
         
-        company_id = self.certification_process_id.company_id.id
-        
-        # Buscar CAF disponible para este tipo de documento
-        caf = self.env['l10n_cl.dte.caf'].search([
-            ('l10n_latam_document_type_id', '=', document_type.id),
-            ('company_id', '=', company_id),
-            ('status', '=', 'in_use')
-        ], limit=1)
-        
-        if not caf:
-            _logger.error("No se encontró CAF disponible para tipo %s en empresa %s", 
-                         document_type.code, company_id)
-            return None
-        
-        _logger.info("CAF encontrado: %s (rango: %s-%s)", caf.filename, caf.start_nb, caf.final_nb)
-        
-        # Buscar el último folio usado para este tipo de documento
-        last_move = self.env['account.move'].search([
-            ('l10n_latam_document_type_id', '=', document_type.id),
-            ('company_id', '=', company_id),
-            ('state', '=', 'posted'),
-            ('l10n_latam_document_number', '!=', False)
-        ], order='l10n_latam_document_number desc', limit=1)
-        
-        if last_move and last_move.l10n_latam_document_number.isdigit():
-            # Siguiente folio después del último usado
-            next_folio = int(last_move.l10n_latam_document_number) + 1
-            _logger.info("Último folio usado: %s, siguiente: %s", last_move.l10n_latam_document_number, next_folio)
-        else:
-            # Primer folio del CAF
-            next_folio = caf.start_nb
-            _logger.info("No hay folios previos, usando primer folio del CAF: %s", next_folio)
-        
-        # Verificar que el folio esté dentro del rango del CAF
-        if next_folio > caf.final_nb:
-            _logger.error("Folio %s excede el rango del CAF (%s-%s)", next_folio, caf.start_nb, caf.final_nb)
-            return None
+        company = self.certification_process_id.company_id
+        next_folio = self.env['l10n_cl_edi.certification.folio.allocator']._allocate_folio(company, document_type)
         
-        _logger.info("✓ Siguiente folio disponible: %s", next_folio)
+        if next_folio:
+            _logger.info("✓ Siguiente folio disponible: %s", next_folio)
         return next_folio
 
     def _apply_global_discount_to_invoice(self, invoice, discount_percent):
@@ -892,7 +931,7 @@ class CertificationDocumentGenerator(models.TransientModel):
             _logger.info(f"Procesando referencia: {ref.reference_document_text_raw} -> {ref.referenced_sii_case_number}")
             
             # Buscar el documento referenciado si existe
-            referenced_move = self._get_referenced_move(ref.referenced_sii_case_number, for_batch)
+            referenced_move = self._get_referenced_move(ref, for_batch)
             
             if referenced_move:
                 _logger.info(f"Documento referenciado encontrado: {referenced_move.name}")
@@ -966,15 +1005,17 @@ class CertificationDocumentGenerator(models.TransientModel):
         else:
             _logger.warning("No hay referencias para crear")
 
-    def _get_referenced_move(self, referenced_sii_case_number, for_batch=False):
-        """Busca un documento generado basado en el número de caso SII de la referencia."""
-        if not referenced_sii_case_number:
-            return self.env['account.move']
-        
-        referenced_dte_case = self.env['l10n_cl_edi.certification.case.dte'].search([
-            ('parsed_set_id.certification_process_id', '=', self.certification_process_id.id),
-            ('case_number_raw', '=', referenced_sii_case_number)
-        ], limit=1)
+    def _get_referenced_move(self, reference, for_batch=False):
+        """
+        Documento generado del caso referenciado, vinculado al programar la generación
+        (ver _get_generation_waves). Si la referencia aún no está vinculada (generación
+        individual), se vinculan de una vez todas las referencias del caso; una referencia
+        sin caso encontrado no se vuelve a buscar en la misma transacción.
+        """
+        if (not reference.referenced_case_dte_id and reference.referenced_sii_case_number
+                and reference.id not in reference.case_dte_id._get_unresolved_reference_ids()):
+            reference.case_dte_id._resolve_reference_targets()
+        referenced_dte_case = reference.referenced_case_dte_id
         
         if not referenced_dte_case:
             return self.env['account.move']
@@ -1408,6 +1449,7 @@ class CertificationDocumentGenerator(models.TransientModel):
         self._adjust_credit_note_lines(credit_note, case_dte)
         
         # **PASO 9: Marcar el caso como generado**
+        credit_note.l10n_cl_edi_certification_case_id = case_dte.id
         if for_batch:
             # En modo batch, SOLO guardar en el campo batch
             update_vals = {
@@ -1631,16 +1673,14 @@ class CertificationDocumentGenerator(models.TransientModel):
         
         # Obtener referencia a la nota de crédito
         ref = self.dte_case_id.reference_ids[0]
-        credit_note_case = ref.referenced_case_dte_id
+        credit_note = self._get_referenced_move(ref, for_batch)
         
-        if not credit_note_case or not credit_note_case.generated_account_move_id:
+        if not credit_note:
             raise UserError(
                 f"La nota de crédito referenciada (caso {ref.referenced_sii_case_number}) "
                 f"debe ser generada antes de crear la nota de débito."
             )
         
-        credit_note = credit_note_case.generated_account_move_id
-        
         # Validar que la NC esté confirmada
         if credit_note.state != 'posted':
             raise UserError(
@@ -1705,6 +1745,7 @@ class CertificationDocumentGenerator(models.TransientModel):
         self._add_set_reference_to_debit_note(debit_note)
         
         # Vincular el caso al documento generado
+        debit_note.l10n_cl_edi_certification_case_id = self.dte_case_id.id
         self.dte_case_id.write({
             'generation_status': 'generated',
             'generated_account_move_id': debit_note.id,
@@ -2316,14 +2357,21 @@ class CertificationDocumentGenerator(models.TransientModel):
         Usa tipo 'consu' (consumible) para permitir movimientos de stock.
         Asigna precio según el item del caso DTE para cumplir especificaciones SII.
         """
-        # Buscar producto existente tipo consumible
-        product = self.env['product.product'].search([
-            ('name', '=', item_name),
-            ('type', '=', 'consu')
-        ], limit=1)
+        # Producto ya resuelto en esta transacción (ver _prefetch_item_products)
+        product_map = self._get_item_product_map()
+        if ('guide', item_name) in product_map:
+            product = self.env['product.product'].browse(product_map[('guide', item_name)])
+        else:
+            # Buscar producto existente tipo consumible
+            product = self.env['product.product'].search([
+                ('name', '=', item_name),
+                ('type', '=', 'consu')
+            ], limit=1)
+            if product:
+                _logger.info("Producto consumible existente encontrado: %s (ID: %s)", product.name, product.id)
+                product_map[('guide', item_name)] = product.id
         
         if product:
-            _logger.info("Producto consumible existente encontrado: %s (ID: %s)", product.name, product.id)
             # Actualizar precio si es diferente (para casos de venta)
             if item_price_unit > 0 and product.list_price != item_price_unit:
                 product.list_price = item_price_unit
@@ -2332,7 +2380,15 @@ class CertificationDocumentGenerator(models.TransientModel):
         
         # Crear producto consumible para guía de despacho
         _logger.info("Creando nuevo producto consumible para guía: %s (precio: %s)", item_name, item_price_unit)
-        product = self.env['product.product'].create({
+        product = self.env['product.product'].create(self._prepare_guide_product_vals(item_name, item_price_unit))
+        self._remember_item_products('guide', product, created=True)
+        
+        _logger.info("✓ Producto consumible creado: %s (ID: %s, precio: %s)", product.name, product.id, item_price_unit)
+        return product
+
+    def _prepare_guide_product_vals(self, item_name, item_price_unit=0, category=None):
+        """Valores del producto consumible creado para un item de guía de despacho"""
+        return {
             'name': item_name,
             'type': 'consu',  # Consumible - permite movimientos de stock
             'invoice_policy': 'delivery',  # Facturar al entregar
@@ -2340,11 +2396,8 @@ class CertificationDocumentGenerator(models.TransientModel):
             'standard_price': item_price_unit,  # Costo igual al precio para certificación
             'sale_ok': True,
             'purchase_ok': True,
-            'categ_id': self._get_certification_product_category().id,
-        })
-        
-        _logger.info("✓ Producto consumible creado: %s (ID: %s, precio: %s)", product.name, product.id, item_price_unit)
-        return product
+            'categ_id': (category or self._get_certification_product_category()).id,
+        }
 
     def _get_certification_product_category(self):
         """Obtiene o crea categoría para productos de certificación."""
@@ -2966,6 +3019,7 @@ class CertificationDocumentGenerator(models.TransientModel):
         
         # Agregar referencia al caso DTE
         invoice_vals['ref'] = f'Certificación DTE - Caso {self.dte_case_id.id}'
+        invoice_vals['l10n_cl_edi_certification_case_id'] = self.dte_case_id.id
         
         # Preparar líneas de factura desde las líneas de purchase.order
         invoice_lines = []
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+import functools
+import logging
+import threading
+
+from .certification_folio_bitmap import FolioRangeBitmap
+
+_logger = logging.getLogger(__name__)
+
+# Bitmaps de folios consumidos por CAF, locales al proceso y usados solo como pista:
+# {(base de datos, caf id, desde, hasta): FolioRangeBitmap}
+_FOLIO_BITMAPS = {}
+_FOLIO_BITMAPS_LOCK = threading.Lock()
+
+# Número de documento como entero (NULL si no es numérico)
+_NUMERIC_DOCUMENT_NUMBER_SQL = """
+    CASE WHEN l10n_latam_document_number ~ '^[0-9]{1,18}$'
+         THEN l10n_latam_document_number::bigint END
+"""
+
+
+class CertificationFolioAllocator(models.AbstractModel):
+    """
+    Servicio de asignación de folios por (empresa, tipo de documento).
+
+    La fuente de verdad es un contador por CAF en la base de datos
+    (l10n_cl_dte_caf.l10n_cl_edi_certification_next_folio), avanzado con UPDATE ... RETURNING:
+    la fila queda bloqueada hasta el fin de la transacción y, bajo REPEATABLE READ, un worker
+    cuyo snapshot no ve el avance de otro falla con un error de serialización (reintentable)
+    en lugar de obtener el mismo folio. El bitmap en memoria de cada proceso solo sugiere
+    desde dónde buscar, para saltar los folios ya consumidos sin consultarlos uno a uno.
+    """
+    _name = 'l10n_cl_edi.certification.folio.allocator'
+    _description = 'Asignador de Folios CAF de Certificación'
+
+    def _get_in_use_cafs(self, company, document_type):
+        """CAFs en uso del tipo de documento, en orden de rango"""
+        return self.env['l10n_cl.dte.caf'].search([
+            ('l10n_latam_document_type_id', '=', document_type.id),
+            ('company_id', '=', company.id),
+            ('status', '=', 'in_use')
+        ], order='start_nb, id')
+
+    def _advance_folio_counter(self, caf, hint):
+        """
+        Tomar el siguiente folio del contador del CAF: el mayor entre el contador y la pista
+        del bitmap, avanzando el contador en la misma sentencia.
+
+        Returns:
+            int | None: folio tomado, o None si el CAF está agotado
+        """
+        self.env.cr.execute("""
+            UPDATE l10n_cl_dte_caf
+               SET l10n_cl_edi_certification_next_folio =
+                   GREATEST(COALESCE(l10n_cl_edi_certification_next_folio, start_nb), %(hint)s) + 1
+             WHERE id = %(caf_id)s
+               AND GREATEST(COALESCE(l10n_cl_edi_certification_next_folio, start_nb), %(hint)s) <= final_nb
+         RETURNING l10n_cl_edi_certification_next_folio - 1
+        """, {'caf_id': caf.id, 'hint': hint})
+        row = self.env.cr.fetchone()
+        caf.invalidate_recordset(['l10n_cl_edi_certification_next_folio'])
+        return row[0] if row else None
+
+    def _get_used_folios(self, company, document_type, start, end):
+        """Folios ya asignados a documentos del tipo dentro del rango [start, end]"""
+        self.env['account.move'].flush_model([
+            'company_id', 'l10n_latam_document_type_id', 'l10n_latam_document_number'
+        ])
+        self.env.cr.execute(f"""
+            SELECT DISTINCT {_NUMERIC_DOCUMENT_NUMBER_SQL}
+              FROM account_move
+             WHERE company_id = %s
+               AND l10n_latam_document_type_id = %s
+               AND {_NUMERIC_DOCUMENT_NUMBER_SQL} BETWEEN %s AND %s
+        """, [company.id, document_type.id, start, end])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def _is_folio_taken(self, company, document_type, folio):
+        """Verificación puntual contra documentos ya numerados (p. ej. por la secuencia de Odoo)"""
+        return bool(self._get_used_folios(company, document_type, folio, folio))
+
+    def _get_bitmap(self, caf, company, document_type):
+        """Bitmap del CAF, construido desde la base de datos la primera vez"""
+        key = (self.env.cr.dbname, caf.id, caf.start_nb, caf.final_nb)
+        with _FOLIO_BITMAPS_LOCK:
+            bitmap = _FOLIO_BITMAPS.get(key)
+        if bitmap is None:
+            bitmap = FolioRangeBitmap(caf.start_nb, caf.final_nb)
+            used_folios = self._get_used_folios(company, document_type, caf.start_nb, caf.final_nb)
+            bitmap.mark_used(used_folios)
+            _logger.info(f"📦 Bitmap de folios CAF {caf.start_nb}-{caf.final_nb}: {len(used_folios)} consumidos")
+            with _FOLIO_BITMAPS_LOCK:
+                bitmap = _FOLIO_BITMAPS.setdefault(key, bitmap)
+        return bitmap
+
+    def _allocate_folio(self, company, document_type):
+        """
+        Reservar el siguiente folio libre para (empresa, tipo de documento).
+
+        El folio se toma del contador del CAF en la base de datos, que queda bloqueado hasta
+        que la transacción termine. Si la transacción se revierte, el contador vuelve atrás
+        y el folio se libera también en el bitmap.
+
+        Returns:
+            int | None: folio asignado, o None si no hay CAF en uso con folios libres
+        """
+        cafs = self._get_in_use_cafs(company, document_type)
+        if not cafs:
+            _logger.error("No se encontró CAF disponible para tipo %s en empresa %s",
+                          document_type.code, company.id)
+            return None
+
+        for caf in cafs:
+            bitmap = self._get_bitmap(caf, company, document_type)
+            while True:
+                folio = self._advance_folio_counter(caf, bitmap.first_free())
+                if folio is None:
+                    _logger.info("CAF %s-%s agotado para tipo %s", caf.start_nb, caf.final_nb, document_type.code)
+                    break
+                bitmap.mark_used([folio])
+                if self._is_folio_taken(company, document_type, folio):
+                    # Numerado fuera del asignador: queda marcado, probar el siguiente
+                    continue
+                self.env.cr.postrollback.add(functools.partial(bitmap.release, folio))
+                _logger.info("✓ Folio %s reservado del CAF %s-%s", folio, caf.start_nb, caf.final_nb)
+                return folio
+
+        _logger.error("No quedan folios libres en los CAF en uso para tipo %s", document_type.code)
+        return None
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Estructura compacta de folios consumidos para un rango CAF (D..H).
+
+Un bit por folio del rango y un cursor al primer folio posiblemente libre: marcar y
+consultar son O(1) y "siguiente folio libre" es O(1) amortizado, porque el cursor
+solo retrocede cuando se libera un folio.
+"""
+import threading
+
+
+class FolioRangeBitmap:
+    """Bitmap de folios consumidos de un CAF, seguro entre hilos"""
+
+    def __init__(self, start, end):
+        if end < start:
+            raise ValueError(f"Rango de folios inválido: {start}-{end}")
+        self.start = start
+        self.end = end
+        self._bits = bytearray((end - start + 8) // 8)
+        self._cursor = start
+        self._lock = threading.Lock()
+
+    def __contains__(self, folio):
+        return self.start <= folio <= self.end
+
+    def _is_set(self, folio):
+        offset = folio - self.start
+        return bool(self._bits[offset >> 3] & (1 << (offset & 7)))
+
+    def is_used(self, folio):
+        return folio in self and self._is_set(folio)
+
+    def mark_used(self, folios):
+        """Marcar folios como consumidos (se ignoran los que están fuera del rango)"""
+        with self._lock:
+            for folio in folios:
+                if folio in self:
+                    offset = folio - self.start
+                    self._bits[offset >> 3] |= 1 << (offset & 7)
+
+    def release(self, folio):
+        """Liberar un folio reservado (p. ej. al hacer rollback de la transacción)"""
+        with self._lock:
+            if folio in self:
+                offset = folio - self.start
+                self._bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+                self._cursor = min(self._cursor, folio)
+
+    def first_free(self):
+        """Primer folio no marcado como consumido (end + 1 si el rango está agotado)"""
+        with self._lock:
+            folio = self._cursor
+            while folio <= self.end and self._is_set(folio):
+                folio += 1
+            self._cursor = folio
+            return folio
@@ -21,6 +21,10 @@ class CertificationIECVBookActions(models.AbstractModel):
             # Generar XML sin firma
             xml_content = self._build_iecv_xml()
             
+            # Validar contra LibroCV_v10.xsd antes de firmar
+            self.env['l10n_cl_edi.certification.xsd.validator']._check_xml(
+                xml_content, 'libro_cv', label=_('Libro %s') % self.book_type, allow_unsigned=True)
+            
             # Aplicar firma digital
             signed_xml = self._apply_digital_signature(xml_content)
             
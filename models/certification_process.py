@@ -1,13 +1,23 @@
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import UserError
 import base64
 import logging
+import re
+import time
 
 # For XML Parsing
 from lxml import etree
 
+from .certification_set_text_parser import SetDePruebasTextParser
+
 _logger = logging.getLogger(__name__)
 
+# Patrones de referencia usados para recuperar la relación caso ↔ factura
+CASE_ID_REF_PATTERN = re.compile(r'Certificación DTE - Caso (\d+)\b')
+CASE_ID_EN_REF_PATTERN = re.compile(r'\bCase (\d+)\b', re.IGNORECASE)
+CASE_NUMBER_REF_PATTERN = re.compile(r'\bCaso (\S+)', re.IGNORECASE)
+SII_NUMBER_REF_PATTERN = re.compile(r'\bSII (\S+)', re.IGNORECASE)
+
 class CertificationProcess(models.Model):
     _name = 'l10n_cl_edi.certification.process'  # Actualizado
     _description = 'Proceso de Certificación SII'
@@ -36,8 +46,8 @@ class CertificationProcess(models.Model):
     document_count = fields.Integer(compute='_compute_document_count', string='Documentos de Prueba Generados')
     
     # Seguimiento de set de pruebas
-    set_prueba_file = fields.Binary(string='Archivo XML Set de Pruebas', attachment=True)
-    set_prueba_filename = fields.Char(string='Nombre del archivo XML')
+    set_prueba_file = fields.Binary(string='Archivo Set de Pruebas (XML o TXT SII)', attachment=True)
+    set_prueba_filename = fields.Char(string='Nombre del archivo del Set de Pruebas')
     test_invoice_ids = fields.One2many(
         'account.move', 'l10n_cl_edi_certification_id',  # Actualizado
         string='Documentos de Prueba Generados',
@@ -124,6 +134,11 @@ class CertificationProcess(models.Model):
         compute='_compute_cafs_status',
         string='Color CAFs',
         help='Color del estado de CAFs'
+    )
+    cafs_remaining_folios = fields.Char(
+        compute='_compute_cafs_status',
+        string='Folios Disponibles',
+        help='Folios restantes en CAFs en uso por tipo de documento'
     )    
     active_company_id = fields.Many2one(
         'res.company',
@@ -168,6 +183,19 @@ class CertificationProcess(models.Model):
         help='Producto que se usará para aplicar descuentos globales'
     )
 
+    # Conciliación de casos/documentos (se ejecuta solo cuando algo cambió)
+    reconcile_dirty = fields.Boolean(
+        string='Requiere Conciliación',
+        default=True,
+        copy=False,
+        help='Se marca cuando cambian casos DTE o documentos del proceso'
+    )
+    last_reconciled_at = fields.Datetime(
+        string='Última Conciliación',
+        readonly=True,
+        copy=False
+    )
+
     _sql_constraints = [
             ('company_uniq', 'unique(company_id)', 'Solo puede existir un proceso de certificación por compañía'),
         ]
@@ -200,17 +228,9 @@ class CertificationProcess(models.Model):
             # Obtener el registro existente
             record = self.search([('company_id', '=', company_id)], limit=1)
         
-        # 2. **MEJORAR VERIFICACIÓN AUTOMÁTICA DE ESTADO**
+        # 2. Conciliar solo si hubo cambios desde la última conciliación
         if record:
-            try:
-                # Verificar y recuperar relaciones perdidas
-                record._recover_lost_relationships()
-                
-                # Verificar estado automáticamente
-                record.check_certification_status()
-                _logger.info("Estado verificado automáticamente para proceso %s: %s", record.id, record.state)
-            except Exception as e:
-                _logger.warning("Error verificando estado automáticamente: %s", str(e))
+            record._reconcile_if_needed()
     
         # 3. Comportamiento estándar de search_read
         return super(CertificationProcess, self).search_read(domain, fields, offset, limit, order)
@@ -244,57 +264,61 @@ class CertificationProcess(models.Model):
         ])
         
         recovered_count = 0
-        for case in cases_with_invoices:
-            invoice = case.generated_account_move_id
-            
-            # Asegurar que la factura esté vinculada al proceso
-            if not invoice.l10n_cl_edi_certification_id:
-                invoice.l10n_cl_edi_certification_id = self.id
-                _logger.info(f"Vinculada factura {invoice.name} al proceso de certificación")
-                recovered_count += 1
-            
-            # Asegurar que esté en test_invoice_ids
-            if invoice not in self.test_invoice_ids:
-                self.test_invoice_ids = [(4, invoice.id)]  # Agregar sin reemplazar
-                _logger.info(f"Agregada factura {invoice.name} a test_invoice_ids")
-        
-        # 3. ESTRATEGIA 3: Buscar facturas por patrones de referencia
+        linked_invoices = cases_with_invoices.generated_account_move_id
+        unlinked_invoices = linked_invoices.filtered(lambda inv: not inv.l10n_cl_edi_certification_id)
+        if unlinked_invoices:
+            # Asegurar que las facturas estén vinculadas al proceso
+            unlinked_invoices.write({'l10n_cl_edi_certification_id': self.id})
+            _logger.info(f"Vinculadas {len(unlinked_invoices)} facturas al proceso de certificación")
+            recovered_count += len(unlinked_invoices)
+        
+        missing_invoices = linked_invoices - self.test_invoice_ids
+        if missing_invoices:
+            # Asegurar que estén en test_invoice_ids (agregar sin reemplazar)
+            self.test_invoice_ids = [(4, invoice_id) for invoice_id in missing_invoices.ids]
+            _logger.info(f"Agregadas {len(missing_invoices)} facturas a test_invoice_ids")
+        
+        # 3. ESTRATEGIA 3: Buscar facturas por patrones de referencia (una sola consulta para todo el set)
         all_cases = self.env['l10n_cl_edi.certification.case.dte'].search([
             ('parsed_set_id.certification_process_id', '=', self.id)
         ])
         
-        for case in all_cases:
-            if not case.generated_account_move_id:
-                # Buscar facturas que podrían estar relacionadas
-                potential_invoices = self.env['account.move'].search([
-                    '|', '|', '|',
-                    ('ref', '=', f'Certificación DTE - Caso {case.id}'),
-                    ('ref', 'ilike', f'Caso {case.case_number_raw}'),
-                    ('ref', 'ilike', f'SII {case.case_number_raw}'),
-                    ('ref', 'ilike', f'Case {case.id}'),
-                    ('state', '!=', 'cancel'),
-                    ('move_type', 'in', ('out_invoice', 'out_refund'))
-                ])
-                
-                if potential_invoices:
-                    # Usar la primera factura encontrada
-                    invoice = potential_invoices[0]
-                    case.generated_account_move_id = invoice.id
-                    
-                    # Vincular al proceso
-                    if not invoice.l10n_cl_edi_certification_id:
-                        invoice.l10n_cl_edi_certification_id = self.id
-                    
-                    # Agregar a test_invoice_ids
-                    if invoice not in self.test_invoice_ids:
-                        self.test_invoice_ids = [(4, invoice.id)]
-                    
-                    _logger.info(f"Recuperada relación: Caso {case.case_number_raw} → Factura {invoice.name}")
-                    recovered_count += 1
-                    
-                    # Actualizar estado del caso
-                    if case.generation_status != 'generated':
-                        case.generation_status = 'generated'
+        cases_without_invoice = all_cases.filtered(lambda c: not c.generated_account_move_id)
+        exclude = linked_invoices | cases_without_invoice.generated_batch_account_move_id
+        matches = self._match_cases_to_invoices_by_key(cases_without_invoice, exclude=exclude)
+        # Documentos sin clave de caso (creados fuera del generador): emparejar por referencia.
+        # Las guías (52) se generan como stock.picking y nunca tienen factura.
+        unmatched_cases = cases_without_invoice.filtered(
+            lambda c: c not in matches and c.document_type_code != '52'
+        )
+        if unmatched_cases:
+            matches.update(self._match_cases_to_invoices_by_ref(
+                unmatched_cases,
+                exclude=exclude | self.env['account.move'].browse([inv.id for inv in matches.values()]),
+            ))
+        
+        if matches:
+            recovered_invoices = self.env['account.move'].browse([inv.id for inv in matches.values()])
+            
+            for case, invoice in matches.items():
+                case_vals = {'generated_account_move_id': invoice.id}
+                # Actualizar estado del caso
+                if case.generation_status != 'generated':
+                    case_vals['generation_status'] = 'generated'
+                case.write(case_vals)
+                _logger.info(f"Recuperada relación: Caso {case.case_number_raw} → Factura {invoice.name}")
+            
+            # Vincular al proceso
+            recovered_invoices.filtered(
+                lambda inv: not inv.l10n_cl_edi_certification_id
+            ).write({'l10n_cl_edi_certification_id': self.id})
+            
+            # Agregar a test_invoice_ids
+            missing_invoices = recovered_invoices - self.test_invoice_ids
+            if missing_invoices:
+                self.test_invoice_ids = [(4, invoice_id) for invoice_id in missing_invoices.ids]
+            
+            recovered_count += len(matches)
         
         # 4. ELIMINADO: Buscar facturas del partner SII (error arquitectónico resuelto)
         # Ya no usamos un partner único del SII para todos los documentos.
@@ -319,6 +343,94 @@ class CertificationProcess(models.Model):
             'linked_cases': final_case_count
         }
 
+    def _match_cases_to_invoices_by_key(self, cases, exclude=None):
+        """
+        Emparejar casos DTE sin factura con facturas que ya tienen la clave del caso
+        (``l10n_cl_edi_certification_case_id``), en una única búsqueda indexada.
+
+        Returns:
+            dict: {caso: factura} con a lo más una factura por caso
+        """
+        if not cases:
+            return {}
+
+        candidates = self.env['account.move'].search([
+            ('l10n_cl_edi_certification_case_id', 'in', cases.ids),
+            ('state', '!=', 'cancel'),
+            ('move_type', 'in', ('out_invoice', 'out_refund')),
+        ])
+        if exclude:
+            candidates -= exclude
+
+        by_case_id = {}
+        for invoice in candidates:
+            by_case_id.setdefault(invoice.l10n_cl_edi_certification_case_id.id, invoice)
+
+        return {case: by_case_id[case.id] for case in cases if case.id in by_case_id}
+
+    def _match_cases_to_invoices_by_ref(self, cases, exclude=None):
+        """
+        Emparejar casos DTE sin factura con facturas existentes según su referencia.
+
+        Se hace una única búsqueda de facturas candidatas de la empresa del proceso que aún
+        no tienen clave de caso, y se extraen los identificadores de caso de cada ``ref`` en
+        memoria, en lugar de una búsqueda ilike por caso.
+        Patrones reconocidos (en orden de prioridad):
+            'Certificación DTE - Caso {id}', 'Case {id}', 'Caso {número}', 'SII {número}'
+
+        Returns:
+            dict: {caso: factura} con a lo más una factura por caso
+        """
+        if not cases:
+            return {}
+
+        # Solo documentos de la empresa que aún no tienen clave de caso
+        candidates = self.env['account.move'].search([
+            '|', '|', '|',
+            ('ref', '=like', 'Certificación DTE - Caso %'),
+            ('ref', 'ilike', 'Caso '),
+            ('ref', 'ilike', 'SII '),
+            ('ref', 'ilike', 'Case '),
+            ('company_id', '=', self.company_id.id),
+            ('l10n_cl_edi_certification_case_id', '=', False),
+            ('state', '!=', 'cancel'),
+            ('move_type', 'in', ('out_invoice', 'out_refund')),
+        ])
+        if exclude:
+            candidates -= exclude
+        if not candidates:
+            return {}
+
+        # Índices en memoria: id de caso y número de caso → primera factura (orden por defecto)
+        by_case_id = {}
+        by_case_number = {}
+        for invoice in candidates:
+            ref = invoice.ref or ''
+            for pattern in (CASE_ID_REF_PATTERN, CASE_ID_EN_REF_PATTERN):
+                for key in pattern.findall(ref):
+                    by_case_id.setdefault(int(key), invoice)
+            # La referencia por id no debe confundirse con un número de caso
+            ref = CASE_ID_REF_PATTERN.sub('', ref)
+            for pattern in (CASE_NUMBER_REF_PATTERN, SII_NUMBER_REF_PATTERN):
+                for key in pattern.findall(ref):
+                    by_case_number.setdefault(key.rstrip('.,;:)').lower(), invoice)
+
+        matches = {}
+        used_invoices = set()
+        for case in cases:
+            case_number = (case.case_number_raw or '').strip().lower()
+            for invoice in (
+                by_case_id.get(case.id),
+                by_case_number.get(case_number) if case_number else None,
+            ):
+                if invoice and invoice.id not in used_invoices:
+                    matches[case] = invoice
+                    used_invoices.add(invoice.id)
+                    break
+
+        _logger.info(f"Emparejamiento por referencia: {len(candidates)} facturas candidatas, {len(matches)} casos recuperados")
+        return matches
+
     @api.model
     def default_get(self, fields_list):
         # Asegurar que solo haya un registro por compañía
@@ -328,13 +440,8 @@ class CertificationProcess(models.Model):
         # Verificar si ya existe un registro para esta compañía
         existing_record = self.search([('company_id', '=', self.env.company.id)], limit=1)
         if existing_record:
-            # Si existe, sincronizar automáticamente
-            try:
-                existing_record._sync_all_dte_cases()
-                existing_record.check_certification_status()
-                _logger.info(f"Estado sincronizado en default_get para proceso {existing_record.id}")
-            except Exception as e:
-                _logger.warning(f"Error en sincronización default_get: {str(e)}")
+            # Si existe, conciliar solo si hubo cambios
+            existing_record._reconcile_if_needed()
         
         return res
         
@@ -345,19 +452,7 @@ class CertificationProcess(models.Model):
         """
         self.ensure_one()
         
-        # **MEJORAR APERTURA DE FORMULARIO**
-        try:
-            # Recuperar relaciones perdidas
-            self._recover_lost_relationships()
-            
-            # Sincronizar estados de casos DTE
-            self._sync_all_dte_cases()
-            
-            # Verificar estado
-            result = self.check_certification_status()
-            _logger.info("Abierto registro de certificación %s, estado verificado: %s", self.id, self.state)
-        except Exception as e:
-            _logger.warning("Error en verificación al abrir formulario: %s", str(e))
+        self._reconcile_if_needed()
         
         # Redirigir a la vista del formulario
         return {
@@ -368,22 +463,63 @@ class CertificationProcess(models.Model):
             'target': 'current',
         }
 
-    def read(self, fields=None, load='_classic_read'):
+    def _mark_reconcile_dirty(self):
+        """Marcar procesos para conciliar en la próxima apertura"""
+        processes = self.sudo().filtered(lambda p: not p.reconcile_dirty)
+        if processes:
+            processes.with_context(l10n_cl_edi_reconciling=True).write({'reconcile_dirty': True})
+
+    def _needs_reconcile(self):
         """
-        Override read method to automatically sync status when loading form data.
+        Hay que conciliar si el proceso fue marcado, nunca se concilió, o algún caso
+        o documento vinculado se modificó después de la última conciliación.
         """
-        result = super().read(fields, load)
-        
-        # Solo ejecutar sincronización si se está leyendo un registro específico
-        if len(self) == 1:
+        self.ensure_one()
+        if self.reconcile_dirty or not self.last_reconciled_at:
+            return True
+
+        since = self.last_reconciled_at
+        return bool(
+            self.env['l10n_cl_edi.certification.case.dte'].search_count([
+                ('parsed_set_id.certification_process_id', '=', self.id),
+                ('write_date', '>', since),
+            ], limit=1)
+            or self.env['account.move'].search_count([
+                ('l10n_cl_edi_certification_id', '=', self.id),
+                ('write_date', '>', since),
+            ], limit=1)
+            or self.env['stock.picking'].search_count([
+                ('l10n_cl_edi_certification_id', '=', self.id),
+                ('write_date', '>', since),
+            ], limit=1)
+        )
+
+    def _reconcile(self):
+        """
+        Servicio de conciliación: recupera relaciones perdidas, sincroniza los casos DTE
+        y verifica el estado del proceso, registrando la fecha de conciliación.
+        """
+        self.ensure_one()
+        process = self.with_context(l10n_cl_edi_reconciling=True)
+        process._recover_lost_relationships()
+        process._sync_all_dte_cases()
+        process.check_certification_status()
+        process.write({
+            'reconcile_dirty': False,
+            'last_reconciled_at': fields.Datetime.now(),
+        })
+        _logger.info(f"Proceso {self.id} conciliado, estado: {self.state}")
+
+    def _reconcile_if_needed(self):
+        """Conciliar solo si hubo cambios (nunca falla la carga de la vista)"""
+        if self.env.context.get('l10n_cl_edi_reconciling'):
+            return
+        for record in self:
             try:
-                self._sync_all_dte_cases()
-                self.check_certification_status()
-                _logger.info(f"Estado sincronizado automáticamente para proceso {self.id}")
+                if record._needs_reconcile():
+                    record._reconcile()
             except Exception as e:
-                _logger.warning(f"Error en sincronización automática: {str(e)}")
-        
-        return result
+                _logger.warning(f"Error en conciliación automática del proceso {record.id}: {str(e)}")
 
     def _sync_all_dte_cases(self):
         """
@@ -603,13 +739,13 @@ class CertificationProcess(models.Model):
     def _compute_cafs_status(self):
         """
         Computes and updates the CAFs (Folio Authorization Codes) status for each certification process record.
-        This method determines which document types require CAFs based on related DTE (Electronic Tax Document) cases.
-        If no DTE cases are found, it falls back to a default set of document types. For each required document type,
-        it checks if there is at least one CAF in 'in_use' status for the company. The method then updates the
-        `cafs_status` and `cafs_status_color` fields on the record to reflect whether all required CAFs are available.
+        Required document types come from the related DTE cases (or a default set if there are none). CAF
+        availability and folio capacity are read with a single grouped query per model, and document type
+        names come from a cached code→name map, so the form costs a constant number of queries.
         Fields updated:
             - cafs_status (str): A string indicating the number of available CAFs versus required, with an emoji.
             - cafs_status_color (str): A CSS class for coloring the status text ('text-success' or 'text-danger').
+            - cafs_remaining_folios (str): Remaining folios in 'in_use' CAFs per required document type.
         """
         for record in self:
             # Obtener tipos de documento requeridos desde los casos DTE
@@ -617,59 +753,32 @@ class CertificationProcess(models.Model):
             
             if record.parsed_set_ids:
                 # Extraer tipos únicos de todos los casos DTE
-                dte_cases = self.env['l10n_cl_edi.certification.case.dte'].search([
-                    ('parsed_set_id.certification_process_id', '=', record.id)
-                ])
-                
-                if dte_cases:
-                    required_doc_types = list(set([
-                        case.document_type_code for case in dte_cases 
-                        if case.document_type_code
-                    ]))
+                required_doc_types = sorted(
+                    code for (code,) in self.env['l10n_cl_edi.certification.case.dte']._read_group([
+                        ('parsed_set_id.certification_process_id', '=', record.id),
+                        ('document_type_code', '!=', False),
+                    ], ['document_type_code'])
+                )
             
             # Si no hay casos DTE, usar tipos por defecto
             if not required_doc_types:
                 required_doc_types = ['33', '61', '56', '52']
             
-            # Verificar CAFs disponibles
-            available_count = 0
-            for doc_type in required_doc_types:
-                if self.env['l10n_cl.dte.caf'].search_count([
-                    ('company_id', '=', record.company_id.id),
-                    ('l10n_latam_document_type_id.code', '=', doc_type),
-                    ('status', '=', 'in_use')
-                ]) > 0:
-                    available_count += 1
+            caf_summary = record._get_caf_summary(required_doc_types)
+            doc_type_names = record._get_document_type_names()
             
-            total_required = len(required_doc_types)
-            
-            # Generar texto del estado
-            if available_count == total_required:
-                record.cafs_status = f"✅ {available_count}/{total_required} Completo"
-                record.cafs_status_color = 'text-success'
-            else:
-                record.cafs_status = f"❌ {available_count}/{total_required} Faltan CAFs"
-                record.cafs_status_color = 'text-danger'
-
             # Crear detalles por tipo
-            caf_details = []
             missing_types = []
-            
+            remaining_details = []
             for doc_type in required_doc_types:
-                # Buscar el nombre del tipo de documento
-                doc_type_name = record._get_document_type_name(doc_type)
-                
-                if self.env['l10n_cl.dte.caf'].search_count([
-                    ('company_id', '=', record.company_id.id),
-                    ('l10n_latam_document_type_id.code', '=', doc_type),
-                    ('status', '=', 'in_use')
-                ]) > 0:
-                    caf_details.append(f"✅ {doc_type_name}")
-                else:
-                    caf_details.append(f"❌ {doc_type_name}")
+                doc_type_name = doc_type_names.get(doc_type, doc_type)
+                type_summary = caf_summary.get(doc_type, {})
+                if not type_summary.get('in_use_count'):
                     missing_types.append(doc_type_name)
+                remaining_details.append(f"{doc_type}: {type_summary.get('remaining', 0)}")
             
             # Generar resumen y detalles
+            total_required = len(required_doc_types)
             available_count = total_required - len(missing_types)
             
             if missing_types:
@@ -680,18 +789,70 @@ class CertificationProcess(models.Model):
                 record.cafs_status_color = 'text-success'
             
             record.cafs_status = summary
+            record.cafs_remaining_folios = ' | '.join(remaining_details)
+
+    def _get_caf_summary(self, doc_type_codes):
+        """
+        Resumen de CAFs por tipo de documento con una consulta agrupada sobre l10n_cl.dte.caf
+        y otra sobre los documentos emitidos.
+
+        Los folios restantes se estiman como la capacidad de los CAFs en uso menos los
+        documentos emitidos que exceden la capacidad de los CAFs ya agotados.
+
+        Returns:
+            dict: {código: {'in_use_count': int, 'remaining': int}}
+        """
+        self.ensure_one()
+        summary = {code: {'in_use_count': 0, 'in_use_capacity': 0, 'spent_capacity': 0, 'issued': 0}
+                   for code in doc_type_codes}
+
+        caf_groups = self.env['l10n_cl.dte.caf']._read_group([
+            ('company_id', '=', self.company_id.id),
+            ('l10n_latam_document_type_id.code', 'in', doc_type_codes),
+        ], ['l10n_latam_document_type_id', 'status'], ['__count', 'start_nb:sum', 'final_nb:sum'])
+        for doc_type, status, count, start_sum, final_sum in caf_groups:
+            type_summary = summary.get(doc_type.code)
+            if type_summary is None:
+                continue
+            capacity = (final_sum or 0) - (start_sum or 0) + count
+            if status == 'in_use':
+                type_summary['in_use_count'] += count
+                type_summary['in_use_capacity'] += capacity
+            else:
+                type_summary['spent_capacity'] += capacity
+
+        issued_groups = self.env['account.move']._read_group([
+            ('company_id', '=', self.company_id.id),
+            ('state', '=', 'posted'),
+            ('l10n_latam_document_type_id.code', 'in', doc_type_codes),
+            ('l10n_latam_document_number', '!=', False),
+        ], ['l10n_latam_document_type_id'], ['__count'])
+        for doc_type, count in issued_groups:
+            if doc_type.code in summary:
+                summary[doc_type.code]['issued'] += count
+
+        return {
+            code: {
+                'in_use_count': values['in_use_count'],
+                'remaining': max(0, values['in_use_capacity'] - max(0, values['issued'] - values['spent_capacity'])),
+            }
+            for code, values in summary.items()
+        }
+
+    @tools.ormcache('self.env.lang')
+    def _get_document_type_names(self):
+        """Mapa cacheado código → nombre legible de los tipos de documento chilenos."""
+        doc_types = self.env['l10n_latam.document.type'].search_read(
+            [('country_id.code', '=', 'CL'), ('code', '!=', False)], ['code', 'name'], order='id'
+        )
+        names = {}
+        for doc_type in doc_types:
+            names.setdefault(doc_type['code'], f"{doc_type['code']} ({doc_type['name']})")
+        return names
 
     def _get_document_type_name(self, code):
         """Obtiene el nombre legible del tipo de documento."""
-        doc_type = self.env['l10n_latam.document.type'].search([
-            ('code', '=', code),
-            ('country_id.code', '=', 'CL')
-        ], limit=1)
-        
-        if doc_type:
-            return f"{code} ({doc_type.name})"
-        else:
-            return code
+        return self._get_document_type_names().get(code, code)
     
     def action_prepare_certification(self):
         """Prepara la base de datos para el proceso de certificación"""
@@ -847,6 +1008,7 @@ class CertificationProcess(models.Model):
         
         # Ejecutar recuperación
         result = self._recover_lost_relationships()
+        self._mark_reconcile_dirty()
         
         # Mostrar resultado
         if result['recovered_count'] > 0:
@@ -877,7 +1039,7 @@ class CertificationProcess(models.Model):
             }
     
     def action_process_set_prueba_xml(self):
-        """Procesa el archivo XML de set de pruebas para crear las definiciones de los documentos."""
+        """Procesa el archivo de set de pruebas (XML convertido o TXT original del SII) para crear las definiciones de los documentos."""
         self.ensure_one()
         
         if not self.set_prueba_file:
@@ -886,60 +1048,91 @@ class CertificationProcess(models.Model):
         # Clear previous parsed data for this process to avoid duplicates if re-processing
         self.parsed_set_ids.unlink() 
 
-        try:
-            xml_content = base64.b64decode(self.set_prueba_file).decode('utf-8')
-            root = etree.fromstring(xml_content.encode('utf-8'))
-        except Exception as e:
-            _logger.error("Error parsing XML Set de Pruebas: %s", str(e))
-            raise UserError(_("Error al procesar el archivo XML: %s") % str(e))
+        file_content = base64.b64decode(self.set_prueba_file)
+
+        if self._is_set_prueba_text_file(file_content):
+            # Archivo de texto original del SII (SIISetDePruebas*.txt)
+            try:
+                parsed_sets = self._parse_set_prueba_text(file_content)
+            except Exception as e:
+                _logger.error("Error parsing TXT Set de Pruebas: %s", str(e))
+                raise UserError(_("Error al procesar el archivo de texto: %s") % str(e))
+        else:
+            try:
+                xml_content = file_content.decode('utf-8')
+                root = etree.fromstring(xml_content.encode('utf-8'))
+            except Exception as e:
+                _logger.error("Error parsing XML Set de Pruebas: %s", str(e))
+                raise UserError(_("Error al procesar el archivo XML: %s") % str(e))
+            parsed_sets = self._parse_set_prueba_xml(root)
 
-        parsed_set_model = self.env['l10n_cl_edi.certification.parsed_set']  # Actualizado
-        dte_case_model = self.env['l10n_cl_edi.certification.case.dte']  # Actualizado
-        item_model = self.env['l10n_cl_edi.certification.case.dte.item']  # Actualizado
-        ref_model = self.env['l10n_cl_edi.certification.case.dte.reference']  # Actualizado
-        purchase_entry_model = self.env['l10n_cl_edi.certification.purchase_book.entry']  # Actualizado
-        instructional_model = self.env['l10n_cl_edi.certification.instructional_set']  # Actualizado
+        if not parsed_sets:
+            raise UserError(_('No se encontraron sets de pruebas en el archivo'))
+        self._import_parsed_sets(parsed_sets)
 
+        self.check_certification_status()
+        
+        
+        # Retornar acción que recarga la vista actual
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'l10n_cl_edi.certification.process',
+            'view_mode': 'form',
+            'res_id': self.id,
+            'target': 'current',
+        }
+
+    def _parse_set_prueba_xml(self, root):
+        """
+        Convierte el XML de set de pruebas en una lista de estructuras de valores:
+        [{'vals': {...}, 'cases': [{'vals', 'items', 'references'}], 'purchase_entries': [...],
+          'instructional': [...]}]
+        Los ids de relaciones padre se completan al importar.
+        """
+        parsed_sets = []
         sequence = 10
         for set_node in root.findall('ParsedSet'):
-            set_vals = {
-                'certification_process_id': self.id,
-                'sequence': sequence,
-                'set_type_raw': set_node.get('set_type_raw'),
-                'set_type_normalized': set_node.get('set_type_normalized'),
-                'attention_number': set_node.get('attention_number'),
-                'raw_header_text': set_node.findtext('RawHeaderText')
+            parsed_set = {
+                'vals': {
+                    'certification_process_id': self.id,
+                    'sequence': sequence,
+                    'set_type_raw': set_node.get('set_type_raw'),
+                    'set_type_normalized': set_node.get('set_type_normalized'),
+                    'attention_number': set_node.get('attention_number'),
+                    'raw_header_text': set_node.findtext('RawHeaderText')
+                },
+                'cases': [],
+                'purchase_entries': [],
+                'instructional': [],
             }
-            parsed_set_rec = parsed_set_model.create(set_vals)
             sequence += 10
 
             # Process DTE Cases if they exist
             dte_cases_node = set_node.find('DTECases')
             if dte_cases_node is not None:
-                case_seq = 10
                 for case_node in dte_cases_node.findall('DTECase'):
-                    dte_case_vals = {
-                        'parsed_set_id': parsed_set_rec.id,
-                        'case_number_raw': case_node.get('case_number_raw'),
-                        'document_type_raw': case_node.get('document_type_raw'),
-                        'document_type_code': case_node.get('document_type_code'),
-                        'global_discount_percent': float(case_node.get('global_discount_percent', 0.0)),
-                        'dispatch_motive_raw': case_node.findtext('DispatchMotiveRaw'),
-                        'dispatch_transport_type_raw': case_node.findtext('DispatchTransportTypeRaw'),
-                        'export_reference_text': case_node.findtext('ExportReferenceText'),
-                        'export_currency_raw': case_node.findtext('ExportCurrencyRaw'),
-                        'raw_text_block': case_node.findtext('RawTextBlock'),
-                        'generation_status': 'pending'
+                    case = {
+                        'vals': {
+                            'case_number_raw': case_node.get('case_number_raw'),
+                            'document_type_raw': case_node.get('document_type_raw'),
+                            'document_type_code': case_node.get('document_type_code'),
+                            'global_discount_percent': float(case_node.get('global_discount_percent', 0.0)),
+                            'dispatch_motive_raw': case_node.findtext('DispatchMotiveRaw'),
+                            'dispatch_transport_type_raw': case_node.findtext('DispatchTransportTypeRaw'),
+                            'export_reference_text': case_node.findtext('ExportReferenceText'),
+                            'export_currency_raw': case_node.findtext('ExportCurrencyRaw'),
+                            'raw_text_block': case_node.findtext('RawTextBlock'),
+                            'generation_status': 'pending'
+                        },
+                        'items': [],
+                        'references': [],
                     }
-                    dte_case_rec = dte_case_model.create(dte_case_vals)
-                    case_seq += 10
 
                     item_seq = 10
                     items_node = case_node.find('Items')
                     if items_node is not None:
                         for item_node in items_node.findall('Item'):
-                            item_vals = {
-                                'case_dte_id': dte_case_rec.id,
+                            case['items'].append({
                                 'sequence': item_seq,
                                 'name': item_node.get('name'),
                                 'quantity': float(item_node.get('quantity', 1.0)),
@@ -947,31 +1140,29 @@ class CertificationProcess(models.Model):
                                 'price_unit': float(item_node.get('price_unit', 0.0)),
                                 'discount_percent': float(item_node.get('discount_percent', 0.0)),
                                 'is_exempt': item_node.get('is_exempt', 'false').lower() == 'true'
-                            }
-                            item_model.create(item_vals)
+                            })
                             item_seq += 10
-                    
+
                     ref_seq = 10
                     refs_node = case_node.find('References')
                     if refs_node is not None:
                         for ref_node in refs_node.findall('Reference'):
-                            ref_vals = {
-                                'case_dte_id': dte_case_rec.id,
+                            case['references'].append({
                                 'sequence': ref_seq,
                                 'reference_document_text_raw': ref_node.get('text_raw'),
                                 'referenced_sii_case_number': ref_node.get('sii_case_number'),
                                 'reason_raw': ref_node.get('reason_raw')
-                            }
-                            ref_model.create(ref_vals)
+                            })
                             ref_seq += 10
 
+                    parsed_set['cases'].append(case)
+
             # Process Purchase Book Entries if they exist
             purchase_entries_node = set_node.find('PurchaseBookEntries')
             if purchase_entries_node is not None:
                 entry_seq = 10
                 for entry_node in purchase_entries_node.findall('Entry'):
-                    pb_vals = {
-                        'parsed_set_id': parsed_set_rec.id,
+                    parsed_set['purchase_entries'].append({
                         'sequence': entry_seq,
                         'document_type_raw': entry_node.get('document_type_raw'),
                         'folio': entry_node.get('folio'),
@@ -979,107 +1170,143 @@ class CertificationProcess(models.Model):
                         'amount_exempt': float(entry_node.get('amount_exempt', 0.0)),
                         'amount_net_affected': float(entry_node.get('amount_net_affected', 0.0)),
                         'raw_text_lines': entry_node.findtext('RawTextLines')
-                    }
-                    purchase_entry_model.create(pb_vals)
+                    })
                     entry_seq += 10
-            
+
             # Process Instructional Content if it exists
             instructional_node = set_node.find('InstructionalContent')
             if instructional_node is not None:
-                instructional_model.create({
-                    'parsed_set_id': parsed_set_rec.id,
+                parsed_set['instructional'].append({
                     'instructions_text': instructional_node.findtext('InstructionsText'),
                     'general_observations': instructional_node.findtext('GeneralObservations')
                 })
 
-        self.check_certification_status()
-        
-        
-        # Retornar acción que recarga la vista actual
-        return {
-            'type': 'ir.actions.act_window',
-            'res_model': 'l10n_cl_edi.certification.process',
-            'view_mode': 'form',
-            'res_id': self.id,
-            'target': 'current',
+            parsed_sets.append(parsed_set)
+
+        return parsed_sets
+
+    def _is_set_prueba_text_file(self, file_content):
+        """El set de pruebas es texto SII si el nombre termina en .txt o el contenido no es XML"""
+        if self.set_prueba_filename and self.set_prueba_filename.lower().endswith('.txt'):
+            return True
+        return not file_content.lstrip().startswith(b'<')
+
+    def _parse_set_prueba_text(self, file_content):
+        """Convierte el texto SIISetDePruebas*.txt en la misma estructura que _parse_set_prueba_xml"""
+        parsed_sets = []
+        sequence = 10
+        for parsed_set in SetDePruebasTextParser().parse_bytes(file_content):
+            parsed_set['vals'].update({
+                'certification_process_id': self.id,
+                'sequence': sequence,
+            })
+            parsed_sets.append(parsed_set)
+            sequence += 10
+        return parsed_sets
+
+    def _import_parsed_sets(self, parsed_sets):
+        """
+        Crea los registros del set de pruebas con un create() por modelo.
+        Los padres se crean primero y sus ids se asignan a los valores de los hijos
+        por posición (create([...]) devuelve los registros en el mismo orden).
+        """
+        timings = {}
+        start = time.time()
+
+        # 1. Sets parseados
+        set_records = self.env['l10n_cl_edi.certification.parsed_set'].create(
+            [parsed_set['vals'] for parsed_set in parsed_sets])
+        timings['parsed_set'] = time.time() - start
+
+        # 2. Casos DTE (mapeo set → id) y contenido de los sets
+        case_vals_list, case_sources = [], []
+        entry_vals_list, instructional_vals_list = [], []
+        for parsed_set, set_record in zip(parsed_sets, set_records):
+            for case in parsed_set['cases']:
+                case_vals_list.append(dict(case['vals'], parsed_set_id=set_record.id))
+                case_sources.append(case)
+            entry_vals_list += [dict(vals, parsed_set_id=set_record.id) for vals in parsed_set['purchase_entries']]
+            instructional_vals_list += [dict(vals, parsed_set_id=set_record.id) for vals in parsed_set['instructional']]
+
+        step = time.time()
+        case_records = self.env['l10n_cl_edi.certification.case.dte'].create(case_vals_list)
+        timings['case.dte'] = time.time() - step
+
+        # 3. Ítems y referencias (mapeo caso → id)
+        item_vals_list, ref_vals_list = [], []
+        for case, case_record in zip(case_sources, case_records):
+            item_vals_list += [dict(vals, case_dte_id=case_record.id) for vals in case['items']]
+            ref_vals_list += [dict(vals, case_dte_id=case_record.id) for vals in case['references']]
+
+        for model_name, vals_list in [
+            ('l10n_cl_edi.certification.case.dte.item', item_vals_list),
+            ('l10n_cl_edi.certification.case.dte.reference', ref_vals_list),
+            ('l10n_cl_edi.certification.purchase_book.entry', entry_vals_list),
+            ('l10n_cl_edi.certification.instructional_set', instructional_vals_list),
+        ]:
+            step = time.time()
+            self.env[model_name].create(vals_list)
+            timings[model_name.replace('l10n_cl_edi.certification.', '')] = time.time() - step
+
+        counts = {
+            'parsed_set': len(set_records),
+            'case.dte': len(case_records),
+            'case.dte.item': len(item_vals_list),
+            'case.dte.reference': len(ref_vals_list),
+            'purchase_book.entry': len(entry_vals_list),
+            'instructional_set': len(instructional_vals_list),
         }
+        _logger.info(f"📥 Importación de set de pruebas completada en {time.time() - start:.3f}s")
+        for key, count in counts.items():
+            _logger.info(f"   {key}: {count} registros en {timings.get(key, 0.0):.3f}s")
+
+        return set_records
 
     def action_generate_dte_documents(self):
         """
-        Genera todos los documentos tributarios electrónicos pendientes.
-        Usa el nuevo flujo sale.order → invoice para evitar problemas con rating mixin.
+        Encola todos los casos DTE pendientes para que los workers de generación los procesen.
+        Los casos se toman de la cola de a uno (ver CertificationCaseDte._claim_next_queued_case),
+        por lo que varios workers generan casos independientes en paralelo, las notas esperan
+        a su documento referenciado (según el grafo de referencias) y una ejecución interrumpida
+        continúa con los casos restantes.
         """
         self.ensure_one()
         if self.state != 'generation':
             raise UserError(_("Primero debe completar la configuración inicial y cargar el set de pruebas."))
 
-        # Asegurar que estamos en estado adecuado
-        self.state = 'generation'
-        self.env.cr.commit()  # Guardar el cambio de estado
+        case_model = self.env['l10n_cl_edi.certification.case.dte']
+        process_domain = [('parsed_set_id.certification_process_id', '=', self.id)]
+        cases_to_generate = case_model.search(process_domain + [('generation_status', '=', 'pending')])
+        in_progress_count = case_model.search_count(process_domain + [('generation_status', 'in', ('queued', 'generating'))])
 
-        # Buscar casos pendientes
-        cases_to_generate = self.env['l10n_cl_edi.certification.case.dte'].search([
-            ('parsed_set_id.certification_process_id', '=', self.id),
-            ('generation_status', '=', 'pending')
-        ])
-        
-        if not cases_to_generate:
-            self.state = 'data_loaded'
+        if not cases_to_generate and not in_progress_count:
             raise UserError(_("No hay casos DTE pendientes de generación."))
 
-        # Generar documentos usando el nuevo generador
-        generated_count = 0
-        error_count = 0
-        
-        for dte_case in cases_to_generate:
-            try:
-                # Crear el generador
-                generator = self.env['l10n_cl_edi.certification.document.generator'].create({
-                    'dte_case_id': dte_case.id,
-                    'certification_process_id': self.id
-                })
-                
-                # Generar el documento usando el nuevo flujo
-                invoice = generator.generate_document()
-                generated_count += 1
-                _logger.info("Documento generado exitosamente para caso %s: %s", 
-                           dte_case.case_number_raw, invoice.name)
-                
-            except Exception as e:
-                # Error en la generación
-                _logger.error("Error generando DTE para caso %s: %s", dte_case.case_number_raw, str(e))
-                dte_case.write({
-                    'generation_status': 'error',
-                    'error_message': str(e)
-                })
-                error_count += 1
-                
-            # Commit por cada documento para preservar el progreso
-            self.env.cr.commit()
+        if cases_to_generate:
+            # Vincula las referencias y detecta ciclos o casos inexistentes antes de encolar
+            waves = cases_to_generate._get_generation_waves()
+            # Crear de una vez los productos que faltan, antes de que los workers compitan por crearlos
+            # (cada worker carga luego su propio mapa de productos, ver _cron_generate_queued_cases)
+            self.env['l10n_cl_edi.certification.document.generator']._prefetch_item_products(cases_to_generate)
+            cases_to_generate.write({
+                'generation_status': 'queued',
+                'generation_attempts': 0,
+                'error_message': False,
+            })
+            cases_to_generate._trigger_generation_crons()
+            _logger.info(f"📥 {len(cases_to_generate)} casos DTE en cola de generación para proceso {self.id} ({len(waves)} oleadas)")
+            message = _("%s casos DTE en cola de generación. Los documentos se generan en segundo plano.") % len(cases_to_generate)
+        else:
+            message = _("La generación ya está en curso: %s casos DTE en cola o generándose.") % in_progress_count
 
-        # Actualizar estado del proceso
-        self.check_certification_status()
-        
-        # Construir mensaje
-        message_parts = []
-        if generated_count > 0:
-            message_parts.append(_("%s DTEs generados exitosamente") % generated_count)
-        if error_count > 0:
-            message_parts.append(_("%s DTEs con error") % error_count)
-            
-        message = ". ".join(message_parts) + "."
-        
-        # Determinar tipo de notificación
-        notification_type = 'success' if error_count == 0 else 'warning'
-        
         return {
             'type': 'ir.actions.client',
             'tag': 'display_notification',
             'params': {
-                'title': _('Generación de DTEs Completada'),
+                'title': _('Generación de DTEs en Cola'),
                 'message': message,
-                'type': notification_type,
-                'sticky': True,
+                'type': 'info',
+                'sticky': False,
             }
         }
 
@@ -1369,7 +1596,8 @@ class CertificationProcess(models.Model):
 
     def action_check_certification_status(self):
         """Acción para verificar el estado desde la interfaz con notificaciones."""
-        self.check_certification_status()
+        self.ensure_one()
+        self._reconcile()
         
         # Retornar acción que recarga la vista actual
         return {
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+Parser del formato de texto entregado por el SII (SIISetDePruebas*.txt)
+
+Recorre el archivo línea a línea en una sola pasada y produce, por cada set,
+la misma estructura de valores que CertificationProcess._parse_set_prueba_xml:
+
+    {'vals': {...}, 'cases': [{'vals': {...}, 'items': [...], 'references': [...]}],
+     'purchase_entries': [...], 'instructional': [...]}
+"""
+import io
+import re
+
+SET_HEADER_RE = re.compile(r'^SET\s+(?P<type>.+?)\s+-\s+NUMERO DE ATENCI\S*N:\s*(?P<number>\d+)')
+CASE_HEADER_RE = re.compile(r'^CASO\s+(?P<number>\d+-\d+)\s*$')
+SEPARATOR_RE = re.compile(r'^-{40,}\s*$')
+UNDERLINE_RE = re.compile(r'^={10,}\s*$')
+COLUMN_SPLIT_RE = re.compile(r'\t+|\s{2,}')
+REFERENCED_CASE_RE = re.compile(r'CASO\s+(\d+-\d+)')
+PERCENT_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*%|%\s*(\d+(?:[.,]\d+)?)')
+
+# Tipos de documento (los más específicos primero)
+DOCUMENT_TYPE_CODES = [
+    ('NOTA DE CREDITO DE EXPORTACION', '112'),
+    ('NOTA DE DEBITO DE EXPORTACION', '111'),
+    ('FACTURA DE EXPORTACION', '110'),
+    ('FACTURA DE COMPRA', '46'),
+    ('FACTURA NO AFECTA O EXENTA', '34'),
+    ('FACTURA EXENTA', '34'),
+    ('NOTA DE CREDITO', '61'),
+    ('NOTA DE DEBITO', '56'),
+    ('GUIA DE DESPACHO', '52'),
+    ('FACTURA', '33'),
+]
+
+# Tipos de set (los más específicos primero)
+SET_TYPES = [
+    ('LIBRO DE VENTAS', 'sales_book'),
+    ('LIBRO DE GUIAS', 'guides_book'),
+    ('LIBRO DE COMPRAS', 'purchase_book'),
+    ('DOCUMENTOS DE EXPORTACION', 'export_documents'),
+    ('FACTURA DE COMPRA', 'purchase_invoice'),
+    ('GUIA DE DESPACHO', 'dispatch_guide'),
+    ('FACTURA EXENTA', 'exempt_invoice'),
+    ('BASICO', 'basic'),
+]
+INSTRUCTIONAL_SET_TYPES = ('sales_book', 'guides_book')
+
+# Etiquetas "CAMPO:  valor" de los casos de exportación
+EXPORT_LABELS = {
+    'MONEDA DE LA OPERACION': ('export_currency_raw',),
+    'FORMA DE PAGO EXPORTACION': ('export_payment_terms_raw',),
+    'MODALIDAD DE VENTA': ('export_sale_modality_raw',),
+    'CLAUSULA DE VENTA DE EXPORTACION': ('export_sale_clause_raw',),
+    'TOTAL CLAUSULA DE VENTA': ('export_total_sale_clause_amount',),
+    'VIA DE TRANSPORTE': ('export_transport_way_raw',),
+    'PUERTO DE EMBARQUE': ('export_loading_port_raw',),
+    'PUERTO DE DESEMBARQUE': ('export_unloading_port_raw',),
+    'UNIDAD DE MEDIDA DE TARA': ('export_tare_uom_raw',),
+    'UNIDAD PESO BRUTO': ('export_gross_weight_uom_raw',),
+    'UNIDAD PESO NETO': ('export_net_weight_uom_raw',),
+    'TIPO DE BULTO': ('export_package_type_raw',),
+    'TOTAL BULTOS': ('export_total_packages',),
+    'FLETE (**)': ('export_freight_amount',),
+    'SEGURO (**)': ('export_insurance_amount',),
+    'PAIS RECEPTOR Y PAIS DESTINO': ('export_recipient_country_raw', 'export_destination_country_raw'),
+    'NACIONALIDAD': ('export_client_nationality_raw',),
+}
+FLOAT_FIELDS = ('export_total_sale_clause_amount', 'export_freight_amount', 'export_insurance_amount')
+INTEGER_FIELDS = ('export_total_packages',)
+
+
+def _normalize(text):
+    """Mayúsculas y espacios simples para comparar etiquetas"""
+    return ' '.join(text.upper().split())
+
+
+def _to_float(value):
+    value = (value or '').strip().replace(',', '.')
+    return float(value) if value else 0.0
+
+
+def _percent(text):
+    match = PERCENT_RE.search(text)
+    if not match:
+        return 0.0
+    return _to_float(match.group(1) or match.group(2))
+
+
+def get_document_type_code(document_type_raw):
+    """Código SII para el nombre de documento del set"""
+    normalized = _normalize(document_type_raw)
+    for label, code in DOCUMENT_TYPE_CODES:
+        if label in normalized:
+            return code
+    return False
+
+
+def get_set_type_normalized(set_type_raw):
+    """Tipo de set normalizado para el encabezado 'SET ... - NUMERO DE ATENCION'"""
+    normalized = _normalize(set_type_raw)
+    for label, set_type in SET_TYPES:
+        if label in normalized:
+            return set_type
+    return 'unknown'
+
+
+def get_reference_code(reason_raw):
+    """Código de referencia SII a partir de la razón (1 anula, 2 corrige texto, 3 corrige monto)"""
+    reason = _normalize(reason_raw or '')
+    if reason.startswith('ANULA'):
+        return '1'
+    if 'CORRIGE' in reason and ('GIRO' in reason or 'TEXTO' in reason or 'DIRECCION' in reason):
+        return '2'
+    return '3'
+
+
+class SetDePruebasTextParser:
+    """Tokenizador en streaming del archivo de set de pruebas del SII"""
+
+    def __init__(self, encoding='ISO-8859-1'):
+        self.encoding = encoding
+
+    def parse_bytes(self, content):
+        """Parsear el contenido binario del archivo"""
+        return self.parse(io.TextIOWrapper(io.BytesIO(content), encoding=self.encoding, newline=None))
+
+    def parse(self, lines):
+        """Generador: produce un set parseado por cada encabezado SET del archivo"""
+        current_set = None
+        current_case = None
+        for raw_line in lines:
+            line = raw_line.rstrip('\r\n')
+
+            header = SET_HEADER_RE.match(line.strip())
+            if header:
+                if current_set:
+                    yield self._finish_set(current_set, current_case)
+                current_set = self._start_set(line.strip(), header)
+                current_case = None
+                continue
+
+            if current_set is None:
+                # Indicaciones generales previas al primer set
+                continue
+
+            if SEPARATOR_RE.match(line):
+                current_case = self._finish_case(current_set, current_case)
+                current_set['after_separator'] = True
+                continue
+
+            case_header = CASE_HEADER_RE.match(line.strip())
+            if case_header:
+                self._finish_case(current_set, current_case)
+                current_case = self._start_case(line.strip(), case_header)
+                current_set['header_done'] = True
+                continue
+
+            if current_case is not None:
+                self._feed_case(current_case, line)
+            elif not current_set['after_separator']:
+                self._feed_set_body(current_set, line)
+
+        if current_set:
+            yield self._finish_set(current_set, current_case)
+
+    # ---------------------------------------------------------------- sets
+
+    def _start_set(self, line, header):
+        set_type_raw = header.group('type').strip()
+        return {
+            'vals': {
+                'set_type_raw': set_type_raw,
+                'set_type_normalized': get_set_type_normalized(set_type_raw),
+                'attention_number': header.group('number'),
+            },
+            'header_lines': [line],
+            'header_done': False,
+            'after_separator': False,
+            'body_lines': [],
+            'purchase_table': 0,
+            'purchase_lines': [],
+            'observations_lines': None,
+            'cases': [],
+            'purchase_entries': [],
+            'instructional': [],
+        }
+
+    def _feed_set_body(self, current_set, line):
+        """Líneas del set fuera de casos: cabecera, tabla de libro de compras o instrucciones"""
+        set_type = current_set['vals']['set_type_normalized']
+
+        if set_type == 'purchase_book':
+            if UNDERLINE_RE.match(line):
+                # 1ª línea abre la cabecera de columnas, 2ª abre las filas, 3ª cierra la tabla
+                current_set['purchase_table'] += 1
+                if current_set['purchase_table'] == 3:
+                    self._flush_purchase_entry(current_set)
+                return
+            if current_set['purchase_table'] == 2:
+                if line.strip():
+                    current_set['purchase_lines'].append(line)
+                else:
+                    self._flush_purchase_entry(current_set)
+                return
+            if current_set['purchase_table'] == 1:
+                return
+            if current_set['purchase_table'] == 3:
+                if _normalize(line) == 'OBSERVACIONES GENERALES':
+                    current_set['observations_lines'] = []
+                elif current_set['observations_lines'] is not None and not set(line.strip()) <= {'-'}:
+                    current_set['observations_lines'].append(line.rstrip())
+                return
+
+        if set_type in INSTRUCTIONAL_SET_TYPES:
+            current_set['body_lines'].append(line.rstrip())
+        elif not current_set['header_done']:
+            current_set['header_lines'].append(line.rstrip())
+
+    def _flush_purchase_entry(self, current_set):
+        entry_lines = current_set['purchase_lines']
+        current_set['purchase_lines'] = []
+        if not entry_lines:
+            return
+
+        type_and_folio = [token.strip() for token in COLUMN_SPLIT_RE.split(entry_lines[0].strip()) if token.strip()]
+        amounts = re.split(r'\t+', entry_lines[2].rstrip()) if len(entry_lines) > 2 else []
+        current_set['purchase_entries'].append({
+            'sequence': (len(current_set['purchase_entries']) + 1) * 10,
+            'document_type_raw': type_and_folio[0] if type_and_folio else False,
+            'folio': type_and_folio[-1] if len(type_and_folio) > 1 else False,
+            'observations_raw': entry_lines[1].strip() if len(entry_lines) > 1 else False,
+            'amount_exempt': _to_float(amounts[0]) if amounts else 0.0,
+            'amount_net_affected': _to_float(amounts[1]) if len(amounts) > 1 else 0.0,
+            'raw_text_lines': '\n'.join(entry_lines),
+        })
+
+    def _finish_set(self, current_set, current_case):
+        self._finish_case(current_set, current_case)
+        self._flush_purchase_entry(current_set)
+
+        set_type = current_set['vals']['set_type_normalized']
+        if set_type in INSTRUCTIONAL_SET_TYPES:
+            instructions = '\n'.join(current_set['body_lines']).strip()
+            if instructions:
+                current_set['instructional'].append({'instructions_text': instructions})
+        elif current_set['observations_lines']:
+            current_set['instructional'].append({
+                'general_observations': '\n'.join(current_set['observations_lines']).strip(),
+            })
+
+        vals = dict(current_set['vals'], raw_header_text='\n'.join(current_set['header_lines']).strip())
+        return {
+            'vals': vals,
+            'cases': current_set['cases'],
+            'purchase_entries': current_set['purchase_entries'],
+            'instructional': current_set['instructional'],
+        }
+
+    # --------------------------------------------------------------- casos
+
+    def _start_case(self, line, case_header):
+        return {
+            'vals': {
+                'case_number_raw': case_header.group('number'),
+                'generation_status': 'pending',
+            },
+            'lines': [line],
+            'columns': None,
+            'items': [],
+            'references': [],
+            'export_references': [],
+        }
+
+    def _feed_case(self, case, line):
+        case['lines'].append(line)
+        stripped = line.strip()
+
+        if not stripped or UNDERLINE_RE.match(stripped):
+            # Una línea vacía cierra la tabla de ítems
+            case['columns'] = None
+            return
+
+        if case['columns'] is not None:
+            self._add_item(case, stripped)
+            return
+
+        tokens = [token.strip() for token in COLUMN_SPLIT_RE.split(stripped) if token.strip()]
+        label = _normalize(tokens[0])
+        value = ' '.join(tokens[1:])
+
+        if label == 'ITEM':
+            case['columns'] = [_normalize(column) for column in tokens[1:]]
+        elif label == 'DOCUMENTO':
+            case['vals']['document_type_raw'] = value
+            case['vals']['document_type_code'] = get_document_type_code(value)
+        elif label == 'REFERENCIA':
+            referenced_case = REFERENCED_CASE_RE.search(value)
+            case['references'].append({
+                'sequence': (len(case['references']) + 1) * 10,
+                'reference_document_text_raw': value,
+                'referenced_sii_case_number': referenced_case.group(1) if referenced_case else False,
+            })
+        elif label == 'RAZON REFERENCIA':
+            if case['references']:
+                case['references'][-1]['reason_raw'] = value
+                case['references'][-1]['reference_code'] = get_reference_code(value)
+        elif label.startswith('DESCUENTO GLOBAL'):
+            case['vals']['global_discount_percent'] = _percent(stripped)
+        elif label.startswith('DESCUENTO LINEA'):
+            line_number = re.search(r'#\s*(\d+)', stripped)
+            index = int(line_number.group(1)) - 1 if line_number else 0
+            if 0 <= index < len(case['items']):
+                case['items'][index]['discount_percent'] = _percent(stripped.split(':', 1)[-1])
+        elif 'COMISIONES EN EL EXTRANJERO' in label or 'RECARGO EN LA LINEA' in label:
+            case['vals']['export_foreign_commission_percent'] = _percent(stripped)
+        elif label.endswith(':'):
+            self._add_labeled_value(case, label[:-1].strip(), value)
+
+    def _add_labeled_value(self, case, label, value):
+        if label == 'MOTIVO':
+            case['vals']['dispatch_motive_raw'] = value
+        elif label == 'TRASLADO POR':
+            case['vals']['dispatch_transport_type_raw'] = value
+        elif label == 'REFERENCIA':
+            case['export_references'].append(value)
+        elif label in EXPORT_LABELS:
+            for field_name in EXPORT_LABELS[label]:
+                if field_name in FLOAT_FIELDS:
+                    case['vals'][field_name] = _to_float(value)
+                elif field_name in INTEGER_FIELDS:
+                    case['vals'][field_name] = int(_to_float(value))
+                else:
+                    case['vals'][field_name] = value
+
+    def _add_item(self, case, line):
+        tokens = [token.strip() for token in COLUMN_SPLIT_RE.split(line) if token.strip()]
+        row = dict(zip(case['columns'], tokens[1:]))
+        name = tokens[0]
+
+        if 'VALOR LINEA' in row:
+            quantity, price_unit = 1.0, _to_float(row['VALOR LINEA'])
+        else:
+            quantity = _to_float(row.get('CANTIDAD')) if row.get('CANTIDAD') else 1.0
+            price_unit = _to_float(row.get('PRECIO UNITARIO'))
+
+        case['items'].append({
+            'sequence': (len(case['items']) + 1) * 10,
+            'name': name,
+            'quantity': quantity,
+            'uom_raw': row.get('UNIDAD MEDIDA') or False,
+            'price_unit': price_unit,
+            'discount_percent': _percent(row['DESCUENTO ITEM']) if row.get('DESCUENTO ITEM') else 0.0,
+            'is_exempt': 'EXENTO' in name.upper() or case['vals'].get('document_type_code') == '34',
+        })
+
+    def _finish_case(self, current_set, case):
+        if case is None:
+            return None
+
+        lines = case['lines']
+        while lines and not lines[-1].strip():
+            lines.pop()
+        case['vals']['raw_text_block'] = '\n'.join(lines)
+        if case['export_references']:
+            case['vals']['export_reference_text'] = ';'.join(case['export_references'])
+
+        current_set['cases'].append({
+            'vals': case['vals'],
+            'items': case['items'],
+            'references': case['references'],
+        })
+        return None
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+from odoo import models, _
+from odoo.exceptions import UserError
+from lxml import etree
+import logging
+import os
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docs')
+
+# Esquemas SII incluidos en el módulo: {clave: (carpeta en docs/, archivo XSD raíz)}
+SII_SCHEMAS = {
+    'envio_dte': ('schema_dte', 'EnvioDTE_v10.xsd'),
+    'dte': ('schema_dte', 'DTE_v10.xsd'),
+    'libro_cv': ('schema_iecv', 'LibroCV_v10.xsd'),
+    'libro_guia': ('schema_lgd', 'LibroGuia_v10.xsd'),
+    'envio_boleta': ('schema_envio_bol', 'EnvioBOLETA_v11.xsd'),
+    'libro_boleta': ('schema_libro_bol', 'LibroBOLETA_v10.xsd'),
+}
+
+# Carpeta donde buscar los XSD importados que no vienen junto al esquema raíz
+# (schema_lgd no incluye xmldsignature_v10.xsd)
+SHARED_SCHEMA_DIR = os.path.join(SCHEMA_DIR, 'schema_dte')
+
+XMLDSIG_SIGNATURE = '{http://www.w3.org/2000/09/xmldsig#}Signature'
+
+# Esquemas compilados por proceso: {clave: etree.XMLSchema}
+_COMPILED_SCHEMAS = {}
+_COMPILED_SCHEMAS_LOCK = threading.Lock()
+
+
+class _SharedSchemaResolver(etree.Resolver):
+    """Resuelve imports de XSD inexistentes junto al esquema desde la carpeta compartida"""
+
+    def resolve(self, url, public_id, context):
+        if url and not url.startswith(('http://', 'https://')) and not os.path.exists(url):
+            shared_path = os.path.join(SHARED_SCHEMA_DIR, os.path.basename(url))
+            if os.path.exists(shared_path):
+                return self.resolve_filename(shared_path, context)
+        return None
+
+
+class CertificationXsdValidator(models.AbstractModel):
+    """
+    Servicio de validación de XML contra los esquemas XSD del SII incluidos en docs/.
+
+    Cada esquema se compila una sola vez por proceso y se reutiliza en todas las
+    validaciones; la validación informa todas las violaciones de una sola pasada.
+    """
+    _name = 'l10n_cl_edi.certification.xsd.validator'
+    _description = 'Validador XSD de Documentos SII'
+
+    def _get_schema(self, schema_key):
+        """Esquema compilado para la clave dada (compilado la primera vez que se usa)"""
+        schema = _COMPILED_SCHEMAS.get(schema_key)
+        if schema is not None:
+            return schema
+
+        if schema_key not in SII_SCHEMAS:
+            raise UserError(_('Esquema XSD desconocido: %s') % schema_key)
+
+        with _COMPILED_SCHEMAS_LOCK:
+            schema = _COMPILED_SCHEMAS.get(schema_key)
+            if schema is None:
+                start = time.perf_counter()
+                folder, filename = SII_SCHEMAS[schema_key]
+                parser = etree.XMLParser()
+                parser.resolvers.add(_SharedSchemaResolver())
+                schema_doc = etree.parse(os.path.join(SCHEMA_DIR, folder, filename), parser)
+                schema = etree.XMLSchema(schema_doc)
+                _COMPILED_SCHEMAS[schema_key] = schema
+                _logger.info(f"📐 Esquema {filename} compilado en {(time.perf_counter() - start) * 1000:.1f} ms")
+        return schema
+
+    def _validate_xml(self, xml, schema_key, allow_unsigned=False):
+        """
+        Validar un XML contra un esquema SII.
+
+        Args:
+            xml: bytes, str, elemento lxml o archivo binario abierto (se parsea desde el archivo)
+            schema_key: clave de SII_SCHEMAS
+            allow_unsigned: ignorar la ausencia de ds:Signature (XML aún no firmado)
+
+        Returns:
+            list: violaciones encontradas como 'línea N: mensaje' (vacía si es válido)
+        """
+        if isinstance(xml, str):
+            xml = xml.encode('ISO-8859-1')
+        if isinstance(xml, bytes):
+            document = etree.fromstring(xml, etree.XMLParser(remove_blank_text=True))
+        elif hasattr(xml, 'read'):
+            document = etree.parse(xml, etree.XMLParser(remove_blank_text=True))
+        else:
+            document = xml
+
+        schema = self._get_schema(schema_key)
+        # El error_log es propio de cada objeto XMLSchema: serializar su uso entre hilos
+        with _COMPILED_SCHEMAS_LOCK:
+            schema.validate(document)
+            errors = list(schema.error_log)
+
+        violations = []
+        for error in errors:
+            if allow_unsigned and error.message.rstrip('.').endswith(f"Expected is ( {XMLDSIG_SIGNATURE} )"):
+                continue
+            violations.append(f"línea {error.line}: {error.message}")
+        return violations
+
+    def _get_validation_mode(self):
+        """Modo de validación (parámetro l10n_cl_edi_certification.xsd_validation): strict, warn u off"""
+        mode = self.env['ir.config_parameter'].sudo().get_param(
+            'l10n_cl_edi_certification.xsd_validation', 'warn')
+        if mode not in ('strict', 'warn', 'off'):
+            _logger.warning(f"Parámetro xsd_validation inválido: {mode}, usando 'warn'")
+            return 'warn'
+        return mode
+
+    def _check_xml(self, xml, schema_key, label=None, allow_unsigned=False):
+        """
+        Validar un XML contra un esquema SII informando todas las violaciones.
+
+        En modo 'strict' lanza UserError con las violaciones; en modo 'warn' (por defecto)
+        solo las registra en el log, ya que algunos esquemas incluidos son anteriores a
+        documentos que el SII acepta (p. ej. DTE de exportación 110-112).
+
+        Returns:
+            bool: True si el XML es válido (o la validación está desactivada)
+        """
+        mode = self._get_validation_mode()
+        if mode == 'off':
+            return True
+
+        start = time.perf_counter()
+        violations = self._validate_xml(xml, schema_key, allow_unsigned=allow_unsigned)
+        elapsed = (time.perf_counter() - start) * 1000
+        label = label or SII_SCHEMAS[schema_key][1]
+
+        if not violations:
+            _logger.info(f"✓ {label} válido según XSD ({elapsed:.1f} ms)")
+            return True
+
+        if mode == 'warn':
+            _logger.warning(f"⚠️ {label} no cumple el esquema XSD del SII ({len(violations)} errores, {elapsed:.1f} ms)")
+            for violation in violations:
+                _logger.warning(f"⚠️ {label}: {violation}")
+            return False
+
+        for violation in violations:
+            _logger.error(f"❌ {label}: {violation}")
+        shown = violations[:20]
+        if len(violations) > len(shown):
+            shown.append(_('... y %d errores más') % (len(violations) - len(shown)))
+        raise UserError(_('%s no cumple el esquema XSD del SII (%d errores):\n%s') % (
+            label, len(violations), '\n'.join(shown)))
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields
+
+
+class L10nClDteCaf(models.Model):
+    _inherit = 'l10n_cl.dte.caf'
+
+    # Contador de folios del asignador de certificación (ver certification_folio_allocator)
+    l10n_cl_edi_certification_next_folio = fields.Integer(
+        string='Siguiente Folio (Certificación)',
+        readonly=True,
+        copy=False,
+        help='Siguiente folio candidato que entregará el asignador de folios de certificación; '
+             'se avanza en la base de datos para que dos workers nunca obtengan el mismo folio'
+    )
@@ -216,6 +216,7 @@ class CertificationParsedSet(models.Model):
             
             # Aplicar cambios al caso
             if case_updates:
+                case_updates.update({'batch_fingerprint': False, 'batch_signed_dte': False})
                 case.write(case_updates)
         
         # Eliminar archivo batch existente si existe
@@ -254,8 +255,8 @@ class CertificationParsedSet(models.Model):
         }
     
     def action_regenerate_batch(self):
-        """Regenera el archivo batch existente"""
-        return self.action_generate_batch()
+        """Regenera el archivo batch existente, rehaciendo solo los casos modificados"""
+        return self.with_context(l10n_cl_edi_incremental_batch=True).action_generate_batch()
     
     def action_download_batch(self):
         """Descarga el archivo batch generado"""
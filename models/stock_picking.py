@@ -17,6 +17,8 @@ class StockPicking(models.Model):
     l10n_cl_edi_certification_case_id = fields.Many2one(
         'l10n_cl_edi.certification.case.dte',
         string='Caso DTE Certificación',
+        index=True,
+        copy=False,
         help='Caso DTE específico que genera esta guía de despacho'
     )
     